@@ -1,43 +1,149 @@
-from redis import Redis
-import fakeredis
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager
 from config import TestingConfig
+from .auth.token_cache import CachingJWTManager, TokenCache
+from .hashing import PasswordHasher, calibrate_rounds
+from .metrics import Metrics, REGISTRY
+from .pools import engine_options, pool_stats, redis_client, redis_node_name
+from .replicas import ReplicaRouter, RoutingSQLAlchemy, replica_binds
+from .startup import install_fork_guard, phase, record_phase
+
+record_phase('import', time.perf_counter() - _import_started)
 
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 bcrypt = Bcrypt()
-jwt = JWTManager()
+jwt = CachingJWTManager()
+hasher = PasswordHasher(bcrypt)
+metrics = Metrics()
 
 
 def create_app(config_class=TestingConfig):
     '''
     Binds all necessary objects to app instance, registers blueprints, configs from .env
     '''
+    with phase('create_app'):
+        app = _create_app(config_class)
+
+    # Safe to build in a gunicorn --preload master: workers never reuse inherited
+    # connections, and reset the rest from gunicorn's post_fork hook
+    install_fork_guard()
+    return app
+
+
+def _create_app(config_class):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    # Redis blocklist config with mock for testing and time to live
+    # Redis blocklist config with mock for testing and time to live. Clients
+    # connect on first command, so nothing is opened before workers fork.
     app.TTL = app.config['JWT_ACCESS_TOKEN_EXPIRES']
     
-    if config_class == TestingConfig:
+    if app.testing:
+        import fakeredis
         app.redis_blocklist = fakeredis.FakeStrictRedis()
+        # One fake server per node, as separate Redis instances would be
+        app.blocklist_nodes = {redis_node_name(url): fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+                               for url in app.config['REDIS_BLOCKLIST_URLS']}
     else:
-        app.redis_blocklist = Redis.from_url(app.config['REDIS_URL'])
+        app.redis_blocklist = redis_client(app.config)
+        app.blocklist_nodes = {redis_node_name(url): redis_client(app.config, url)
+                               for url in app.config['REDIS_BLOCKLIST_URLS']}
+
+    from .auth.blocklist import Blocklist
+    app.blocklist = Blocklist.from_config(app.redis_blocklist, app.config, app.blocklist_nodes)
+    if app.blocklist_nodes:
+        REGISTRY.gauge('blocklist_nodes', 'Sharded blocklist node state and command counts', ['node', 'stat'],
+                       collect=lambda: app.blocklist.store.stats())
+
+    from .auth.epochs import TokenEpochs
+    app.token_epochs = TokenEpochs(app.redis_blocklist,
+                                   cache_ttl=app.config['TOKEN_EPOCH_CACHE_SECONDS'],
+                                   cache_size=app.config['TOKEN_EPOCH_CACHE_SIZE'],
+                                   redis_ttl=app.config['TOKEN_EPOCH_REDIS_TTL'])
+
+    from .auth.throttle import LoginThrottle
+    app.login_throttle = (LoginThrottle.from_config(app.redis_blocklist, app.config)
+                          if app.config['LOGIN_THROTTLE_ENABLED'] else None)
+
+    from .auth.identity import IdentityCache
+    app.identity_cache = IdentityCache(app.config['IDENTITY_CACHE_SIZE'],
+                                       app.config['IDENTITY_CACHE_TTL'],
+                                       redis=app.redis_blocklist if app.config['IDENTITY_CACHE_REDIS'] else None,
+                                       broadcast=app.redis_blocklist if app.config['IDENTITY_CACHE_BROADCAST'] else None,
+                                       channel=app.config['IDENTITY_CACHE_CHANNEL'],
+                                       max_staleness=app.config['IDENTITY_CACHE_MAX_STALENESS'])
+    REGISTRY.gauge('identity_cache', 'Identity cache size and hit/miss counters', ['stat'],
+                   collect=lambda: {(stat,): value for stat, value in app.identity_cache.stats().items()})
+
+    # Verified claims per token digest, so repeat requests skip HMAC and JSON decoding
+    app.token_cache = (TokenCache(app.config['JWT_DECODE_CACHE_SIZE'])
+                       if app.config['JWT_DECODE_CACHE_SIZE'] else None)
+    if app.token_cache is not None:
+        REGISTRY.gauge('token_cache', 'Decoded token cache size and hit/miss counters', ['stat'],
+                       collect=lambda: {(stat,): value for stat, value in app.token_cache.stats().items()})
+
+    # Pick the bcrypt cost meeting the per-hash latency target on this machine
+    if app.config.get('BCRYPT_TARGET_MS'):
+        with phase('calibrate_bcrypt'):
+            app.config['BCRYPT_LOG_ROUNDS'] = calibrate_rounds(bcrypt, app.config['BCRYPT_TARGET_MS'] / 1000,
+                                                               app.config['BCRYPT_MIN_ROUNDS'],
+                                                               app.config['BCRYPT_MAX_ROUNDS'])
+
+    # Reads go to replicas when configured, except shortly after a user's writes
+    binds = replica_binds(app.config['SQLALCHEMY_REPLICA_URIS'])
+    app.config['SQLALCHEMY_BINDS'] = {**(app.config.get('SQLALCHEMY_BINDS') or {}), **binds}
+    app.replicas = ReplicaRouter(binds, app.redis_blocklist, app.config['REPLICA_STICKY_SECONDS'])
+
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS win over the computed pool settings
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app.config),
+                                               **(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})}
+    REGISTRY.gauge('pool_connections', 'Pooled database and Redis connections by state', ['pool', 'state'],
+                   collect=lambda: pool_stats(app))
 
     # Bind any packages here
     db.init_app(app)
     bcrypt.init_app(app)
+    hasher.init_app(app)
     jwt.init_app(app)
+    metrics.init_app(app)
+
+    # Register any blueprints here; Swagger UI and swagger.json only when docs are on
+    with phase('routes'):
+        from .auth.routes import auth
+        from .auth.validation import compile_validators
+        auth._doc = '/' if app.config['API_DOCS_ENABLED'] else False
+        auth.init_app(app, add_specs=app.config['API_DOCS_ENABLED'])
+        compile_validators()
+
+    # Sliding sessions: re-issue access cookies past half their TTL, unless the
+    # client uses the explicit /api/users/refresh endpoint instead
+    from .auth.refresh import RefreshCoalescer, refresh_expiring_jwt
+    if app.config['JWT_REFRESH_MODE'] == 'implicit':
+        app.refresh_coalescer = RefreshCoalescer(app.config['JWT_REFRESH_COALESCE_SIZE'],
+                                                 app.TTL.total_seconds())
+        app.after_request(refresh_expiring_jwt)
 
-    # Register any blueprints here
-    from .auth.routes import auth
-    auth.init_app(app)
+    # last_login/last_seen, written behind in batches
+    from .activity import ActivityBuffer, record_authenticated_request
+    app.activity = None
+    if app.config['ACTIVITY_TRACKING_ENABLED']:
+        app.activity = ActivityBuffer(lambda: db.get_engine(app), app.config['ACTIVITY_BUFFER_SIZE'],
+                                      app.config['ACTIVITY_FLUSH_INTERVAL'])
+        app.after_request(record_authenticated_request)
+        REGISTRY.gauge('activity_buffer_pending', 'Users with activity updates awaiting a flush',
+                       collect=lambda: {(): app.activity.pending()})
 
     # Add cli commands
-    from cli import test
+    from cli import test, import_users, export_users, blocklist_memory, add_user_columns, normalize_emails
     app.cli.add_command(test)
+    app.cli.add_command(import_users)
+    app.cli.add_command(export_users)
+    app.cli.add_command(blocklist_memory)
+    app.cli.add_command(add_user_columns)
+    app.cli.add_command(normalize_emails)
 
     return app
@@ -0,0 +1,218 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from flask_jwt_extended import get_jwt
+from sqlalchemy import bindparam, func, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from .metrics import REGISTRY, STAGE_SECONDS
+
+'''
+Write-behind tracking of users' last_login / last_seen timestamps
+'''
+
+logger = logging.getLogger(__name__)
+
+FLUSH_LAG = REGISTRY.histogram('activity_flush_lag_seconds',
+                               'Age of the oldest buffered activity update when it was flushed',
+                               buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+FLUSHED = REGISTRY.counter('activity_updates_flushed_total', 'User rows updated by activity flushes')
+DROPPED = REGISTRY.counter('activity_updates_dropped_total',
+                           'Activity updates dropped because the buffer was full')
+
+
+class ActivityBuffer:
+    '''
+    Per-worker buffer of the latest last_login/last_seen per public_id, written
+    to the user table in batches by a daemon thread every flush_interval
+    seconds (or when it fills up) and once more at interpreter exit. At most
+    maxsize users are buffered; updates for further users are dropped and
+    counted until the next flush. A flush_interval of 0 leaves flushing to
+    explicit flush() calls.
+    '''
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, engine_factory, maxsize, flush_interval):
+        self.engine_factory = engine_factory
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._exit_flush = False
+
+    def record(self, public_id, last_login=None, last_seen=None):
+        with self._lock:
+            entry = self._pending.get(public_id)
+            if entry is None:
+                if len(self._pending) >= self.maxsize:
+                    DROPPED.inc()
+                    self._wake.set()
+                    return
+                entry = self._pending[public_id] = [None, None]
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+
+            if last_login is not None and (entry[0] is None or last_login > entry[0]):
+                entry[0] = last_login
+            if last_seen is not None and (entry[1] is None or last_seen > entry[1]):
+                entry[1] = last_seen
+
+            full = len(self._pending) >= self.maxsize
+
+        if full:
+            self._wake.set()
+        self.start()
+
+    def start(self):
+        # Started on first use so the flusher always belongs to the serving process
+        if not self.flush_interval or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-flusher', daemon=True)
+                self._thread.start()
+                if not self._exit_flush:
+                    atexit.register(self.flush)
+                    self._exit_flush = True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except SQLAlchemyError:
+                logger.warning('Activity flush failed, will retry', exc_info=True)
+
+    def pending(self):
+        return len(self._pending)
+
+    def clear(self):
+        '''
+        Drops every buffered update without writing it
+        '''
+        with self._lock:
+            self._pending = {}
+            self._oldest = None
+
+    def _take(self):
+        '''
+        Empties the buffer, returning its rows in public_id order and the time
+        its oldest update was recorded
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            oldest, self._oldest = self._oldest, None
+
+        # In public_id order, so concurrent flushes from several workers lock
+        # the rows they share in the same order instead of deadlocking
+        rows = [{'b_public_id': public_id, 'b_last_login': last_login, 'b_last_seen': last_seen}
+                for public_id, (last_login, last_seen) in sorted(pending.items())]
+        return rows, oldest
+
+    def _restore(self, rows):
+        # Put a failed batch back unless newer updates have replaced it meanwhile
+        for row in rows:
+            self.record(row['b_public_id'], row['b_last_login'], row['b_last_seen'])
+
+    def _flushed(self, updated, oldest):
+        FLUSH_LAG.observe(time.monotonic() - oldest)
+        FLUSHED.inc(updated)
+        return updated
+
+    def _statements(self, dialect, rows):
+        '''
+        (statement, parameters) to execute for each batch of rows
+        '''
+        for start in range(0, len(rows), self.BATCH_SIZE):
+            batch = rows[start:start + self.BATCH_SIZE]
+            if dialect == 'postgresql':
+                yield _values_update(batch)
+            else:
+                yield _executemany_update(), batch
+
+    def flush(self):
+        '''
+        Writes every buffered update, returning the number of rows updated
+        '''
+        with self._flush_lock:
+            rows, oldest = self._take()
+            if not rows:
+                return 0
+
+            try:
+                with STAGE_SECONDS.time(stage='activity_flush'):
+                    updated = self._write(rows)
+            except Exception:
+                self._restore(rows)
+                raise
+            return self._flushed(updated, oldest)
+
+    def _write(self, rows):
+        engine = self.engine_factory()
+        updated = 0
+
+        with engine.begin() as conn:
+            for statement in self._statements(engine.dialect.name, rows):
+                updated += conn.execute(*statement).rowcount
+        return updated
+
+
+def _values_update(rows):
+    '''
+    One UPDATE ... FROM (VALUES ...) statement for a batch of rows on Postgres
+    '''
+    values, params = [], {}
+    for i, row in enumerate(rows):
+        values.append(f'(:p{i}, CAST(:l{i} AS TIMESTAMPTZ), CAST(:s{i} AS TIMESTAMPTZ))')
+        params.update({f'p{i}': row['b_public_id'], f'l{i}': row['b_last_login'], f's{i}': row['b_last_seen']})
+
+    return text(f'''
+        UPDATE "user" SET last_login = COALESCE(v.last_login, "user".last_login),
+                          last_seen = COALESCE(v.last_seen, "user".last_seen)
+        FROM (VALUES {', '.join(values)}) AS v (public_id, last_login, last_seen)
+        WHERE "user".public_id = v.public_id
+    '''), params
+
+
+def _executemany_update():
+    from .models import User
+    users = User.__table__
+    return (update(users)
+            .where(users.c.public_id == bindparam('b_public_id'))
+            .values(last_login=func.coalesce(bindparam('b_last_login', type_=users.c.last_login.type),
+                                             users.c.last_login),
+                    last_seen=func.coalesce(bindparam('b_last_seen', type_=users.c.last_seen.type),
+                                            users.c.last_seen)))
+
+
+def record_login(user):
+    now = datetime.now(timezone.utc)
+    if current_app.activity is not None:
+        current_app.activity.record(user.public_id, last_login=now, last_seen=now)
+
+
+def record_authenticated_request(response):
+    '''
+    Buffers last_seen for the identity of every request that verified a JWT
+    '''
+    if current_app.activity is None or response.status_code >= 400:
+        return response
+
+    try:
+        identity = get_jwt().get('sub')
+    except RuntimeError:
+        # Unprotected route, nothing was verified
+        return response
+
+    if identity:
+        current_app.activity.record(identity, last_seen=datetime.now(timezone.utc))
+    return response
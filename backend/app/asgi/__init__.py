@@ -0,0 +1,140 @@
+import asyncio
+from flask import Config
+from redis import Redis
+from redis import asyncio as aioredis
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from config import TestingConfig
+from .. import bcrypt
+from ..hashing import AsyncPasswordHasher, HasherBusy, calibrate_rounds
+
+'''
+Async (ASGI) serving mode for the auth API: the same /api/users/* routes on
+an event loop, with an async Redis client, an async database driver and
+bcrypt in an executor, so waiting on I/O does not pin a worker.
+Served with e.g. `uvicorn asgi:app`.
+'''
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg',
+                 'sqlite': 'sqlite+aiosqlite'
+                 }
+
+
+def async_database_uri(uri):
+    '''
+    Maps a SQLALCHEMY_DATABASE_URI to the same database through its async driver
+    '''
+    url = make_url(uri.replace('postgres://', 'postgresql://', 1))
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend!r} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_engine(config):
+    url = async_database_uri(config.get('ASYNC_DATABASE_URI') or config['SQLALCHEMY_DATABASE_URI'])
+
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory sqlite only exists on its one connection
+        return create_async_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+    return create_async_engine(url)
+
+
+async def handle_auth_error(request, error):
+    return JSONResponse({'msg': error.msg}, error.status_code)
+
+
+async def handle_payload_error(request, error):
+    return JSONResponse(error.body, 400)
+
+
+async def handle_hasher_busy(request, error):
+    return JSONResponse({'success': False,
+                         'msg': 'Server busy, please try again shortly.'
+                         }, 503, {'Retry-After': '1'})
+
+
+def create_asgi_app(config_class=TestingConfig):
+    '''
+    Builds the Starlette app from the same config classes as create_app
+    '''
+    config = Config('.')
+    config.from_object(config_class)
+    if config['REDIS_BLOCKLIST_URLS']:
+        # Revocations here go to REDIS_URL only, so they would miss the sharded blocklist
+        raise ValueError('The ASGI app does not support a sharded blocklist; unset REDIS_BLOCKLIST_URLS')
+
+    from ..auth.refresh import RefreshCoalescer
+    from ..auth.throttle import LoginThrottle
+    from .activity import AsyncActivityBuffer
+    from .revocation import AsyncReplicaStickiness, AsyncRevocation
+    from .routes import PayloadError, routes
+    from .tokens import AuthError, TokenCookies
+
+    # Pick the bcrypt cost meeting the per-hash latency target on this machine
+    if config.get('BCRYPT_TARGET_MS'):
+        config['BCRYPT_LOG_ROUNDS'] = calibrate_rounds(bcrypt, config['BCRYPT_TARGET_MS'] / 1000,
+                                                       config['BCRYPT_MIN_ROUNDS'],
+                                                       config['BCRYPT_MAX_ROUNDS'])
+
+    app = Starlette(routes=routes,
+                    exception_handlers={AuthError: handle_auth_error,
+                                        PayloadError: handle_payload_error,
+                                        HasherBusy: handle_hasher_busy})
+    state = app.state
+    state.config = config
+
+    if config['TESTING']:
+        import fakeredis
+        import fakeredis.aioredis
+        state.redis = fakeredis.aioredis.FakeRedis()
+        throttle_redis = fakeredis.FakeStrictRedis()
+    else:
+        state.redis = aioredis.Redis.from_url(config['REDIS_URL'])
+        throttle_redis = Redis.from_url(config['REDIS_URL'])
+
+    state.engine = create_engine(config)
+    state.hasher = AsyncPasswordHasher.from_config(config)
+    state.tokens = TokenCookies(config)
+    state.revocation = AsyncRevocation(state.redis, state.engine, config)
+    state.replicas = AsyncReplicaStickiness(state.redis, config)
+
+    # last_login/last_seen, written behind in batches by a task on the event loop
+    state.activity = None
+    state.activity_task = None
+    if config['ACTIVITY_TRACKING_ENABLED']:
+        state.activity = AsyncActivityBuffer(state.engine, config['ACTIVITY_BUFFER_SIZE'],
+                                             config['ACTIVITY_FLUSH_INTERVAL'])
+
+    # The throttle stays on the sync client in a thread; only logins pay for it
+    state.login_throttle = (LoginThrottle.from_config(throttle_redis, config)
+                            if config['LOGIN_THROTTLE_ENABLED'] else None)
+
+    state.refresh_coalescer = None
+    if config['JWT_REFRESH_MODE'] == 'implicit':
+        state.refresh_coalescer = RefreshCoalescer(config['JWT_REFRESH_COALESCE_SIZE'],
+                                                   config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())
+
+    @app.on_event('startup')
+    async def start_activity_flusher():
+        if state.activity is not None and state.activity.flush_interval:
+            state.activity_task = asyncio.create_task(state.activity.run())
+
+    @app.on_event('shutdown')
+    async def close_connections():
+        if state.activity_task is not None:
+            state.activity_task.cancel()
+            try:
+                await state.activity_task
+            except asyncio.CancelledError:
+                pass
+        elif state.activity is not None:
+            await state.activity.flush()
+        await state.engine.dispose()
+        await state.redis.close()
+        state.hasher.shutdown()
+
+    return app
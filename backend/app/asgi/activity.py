@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from sqlalchemy.exc import SQLAlchemyError
+from ..activity import ActivityBuffer
+from ..metrics import STAGE_SECONDS
+
+'''
+Write-behind last_login / last_seen tracking for the ASGI app, flushed on the
+event loop through the async engine
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncActivityBuffer(ActivityBuffer):
+    '''
+    ActivityBuffer whose flushes run as a task on the app's event loop over the
+    async engine, instead of in a daemon thread. run() is started with the app
+    and flushes once more when cancelled at shutdown.
+    '''
+
+    def __init__(self, engine, maxsize, flush_interval):
+        super().__init__(None, maxsize, flush_interval)
+        self.engine = engine
+        self._async_flush_lock = asyncio.Lock()
+
+    def start(self):
+        # The flusher is the task running run(), started with the app
+        pass
+
+    async def run(self):
+        flushed_at = time.monotonic()
+        try:
+            while True:
+                # record() signals a full buffer through a threading.Event, so poll it
+                await asyncio.sleep(min(self.flush_interval, 0.25))
+                if not self._wake.is_set() and time.monotonic() - flushed_at < self.flush_interval:
+                    continue
+
+                self._wake.clear()
+                flushed_at = time.monotonic()
+                try:
+                    await self.flush()
+                except SQLAlchemyError:
+                    logger.warning('Activity flush failed, will retry', exc_info=True)
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+    async def flush(self):
+        '''
+        Writes every buffered update, returning the number of rows updated
+        '''
+        async with self._async_flush_lock:
+            rows, oldest = self._take()
+            if not rows:
+                return 0
+
+            try:
+                with STAGE_SECONDS.time(stage='activity_flush'):
+                    updated = 0
+                    async with self.engine.begin() as conn:
+                        for statement in self._statements(conn.dialect.name, rows):
+                            updated += (await conn.execute(*statement)).rowcount
+            except Exception:
+                self._restore(rows)
+                raise
+            return self._flushed(updated, oldest)
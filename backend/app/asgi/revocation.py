@@ -0,0 +1,132 @@
+import logging
+from redis.exceptions import RedisError
+from sqlalchemy import select, update
+from ..auth.blocklist import BucketStore, KeyStore
+from ..auth.epochs import TokenEpochs
+from ..auth.identity import IdentityCache
+from ..models import User
+from ..replicas import ReplicaRouter
+
+'''
+Async counterparts of the blocklist, token epoch, identity cache and replica
+stickiness writes, sharing their Redis keys with the WSGI app so both can
+serve the same users
+'''
+
+logger = logging.getLogger(__name__)
+
+users = User.__table__
+
+
+class AsyncRevocation:
+    '''
+    Checks and records token revocations in JWT_REVOCATION_MODE ('blocklist'
+    or 'epoch') over an async Redis client. Revocations are published to the
+    WSGI workers' revocation caches when those are enabled.
+    '''
+
+    def __init__(self, redis, engine, config):
+        self.redis = redis
+        self.engine = engine
+        self.mode = config['JWT_REVOCATION_MODE']
+        self.ttl = config['JWT_ACCESS_TOKEN_EXPIRES']
+        self.epoch_ttl = config['TOKEN_EPOCH_REDIS_TTL']
+        self.channel = config['REVOCATION_CACHE_CHANNEL'] if config.get('REVOCATION_CACHE_ENABLED') else None
+        self.identity_redis = config.get('IDENTITY_CACHE_REDIS', False)
+        self.identity_channel = config['IDENTITY_CACHE_CHANNEL'] if config.get('IDENTITY_CACHE_BROADCAST') else None
+        # Only used for its key layout; the sync client it would wrap is not needed
+        self.buckets = (BucketStore(None, config['JWT_BLOCKLIST_BUCKET_SHARDS'])
+                        if config.get('JWT_BLOCKLIST_BACKEND', 'keys') == 'buckets' else None)
+        self.keys = KeyStore(None, self.ttl, config.get('JWT_BLOCKLIST_LEGACY_KEYS', False))
+
+    def _epoch_key(self, public_id):
+        return f'{TokenEpochs.KEY_PREFIX}{public_id}'
+
+    async def claims_for(self, public_id):
+        '''
+        Extra claims for a new token of the user, as add_token_claims does
+        '''
+        if self.mode == 'epoch':
+            return {'epoch': await self.current_epoch(public_id)}
+        return {}
+
+    async def current_epoch(self, public_id):
+        stored = await self.redis.get(self._epoch_key(public_id))
+        if stored is not None:
+            return int(stored)
+
+        # Redis lost the key (restart, eviction): the User row is the fallback
+        async with self.engine.connect() as conn:
+            epoch = (await conn.execute(select(users.c.token_epoch)
+                                        .where(users.c.public_id == public_id))).scalar() or 0
+        await self.redis.set(self._epoch_key(public_id), epoch, ex=self.epoch_ttl, nx=True)
+        return epoch
+
+    async def is_revoked(self, claims):
+        if self.mode == 'epoch':
+            return claims.get('epoch', 0) < await self.current_epoch(claims['sub'])
+
+        if self.buckets is not None:
+            return bool(await self.redis.hexists(self.buckets.key(claims['jti'], claims['exp']),
+                                                 self.buckets.field(claims['jti'])))
+        return any(value is not None for value in await self.redis.mget(self.keys.keys(claims['jti'])))
+
+    async def revoke(self, claims):
+        if self.buckets is not None:
+            key = self.buckets.key(claims['jti'], claims['exp'])
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, self.buckets.field(claims['jti']), '')
+                pipe.expireat(key, self.buckets.expires_at(claims['exp']))
+                await pipe.execute()
+        else:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in self.keys.keys(claims['jti']):
+                    pipe.setex(key, self.ttl, '')
+                await pipe.execute()
+        if self.channel is not None:
+            await self.redis.publish(self.channel, claims['jti'])
+
+    async def revoke_user(self, conn, user_id, public_id):
+        '''
+        Bumps the user's token epoch inside the caller's transaction
+        '''
+        await conn.execute(update(users).where(users.c.id == user_id)
+                           .values(token_epoch=users.c.token_epoch + 1))
+        epoch = (await conn.execute(select(users.c.token_epoch).where(users.c.id == user_id))).scalar()
+        await self.redis.set(self._epoch_key(public_id), epoch, ex=self.epoch_ttl)
+        return epoch
+
+    async def invalidate_identity(self, *public_ids):
+        '''
+        Drops Redis-shared identity snapshots of changed users and tells the
+        WSGI workers to drop their local copies
+        '''
+        if self.identity_redis and public_ids:
+            await self.redis.delete(*(f'{IdentityCache.KEY_PREFIX}{public_id}' for public_id in public_ids))
+        if self.identity_channel is not None and public_ids:
+            await self.redis.publish(self.identity_channel, ','.join(public_ids))
+
+
+class AsyncReplicaStickiness:
+    '''
+    Marks users written here sticky for REPLICA_STICKY_SECONDS, as User writes
+    do in the WSGI app, so its workers read them from the primary until the
+    replicas have caught up. The ASGI app itself only reads the primary.
+    '''
+
+    def __init__(self, redis, config):
+        self.redis = redis
+        self.enabled = bool(config['SQLALCHEMY_REPLICA_URIS'])
+        self.sticky_ms = max(1, int(config['REPLICA_STICKY_SECONDS'] * 1000))
+
+    async def stick(self, *keys):
+        if not self.enabled or not keys:
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(f'{ReplicaRouter.KEY_PREFIX}{key}', 1, px=self.sticky_ms)
+                await pipe.execute()
+        except RedisError:
+            logger.warning('Could not record replica stickiness', exc_info=True)
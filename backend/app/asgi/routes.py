@@ -0,0 +1,256 @@
+import json
+import math
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from ..auth.routes import signup_user_model, login_user_model, update_user_model
+from ..auth.throttle import client_address
+from ..auth.validation import payload_errors
+from ..hashing import HasherBusy, hash_rounds
+from ..models import User, UNUSABLE_PASSWORD, normalize_email
+from .tokens import jwt_required
+
+'''
+Async handlers for the /api/users/* routes, answering as the flask-restx
+resources in app.auth.routes do
+'''
+
+users = User.__table__
+
+
+class PayloadError(Exception):
+    '''
+    Raised for a body that is not JSON or fails the route's model
+    '''
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.body = {'message': message}
+        if errors:
+            self.body['errors'] = errors
+
+
+async def _payload(request, model, partial=False):
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        raise PayloadError('Failed to decode JSON object')
+
+    errors = payload_errors(model, data, partial)
+    if errors:
+        raise PayloadError('Input payload validation failed', errors)
+    return data
+
+
+def _user_json(user):
+    return {'_id': user['id'],
+            'username': user['username'],
+            'email': user['email']
+            }
+
+
+async def _get_user(conn, public_id):
+    return (await conn.execute(select(users).where(users.c.public_id == public_id))).first()
+
+
+def _insert_if_absent(dialect, values):
+    insert_stmt = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    return insert_stmt(users).values(**values).on_conflict_do_nothing()
+
+
+async def signup(request):
+    '''
+    Creates a new user unless the email is taken; see User.register
+    '''
+    state = request.app.state
+    request_data = await _payload(request, signup_user_model)
+    _username = request_data.get('username')
+    _email = request_data.get('email')
+
+    public_id = str(uuid.uuid4())
+    async with state.engine.begin() as conn:
+        result = await conn.execute(_insert_if_absent(conn.dialect.name,
+                                                      {'public_id': public_id,
+                                                       'username': _username,
+                                                       'email': _email,
+                                                       'email_normalized': normalize_email(_email),
+                                                       'password': UNUSABLE_PASSWORD
+                                                       }))
+        if result.rowcount != 1:
+            return JSONResponse({'success': False,
+                                 'msg': 'User already exists!'
+                                 }, 202)
+
+        password_hash = await state.hasher.generate_password_hash(request_data.get('password'))
+        await conn.execute(update(users)
+                           .where(users.c.email_normalized == normalize_email(_email))
+                           .values(password=password_hash))
+    await state.replicas.stick(public_id, normalize_email(_email))
+
+    return JSONResponse({'success': True,
+                         'msg': 'Successfully registered.',
+                         'user': _username,
+                         }, 201)
+
+
+async def login(request):
+    '''
+    Logs the user in if passwords match, setting the access token cookie
+    '''
+    state = request.app.state
+    request_data = await _payload(request, login_user_model)
+    _email = request_data.get('email')
+    _password = request_data.get('password')
+
+    if state.login_throttle is not None:
+        client_ip = client_address(request.client.host if request.client else None,
+                                   request.headers.get('x-forwarded-for'), state.config['TRUSTED_PROXIES'])
+        retry_after = await run_in_threadpool(state.login_throttle.check, _email, client_ip)
+        if retry_after:
+            return JSONResponse({'success': False,
+                                 'msg': 'Too many login attempts, please try again later.'
+                                 }, 429, {'Retry-After': str(math.ceil(retry_after))})
+
+    async with state.engine.connect() as conn:
+        user = (await conn.execute(select(users).where(users.c.email_normalized == normalize_email(_email)))).first()
+
+    if not user:
+        return JSONResponse({'success': False,
+                             'msg': 'User not found'
+                             }, 401)
+
+    if not await state.hasher.check_password_hash(user.password, _password):
+        return JSONResponse({'success': False,
+                             'msg': 'Could not verify credentials'
+                             }, 403)
+
+    if hash_rounds(user.password) != state.hasher.rounds:
+        # Move the stored hash to the current cost while we have the plaintext
+        try:
+            password_hash = await state.hasher.generate_password_hash(_password)
+            async with state.engine.begin() as conn:
+                await conn.execute(update(users).where(users.c.id == user.id).values(password=password_hash))
+            await state.replicas.stick(user.public_id, user.email_normalized)
+        except HasherBusy:
+            pass
+
+    if state.activity is not None:
+        now = datetime.now(timezone.utc)
+        state.activity.record(user.public_id, last_login=now, last_seen=now)
+
+    response = JSONResponse({'success': True,
+                             'msg': 'Successfully logged in.',
+                             'user': _user_json(user._mapping)
+                             })
+
+    claims = await state.revocation.claims_for(user.public_id)
+    state.tokens.set_cookies(response, state.tokens.encode(user.public_id, claims=claims))
+    if state.config['JWT_REFRESH_MODE'] == 'explicit':
+        state.tokens.set_cookies(response, state.tokens.encode(user.public_id, 'refresh', claims=claims), 'refresh')
+
+    return response
+
+
+@jwt_required()
+async def update_user(request):
+    '''
+    Updates the username and/or email of the token's user
+    '''
+    state = request.app.state
+    request_data = await _payload(request, update_user_model, partial=True)
+    values = {key: request_data[key] for key in ('username', 'email') if request_data.get(key)}
+
+    async with state.engine.begin() as conn:
+        user = await _get_user(conn, request.state.jwt['sub'])
+
+        if not user:
+            return JSONResponse({'success': False,
+                                 'msg': 'User not found'
+                                 }, 401)
+
+        if values:
+            normalized = {'email_normalized': normalize_email(values['email'])} if 'email' in values else {}
+            await conn.execute(update(users).where(users.c.id == user.id).values(**values, **normalized))
+
+    await state.revocation.invalidate_identity(user.public_id)
+    if values:
+        await state.replicas.stick(user.public_id, user.email_normalized, *normalized.values())
+
+    return JSONResponse({'success': True,
+                         'msg': 'Successfully updated user.',
+                         'user': _user_json(dict(user._mapping, **values))
+                         })
+
+
+@jwt_required()
+async def logout_user(request):
+    '''
+    Logs the user out, blocklisting the token and rotating the public_id, or
+    in epoch mode revoking all of the user's tokens at once
+    '''
+    state = request.app.state
+    claims = request.state.jwt
+
+    async with state.engine.begin() as conn:
+        user = await _get_user(conn, claims['sub'])
+
+        if not user:
+            return JSONResponse({'success': False,
+                                 'msg': 'User not found'
+                                 }, 401)
+
+        public_id = user.public_id
+        if state.revocation.mode == 'epoch':
+            await state.revocation.revoke_user(conn, user.id, user.public_id)
+        else:
+            public_id = str(uuid.uuid4())
+            await conn.execute(update(users).where(users.c.id == user.id)
+                               .values(public_id=public_id))
+
+    if state.revocation.mode != 'epoch':
+        await state.revocation.revoke(claims)
+    await state.revocation.invalidate_identity(user.public_id)
+    await state.replicas.stick(*{user.public_id, public_id}, user.email_normalized)
+
+    response = JSONResponse({'success': True,
+                             'msg': 'Successfully logged out.',
+                             'user': user.username
+                             })
+    state.tokens.unset_cookies(response)
+    return response
+
+
+@jwt_required(refresh=True)
+async def refresh_token(request):
+    '''
+    Exchanges a refresh token cookie for a new access token cookie
+    '''
+    state = request.app.state
+
+    async with state.engine.connect() as conn:
+        user = await _get_user(conn, request.state.jwt['sub'])
+
+    if not user:
+        return JSONResponse({'success': False,
+                             'msg': 'User not found'
+                             }, 401)
+
+    response = JSONResponse({'success': True,
+                             'msg': 'Successfully refreshed token.',
+                             'user': user.username
+                             })
+    claims = await state.revocation.claims_for(user.public_id)
+    state.tokens.set_cookies(response, state.tokens.encode(user.public_id, claims=claims))
+    return response
+
+
+routes = [Route('/api/users/signup', signup, methods=['POST']),
+          Route('/api/users/login', login, methods=['POST']),
+          Route('/api/users/update', update_user, methods=['PUT']),
+          Route('/api/users/logout', logout_user, methods=['POST']),
+          Route('/api/users/refresh', refresh_token, methods=['POST'])
+          ]
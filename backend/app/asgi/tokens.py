@@ -0,0 +1,165 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from hmac import compare_digest
+import jwt
+
+'''
+JWT cookies for the ASGI app, encoded and verified the way Flask-JWT-Extended
+does under the same config, so cookies issued by either server work on both
+'''
+
+
+class AuthError(Exception):
+    '''
+    Raised when a request's JWT cookie is missing, invalid or revoked; answered
+    with the same status and {'msg': ...} body as Flask-JWT-Extended
+    '''
+
+    def __init__(self, msg, status_code=401):
+        super().__init__(msg)
+        self.msg = msg
+        self.status_code = status_code
+
+
+class TokenCookies:
+    '''
+    Creates, sets, unsets and decodes access/refresh token cookies, reading the
+    same JWT_* config keys (and defaults) as Flask-JWT-Extended
+    '''
+
+    def __init__(self, config):
+        self.secret = config['JWT_SECRET_KEY']
+        self.algorithm = config.get('JWT_ALGORITHM', 'HS256')
+        self.expires = {'access': config['JWT_ACCESS_TOKEN_EXPIRES'],
+                        'refresh': config.get('JWT_REFRESH_TOKEN_EXPIRES', timedelta(days=30))}
+        self.csrf_protect = config['JWT_COOKIE_CSRF_PROTECT']
+        self.csrf_methods = config.get('JWT_CSRF_METHODS', ['POST', 'PUT', 'PATCH', 'DELETE'])
+        self.secure = config['JWT_COOKIE_SECURE']
+        self.samesite = config.get('JWT_COOKIE_SAMESITE')
+        self.domain = config.get('JWT_COOKIE_DOMAIN')
+        self.max_age = None if config['JWT_SESSION_COOKIE'] else 2147483647
+
+        # token type -> (cookie name, cookie path, CSRF cookie name, CSRF cookie path, CSRF header)
+        self.cookies = {'access': (config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie'),
+                                   config.get('JWT_ACCESS_COOKIE_PATH', '/'),
+                                   config.get('JWT_ACCESS_CSRF_COOKIE_NAME', 'csrf_access_token'),
+                                   config.get('JWT_ACCESS_CSRF_COOKIE_PATH', '/'),
+                                   config.get('JWT_ACCESS_CSRF_HEADER_NAME', 'X-CSRF-TOKEN')),
+                        'refresh': (config.get('JWT_REFRESH_COOKIE_NAME', 'refresh_token_cookie'),
+                                    config.get('JWT_REFRESH_COOKIE_PATH', '/'),
+                                    config.get('JWT_REFRESH_CSRF_COOKIE_NAME', 'csrf_refresh_token'),
+                                    config.get('JWT_REFRESH_CSRF_COOKIE_PATH', '/'),
+                                    config.get('JWT_REFRESH_CSRF_HEADER_NAME', 'X-CSRF-TOKEN'))}
+
+    def encode(self, identity, token_type='access', claims=None, expires_delta=None):
+        now = datetime.now(timezone.utc)
+        token_data = {'fresh': False,
+                      'iat': now,
+                      'jti': str(uuid.uuid4()),
+                      'type': token_type,
+                      'sub': identity,
+                      'nbf': now,
+                      'csrf': str(uuid.uuid4()),
+                      'exp': now + (expires_delta or self.expires[token_type])
+                      }
+        token_data.update(claims or {})
+        return jwt.encode(token_data, self.secret, self.algorithm)
+
+    def set_cookies(self, response, token, token_type='access'):
+        name, path, csrf_name, csrf_path, _ = self.cookies[token_type]
+        response.set_cookie(name, token, max_age=self.max_age, path=path, domain=self.domain,
+                            secure=self.secure, httponly=True, samesite=self.samesite)
+
+        if self.csrf_protect:
+            response.set_cookie(csrf_name, self.decode_unverified(token)['csrf'], max_age=self.max_age,
+                                path=csrf_path, domain=self.domain, secure=self.secure, httponly=False,
+                                samesite=self.samesite)
+
+    def unset_cookies(self, response):
+        for name, path, csrf_name, csrf_path, _ in self.cookies.values():
+            response.delete_cookie(name, path=path, domain=self.domain)
+            if self.csrf_protect:
+                response.delete_cookie(csrf_name, path=csrf_path, domain=self.domain)
+
+    def sets_cookie(self, response, token_type='access'):
+        prefix = f'{self.cookies[token_type][0]}='.encode('latin-1')
+        return any(key == b'set-cookie' and value.startswith(prefix) for key, value in response.raw_headers)
+
+    def decode_unverified(self, token):
+        return jwt.decode(token, options={'verify_signature': False})
+
+    def decode(self, request, token_type='access'):
+        '''
+        Returns the verified claims of the request's token cookie, or raises AuthError
+        '''
+        name, _, _, _, csrf_header = self.cookies[token_type]
+        token = request.cookies.get(name)
+        if not token:
+            raise AuthError(f'Missing cookie "{name}"')
+
+        csrf_value = None
+        if self.csrf_protect and request.method in self.csrf_methods:
+            csrf_value = request.headers.get(csrf_header)
+            if not csrf_value:
+                raise AuthError('Missing CSRF token')
+
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.ExpiredSignatureError:
+            raise AuthError('Token has expired')
+        except jwt.InvalidTokenError as e:
+            raise AuthError(str(e), 422)
+
+        if csrf_value is not None and not compare_digest(csrf_value, claims.get('csrf', '')):
+            raise AuthError('CSRF double submit tokens do not match')
+
+        if claims.get('type') != token_type:
+            raise AuthError('Only refresh tokens are allowed' if token_type == 'refresh'
+                            else 'Only non-refresh tokens are allowed', 422)
+
+        return claims
+
+
+def jwt_required(refresh=False):
+    '''
+    Decorator for ASGI endpoints mirroring Flask-JWT-Extended's: verifies the
+    token cookie and its revocation, storing the claims on request.state.jwt.
+    In 'implicit' refresh mode, access tokens past half their TTL are
+    re-issued on the response, once per jti.
+    '''
+    token_type = 'refresh' if refresh else 'access'
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(request):
+            state = request.app.state
+            claims = state.tokens.decode(request, token_type)
+            if await state.revocation.is_revoked(claims):
+                raise AuthError('Token has been revoked')
+
+            request.state.jwt = claims
+            response = await func(request)
+
+            if state.activity is not None and response.status_code < 400:
+                state.activity.record(claims['sub'], last_seen=datetime.now(timezone.utc))
+
+            if token_type == 'access' and state.refresh_coalescer is not None:
+                _refresh_expiring(state, claims, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def _refresh_expiring(state, claims, response):
+    if response.status_code >= 400 or state.tokens.sets_cookie(response):
+        return
+
+    ttl = state.tokens.expires['access'].total_seconds()
+    remaining = claims['exp'] - datetime.now(timezone.utc).timestamp()
+    if remaining > ttl / 2:
+        return
+
+    if state.refresh_coalescer.claim(claims['jti'], ttl=max(remaining, 1)):
+        extra = {'epoch': claims['epoch']} if 'epoch' in claims else None
+        state.tokens.set_cookies(response, state.tokens.encode(claims['sub'], claims=extra))
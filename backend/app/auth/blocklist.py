@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+import zlib
+from redis.exceptions import RedisError, ResponseError
+from ..cache import TTLCache
+
+'''
+Redis JWT blocklist with an optional per-worker revocation cache in front of it
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter over strings. A miss means the key was never added.
+    '''
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RevocationCache:
+    '''
+    Per-worker view of the revoked jtis: two rotating Bloom filters answer the
+    common "not revoked" case locally and a TTL-bounded LRU holds jtis known to
+    be revoked. A daemon thread keeps it in sync through Redis pub/sub; whenever
+    the subscription has been silent for longer than max_staleness, lookups go
+    straight to Redis so a revocation is never missed for longer than that.
+    '''
+
+    def __init__(self, redis, ttl, channel, max_staleness, capacity, error_rate, lru_size, scan=None):
+        self.redis = redis
+        self.scan = scan or KeyStore(redis, ttl).scan
+        self.ttl = ttl
+        self.channel = channel
+        self.max_staleness = max_staleness
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._revoked = TTLCache(lru_size, ttl)
+        self._filters = [self._new_filter(), self._new_filter()]
+        self._rotated_at = time.monotonic()
+        self._synced_at = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def _new_filter(self):
+        return BloomFilter(self._capacity, self._error_rate)
+
+    def start(self):
+        # Started on first use so the listener always belongs to the serving process
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._listen, name='revocation-cache', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def synced(self):
+        return (self._synced_at is not None
+                and time.monotonic() - self._synced_at <= self.max_staleness)
+
+    def add(self, jti):
+        with self._lock:
+            # Each filter lives for two TTLs, long enough to outlast any token it covers
+            if time.monotonic() - self._rotated_at >= self.ttl:
+                self._filters = [self._filters[1], self._new_filter()]
+                self._rotated_at = time.monotonic()
+            self._filters[1].add(jti)
+        self._revoked.set(jti, True)
+
+    def might_be_revoked(self, jti):
+        return any(jti in bloom for bloom in self._filters)
+
+    def known_revoked(self, jti):
+        return self._revoked.get(jti, False)
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Subscribe before loading so nothing revoked in between is missed
+                for jti in self.scan():
+                    self.add(jti)
+                self._synced_at = time.monotonic()
+
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self.add(message['data'].decode('utf-8'))
+                    self._synced_at = time.monotonic()
+
+            except RedisError:
+                logger.warning('Revocation cache lost its Redis subscription, retrying')
+                self._synced_at = None
+                self._stopped.wait(1.0)
+
+            finally:
+                pubsub.close()
+
+
+def _memory_usage(redis, keys):
+    '''
+    Sums MEMORY USAGE over keys, or None where the server does not support it
+    '''
+    total = 0
+    for start in range(0, len(keys), 1000):
+        with redis.pipeline(transaction=False) as pipe:
+            for key in keys[start:start + 1000]:
+                pipe.memory_usage(key)
+            try:
+                total += sum(usage or 0 for usage in pipe.execute())
+            except ResponseError:
+                return None
+    return total
+
+
+class KeyStore:
+    '''
+    One Redis key per revoked jti, expiring after the access token TTL. Keys
+    are prefixed so scans skip the throttle, epoch and cache keys sharing the
+    database. With legacy_keys, revocations are also written to and read from
+    the bare jti keys earlier releases used, so tokens they revoked stay
+    revoked and old and new workers see each other's revocations during a
+    rolling deploy. Scans and memory reports only cover prefixed keys.
+    '''
+
+    name = 'keys'
+    KEY_PREFIX = 'blocklist-jti:'
+
+    def __init__(self, redis, ttl, legacy_keys=False):
+        self.redis = redis
+        self.ttl = ttl
+        self.legacy_keys = legacy_keys
+
+    @classmethod
+    def key(cls, jti):
+        return f'{cls.KEY_PREFIX}{jti}'
+
+    def keys(self, jti):
+        '''
+        Every key a revocation of jti is written to and looked up under
+        '''
+        return [self.key(jti), jti] if self.legacy_keys else [self.key(jti)]
+
+    def add(self, jti, exp=None):
+        keys = self.keys(jti)
+        if len(keys) == 1:
+            self.redis.setex(keys[0], self.ttl, '')
+            return
+
+        with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.setex(key, self.ttl, '')
+            pipe.execute()
+
+    def contains(self, jti, exp=None):
+        keys = self.keys(jti)
+        if len(keys) == 1:
+            return self.redis.get(keys[0]) is not None
+        return any(value is not None for value in self.redis.mget(keys))
+
+    def scan(self):
+        for key in self.redis.scan_iter(match=f'{self.KEY_PREFIX}*', count=1000):
+            yield key.decode('utf-8')[len(self.KEY_PREFIX):]
+
+    def memory_report(self):
+        keys = [key for key in self.redis.scan_iter(match=f'{self.KEY_PREFIX}*', count=1000)]
+        return {'backend': self.name,
+                'keys': len(keys),
+                'entries': len(keys),
+                'bytes': _memory_usage(self.redis, keys)
+                }
+
+
+class BucketStore:
+    '''
+    Revoked jtis grouped by the minute their token expires, each minute split
+    over `shards` hashes small enough for Redis to keep in its compact
+    listpack encoding. jtis are stored as their 16 raw UUID bytes, and a
+    bucket expires once every token in it has, so Redis holds one key and one
+    TTL per shard-minute rather than per logout. Lookups need the token's exp.
+    '''
+
+    name = 'buckets'
+    KEY_PREFIX = 'blocklist:'
+
+    def __init__(self, redis, shards, grace=60):
+        self.redis = redis
+        self.shards = shards
+        self.grace = grace
+
+    @staticmethod
+    def field(jti):
+        try:
+            return uuid.UUID(jti).bytes
+        except ValueError:
+            return jti.encode('utf-8')
+
+    @staticmethod
+    def jti(field):
+        return str(uuid.UUID(bytes=field)) if len(field) == 16 else field.decode('utf-8')
+
+    def key(self, jti, exp):
+        return f'{self.KEY_PREFIX}{int(exp) // 60}:{zlib.crc32(self.field(jti)) % self.shards}'
+
+    def expires_at(self, exp):
+        return (int(exp) // 60 + 1) * 60 + self.grace
+
+    def add(self, jti, exp):
+        key = self.key(jti, exp)
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, self.field(jti), '')
+            pipe.expireat(key, self.expires_at(exp))
+            pipe.execute()
+
+    def contains(self, jti, exp):
+        return bool(self.redis.hexists(self.key(jti, exp), self.field(jti)))
+
+    def scan(self):
+        for key in self.redis.scan_iter(match=f'{self.KEY_PREFIX}*', count=1000):
+            for field in self.redis.hkeys(key):
+                yield self.jti(field)
+
+    def memory_report(self):
+        keys = [key for key in self.redis.scan_iter(match=f'{self.KEY_PREFIX}*', count=1000)]
+        with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hlen(key)
+            entries = sum(pipe.execute())
+        return {'backend': self.name,
+                'keys': len(keys),
+                'entries': entries,
+                'bytes': _memory_usage(self.redis, keys)
+                }
+
+
+class Blocklist:
+    '''
+    Stores revoked jtis in Redis for the lifetime of an access token, one key
+    each or in expiry buckets (JWT_BLOCKLIST_BACKEND), on one server or
+    sharded over several, optionally answering lookups from a RevocationCache
+    '''
+
+    def __init__(self, redis, ttl, cache=None, store=None):
+        self.redis = redis
+        self.ttl = ttl
+        self.cache = cache
+        self.store = store or KeyStore(redis, ttl)
+
+    @classmethod
+    def from_config(cls, redis, config, nodes=None):
+        '''
+        Builds the blocklist on redis, or sharded over nodes ({name: client})
+        when given; pub/sub for the revocation cache always goes through redis
+        '''
+        ttl = config['JWT_ACCESS_TOKEN_EXPIRES']
+        cache = None
+
+        def make_store(client):
+            if config.get('JWT_BLOCKLIST_BACKEND', 'keys') == 'buckets':
+                return BucketStore(client, config['JWT_BLOCKLIST_BUCKET_SHARDS'])
+            return KeyStore(client, ttl, config.get('JWT_BLOCKLIST_LEGACY_KEYS', False))
+
+        if nodes:
+            from .sharding import ShardedStore
+            store = ShardedStore({name: make_store(client) for name, client in nodes.items()},
+                                 vnodes=config['REDIS_BLOCKLIST_VNODES'],
+                                 retry_interval=config['REDIS_BLOCKLIST_RETRY_SECONDS'],
+                                 handoff_window=ttl.total_seconds(),
+                                 fail_open=config['REDIS_BLOCKLIST_FAIL_OPEN'])
+        else:
+            store = make_store(redis)
+
+        if config.get('REVOCATION_CACHE_ENABLED'):
+            cache = RevocationCache(redis, int(ttl.total_seconds()),
+                                    channel=config['REVOCATION_CACHE_CHANNEL'],
+                                    max_staleness=config['REVOCATION_CACHE_MAX_STALENESS'],
+                                    capacity=config['REVOCATION_CACHE_CAPACITY'],
+                                    error_rate=config['REVOCATION_CACHE_ERROR_RATE'],
+                                    lru_size=config['REVOCATION_CACHE_LRU_SIZE'],
+                                    scan=store.scan)
+
+        return cls(redis, ttl, cache, store)
+
+    def revoke(self, jti, exp=None):
+        if exp is None:
+            exp = time.time() + self.ttl.total_seconds()
+        self.store.add(jti, exp)
+
+        if self.cache is not None:
+            self.cache.add(jti)
+            self.redis.publish(self.cache.channel, jti)
+
+    def is_revoked(self, jti, exp=None):
+        if self.cache is not None:
+            self.cache.start()
+
+            if self.cache.known_revoked(jti):
+                return True
+            if self.cache.synced and not self.cache.might_be_revoked(jti):
+                return False
+
+        revoked = self.store.contains(jti, exp)
+        if revoked and self.cache is not None:
+            self.cache.add(jti)
+
+        return revoked
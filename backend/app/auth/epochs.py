@@ -0,0 +1,63 @@
+from .. import db
+from ..cache import TTLCache
+from ..models import User
+
+'''
+Per-user token epochs: an alternative to per-token blocklist entries where
+logging out bumps a counter that every older token of that user falls behind
+'''
+
+
+class TokenEpochs:
+    '''
+    Resolves a user's current token epoch from a short-lived per-worker cache,
+    then Redis, then the User row. Bumping the epoch revokes every token issued
+    before it, so "log out everywhere" is a single increment. Other workers see
+    the bump once their cached value expires, after at most cache_ttl seconds;
+    new tokens are minted with the fresh value so they are never born revoked.
+    '''
+
+    KEY_PREFIX = 'token_epoch:'
+
+    def __init__(self, redis, cache_ttl, cache_size, redis_ttl):
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        self._cache = TTLCache(cache_size, cache_ttl)
+
+    def _key(self, public_id):
+        return f'{self.KEY_PREFIX}{public_id}'
+
+    def current(self, public_id, fresh=False):
+        '''
+        The user's epoch, skipping the per-worker cache when fresh is set
+        '''
+        epoch = None if fresh else self._cache.get(public_id)
+        if epoch is not None:
+            return epoch
+
+        stored = self.redis.get(self._key(public_id))
+        if stored is not None:
+            epoch = int(stored)
+        else:
+            # Redis lost the key (restart, eviction): the User row is the fallback
+            epoch = (db.session.query(User.token_epoch)
+                     .filter_by(public_id=public_id).scalar()) or 0
+            self.redis.set(self._key(public_id), epoch, ex=self.redis_ttl, nx=True)
+
+        self._cache.set(public_id, epoch)
+        return epoch
+
+    def clear(self):
+        '''
+        Empties the per-worker cache; Redis and the database are untouched
+        '''
+        self._cache.reset()
+
+    def bump(self, user):
+        user.token_epoch = User.token_epoch + 1
+        user.save()
+
+        epoch = user.token_epoch
+        self.redis.set(self._key(user.public_id), epoch, ex=self.redis_ttl)
+        self._cache.set(user.public_id, epoch)
+        return epoch
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from redis.exceptions import RedisError
+from .. import db
+from ..cache import TTLCache
+from ..models import User
+
+'''
+Read-through cache for resolving a JWT identity (public_id) to its user
+'''
+
+logger = logging.getLogger(__name__)
+
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'public_id', 'username', 'email'])
+
+
+class IdentityCache:
+    '''
+    Per-worker LRU of UserSnapshots keyed by public_id, optionally backed by
+    Redis so a miss in one worker can be served from another worker's load.
+    User.save() invalidates both layers.
+
+    With a broadcast client, invalidations are also published on channel and
+    a daemon thread drops them from every worker's local layer, so a rotated
+    public_id stops resolving everywhere at once. Whenever that subscription
+    has been silent for longer than max_staleness the local layer is bypassed,
+    and it is emptied on (re)subscribing since messages may have been missed.
+    Without one, other workers' copies expire after at most ttl seconds.
+    '''
+
+    KEY_PREFIX = 'identity:'
+
+    def __init__(self, maxsize, ttl, redis=None, broadcast=None, channel=None, max_staleness=5.0):
+        self.ttl = ttl
+        self.redis = redis
+        self.broadcast = broadcast
+        self.channel = channel
+        self.max_staleness = max_staleness
+        self.redis_hits = 0
+        self.db_loads = 0
+        self._local = TTLCache(maxsize, ttl)
+        self._synced_at = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def _key(self, public_id):
+        return f'{self.KEY_PREFIX}{public_id}'
+
+    def start(self):
+        # Started on first use so the listener always belongs to the serving process
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._listen, name='identity-cache', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def synced(self):
+        return (self._synced_at is not None
+                and time.monotonic() - self._synced_at <= self.max_staleness)
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            pubsub = self.broadcast.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                self._local.clear()
+                self._synced_at = time.monotonic()
+
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        for public_id in message['data'].decode('utf-8').split(','):
+                            self._local.pop(public_id)
+                    self._synced_at = time.monotonic()
+
+            except RedisError:
+                logger.warning('Identity cache lost its Redis subscription, retrying')
+                self._synced_at = None
+                self._stopped.wait(1.0)
+
+            finally:
+                pubsub.close()
+
+    def get(self, public_id):
+        if self.broadcast is None:
+            local = True
+        else:
+            self.start()
+            local = self.synced
+
+        snapshot = self._local.get(public_id) if local else None
+        if snapshot is not None:
+            return snapshot
+
+        if self.redis is not None:
+            stored = self.redis.get(self._key(public_id))
+            if stored is not None:
+                self.redis_hits += 1
+                snapshot = UserSnapshot(*json.loads(stored))
+                self._local.set(public_id, snapshot)
+                return snapshot
+
+        row = (db.session.query(User.id, User.public_id, User.username, User.email)
+               .filter_by(public_id=public_id).first())
+        self.db_loads += 1
+        if row is None:
+            return None
+
+        return self._store(UserSnapshot(*row))
+
+    def put(self, user):
+        '''
+        Replaces the cached snapshot for a user that was just written
+        '''
+        return self._store(UserSnapshot(user.id, user.public_id, user.username, user.email))
+
+    def _store(self, snapshot):
+        self._local.set(snapshot.public_id, snapshot)
+        if self.redis is not None:
+            self.redis.set(self._key(snapshot.public_id), json.dumps(snapshot), ex=self.ttl)
+
+        return snapshot
+
+    def get_user(self, public_id):
+        '''
+        Returns a session-bound User for the identity without querying the
+        database, or None if the identity does not exist
+        '''
+        snapshot = self.get(public_id)
+        return User.from_snapshot(snapshot) if snapshot is not None else None
+
+    def invalidate(self, *public_ids):
+        for public_id in public_ids:
+            self._local.pop(public_id)
+        if self.redis is not None and public_ids:
+            self.redis.delete(*(self._key(public_id) for public_id in public_ids))
+        if self.broadcast is not None and public_ids:
+            self.broadcast.publish(self.channel, ','.join(public_ids))
+
+    def clear(self):
+        '''
+        Empties this worker's layer and zeroes the counters
+        '''
+        self._local.reset()
+        self.redis_hits = self.db_loads = 0
+
+    def stats(self):
+        stats = self._local.stats()
+        stats['redis_hits'] = self.redis_hits
+        stats['db_loads'] = self.db_loads
+        return stats
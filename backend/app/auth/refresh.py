@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from flask import current_app, request
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, set_access_cookies
+from ..cache import TTLCache
+from ..metrics import STAGE_SECONDS
+
+'''
+Sliding-session refresh of access token cookies
+'''
+
+
+class RefreshCoalescer:
+    '''
+    Remembers which jtis this worker has already re-issued, so a client whose
+    in-flight requests still carry the old cookie gets one new token per
+    window instead of a fresh signature and Set-Cookie on every request
+    '''
+
+    def __init__(self, maxsize, ttl):
+        self._reissued = TTLCache(maxsize, ttl)
+
+    def claim(self, jti, ttl):
+        if jti in self._reissued:
+            return False
+        self._reissued.set(jti, True, ttl=ttl)
+        return True
+
+    def clear(self):
+        self._reissued.reset()
+
+
+def _sets_access_cookie(response, cookie_name):
+    return any(cookie.startswith(f'{cookie_name}=') for cookie in response.headers.getlist('Set-Cookie'))
+
+
+def refresh_expiring_jwt(response):
+    '''
+    Implicit token refreshing via cookies if the token is over halfway to its time to
+    live (TTL). Only requests that carried and verified an access token are
+    considered, and each token is re-issued at most once.
+    '''
+    cookie_name = current_app.config['JWT_ACCESS_COOKIE_NAME']
+    if response.status_code >= 400 or cookie_name not in request.cookies:
+        return response
+
+    # Login and logout already set or unset the cookie themselves
+    if _sets_access_cookie(response, cookie_name):
+        return response
+
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        # Unprotected route, the cookie was never verified
+        return response
+
+    if claims.get('type') != 'access':
+        return response
+
+    remaining = claims['exp'] - datetime.now(timezone.utc).timestamp()
+    if remaining > current_app.TTL.total_seconds() / 2:
+        return response
+
+    if current_app.refresh_coalescer.claim(claims['jti'], ttl=max(remaining, 1)):
+        with STAGE_SECONDS.time(stage='token_refresh'):
+            access_token = create_access_token(identity=get_jwt_identity())
+            set_access_cookies(response, access_token)
+
+    return response
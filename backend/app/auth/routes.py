@@ -1,11 +1,17 @@
+import math
 import uuid
-from flask import current_app, request, jsonify, make_response
+from flask import Response, current_app, request, jsonify, make_response, stream_with_context
 from flask_restx import Api, Resource, fields
 from flask_jwt_extended import (
-    create_access_token, get_jwt_identity, jwt_required, get_jwt,
-    set_access_cookies, unset_access_cookies)
-from ..models import User
-from .utils import is_token_in_blocklist
+    create_access_token, create_refresh_token, get_jwt_identity, jwt_required, get_jwt,
+    set_access_cookies, set_refresh_cookies, unset_jwt_cookies)
+from ..activity import record_login
+from ..exporter import SERIALIZERS, iter_users
+from ..models import User, normalize_email
+from ..hashing import HasherBusy
+from .throttle import client_address
+from .utils import admin_required, is_token_in_blocklist, revoke_token, revoke_user_tokens
+from .validation import validate_payload
 
 
 auth = Api(version="1.0", title="User Auth")
@@ -29,13 +35,25 @@ update_user_model = auth.model('UpdateModel', {"username": fields.String(require
                                                })
 
 
+@auth.errorhandler(HasherBusy)
+def handle_hasher_busy(error):
+    '''
+    Signup and login share a bounded bcrypt pool; when it is saturated, tell the
+    client to back off instead of queueing the request indefinitely
+    '''
+    return ({'success': False,
+             'msg': 'Server busy, please try again shortly.'
+             }, 503, {'Retry-After': '1'})
+
+
 @auth.route('/api/users/signup')
 class Signup(Resource):
     '''
     Takes signup_user_model as input and creates a new user based on the data,
     if user doesn't already exist
     '''
-    @auth.expect(signup_user_model, validate=True)
+    @auth.expect(signup_user_model)
+    @validate_payload(signup_user_model)
     def post(self):
 
         request_data = request.get_json()
@@ -43,21 +61,14 @@ class Signup(Resource):
         _email = request_data.get('email')
         _password = request_data.get('password')
 
-        user = User.query.filter_by(email=_email).first()
-
-        if not user:
-            new_user = User(
-                public_id=str(uuid.uuid4()),
-                username=_username,
-                email=_email
-            )
-
-            new_user.set_password(_password)
-            new_user.save()
+        if User.register(public_id=str(uuid.uuid4()),
+                         username=_username,
+                         email=_email,
+                         password=_password):
 
             return ({'success': True,
                      'msg': 'Successfully registered.',
-                     'user': new_user.username,
+                     'user': _username,
                      }, 201)
         else:
             return ({'success': False,
@@ -71,14 +82,25 @@ class Login(Resource):
     Takes login_user_model as input and logs user in if passwords match,
     creating JWT for auth to be sent to protected endpoints
     '''
-    @auth.expect(login_user_model, validate=True)
+    @auth.expect(login_user_model)
+    @validate_payload(login_user_model)
     def post(self):
 
         request_data = request.get_json()
         _email = request_data.get('email')
         _password = request_data.get('password')
 
-        user = User.query.filter_by(email=_email).first()
+        if current_app.login_throttle is not None:
+            client_ip = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'),
+                                       current_app.config['TRUSTED_PROXIES'])
+            retry_after = current_app.login_throttle.check(_email, client_ip)
+            if retry_after:
+                return ({'success': False,
+                         'msg': 'Too many login attempts, please try again later.'
+                         }, 429, {'Retry-After': str(math.ceil(retry_after))})
+
+        current_app.replicas.pin_if_recent(normalize_email(_email))
+        user = User.by_email(_email).first()
 
         if not user:
             return ({'success': False,
@@ -86,6 +108,15 @@ class Login(Resource):
                      }, 401)
 
         if user.check_password(_password):
+            record_login(user)
+            if user.needs_rehash():
+                # Move the stored hash to the current cost while we have the plaintext
+                try:
+                    user.set_password(_password)
+                    user.save()
+                except HasherBusy:
+                    pass
+
             token = create_access_token(identity=user.public_id)
 
             response = jsonify({'success': True,
@@ -94,6 +125,9 @@ class Login(Resource):
                                 })
 
             set_access_cookies(response, token)
+            if current_app.config['JWT_REFRESH_MODE'] == 'explicit':
+                set_refresh_cookies(response, create_refresh_token(identity=user.public_id))
+
             return make_response(response, 200)
 
         return ({'success': False,
@@ -105,17 +139,19 @@ class Login(Resource):
 class UpdateUser (Resource):
     '''
     Takes update_user_model as input and updates their data if they provide a valid JWT
-    and the user exists
+    and the user exists. Either field may be omitted.
     '''
     @auth.expect(update_user_model)
     @jwt_required()
+    @validate_payload(update_user_model, partial=True)
     def put(self):
 
         request_data = request.get_json()
         _new_username = request_data.get('username')
         _new_email = request_data.get('email')
 
-        user = User.query.filter_by(public_id=get_jwt_identity()).first()
+        current_app.replicas.pin_if_recent(get_jwt_identity())
+        user = current_app.identity_cache.get_user(get_jwt_identity())
 
         if not user:
             return ({'success': False,
@@ -138,28 +174,84 @@ class UpdateUser (Resource):
 @auth.route('/api/users/logout')
 class LogoutUser(Resource):
     '''
-    Logs user out, adding their JWT to redis_blocklist
+    Logs user out, adding their JWT to the blocklist, or in epoch mode
+    revoking all of their tokens at once
     '''
     @jwt_required()
     def post(self):
 
-        user = User.query.filter_by(public_id=get_jwt_identity()).first()
+        current_app.replicas.pin_if_recent(get_jwt_identity())
+        user = current_app.identity_cache.get_user(get_jwt_identity())
 
         if user:
-            user.public_id = str(uuid.uuid4())
-            user.save()
+            if current_app.config['JWT_REVOCATION_MODE'] == 'epoch':
+                revoke_user_tokens(user)
+            else:
+                user.public_id = str(uuid.uuid4())
+                user.save()
 
-            _jti = get_jwt()['jti']
-            current_app.redis_blocklist.setex(_jti, current_app.TTL, '')
+                revoke_token(get_jwt())
 
             response = jsonify({'success': True,
                                 'msg': 'Successfully logged out.',
                                 'user': user.username
                                 })
 
-            unset_access_cookies(response)
+            unset_jwt_cookies(response)
             return make_response(response, 200)
 
         return ({'success': False,
                  'msg': 'User not found'
                  }, 401)
+
+
+@auth.route('/api/users/refresh')
+class RefreshToken(Resource):
+    '''
+    Exchanges a refresh token cookie (issued at login when JWT_REFRESH_MODE is
+    'explicit') for a new access token cookie
+    '''
+    @jwt_required(refresh=True)
+    def post(self):
+
+        user = current_app.identity_cache.get(get_jwt_identity())
+
+        if user:
+            response = jsonify({'success': True,
+                                'msg': 'Successfully refreshed token.',
+                                'user': user.username
+                                })
+
+            set_access_cookies(response, create_access_token(identity=user.public_id))
+            return make_response(response, 200)
+
+        return ({'success': False,
+                 'msg': 'User not found'
+                 }, 401)
+
+
+@auth.route('/api/admin/users')
+class AdminUsers(Resource):
+    '''
+    Streams users ordered by id as JSON Lines (default) or CSV to admins.
+    ?after_id= and ?limit= page through the table by keyset; reads may be
+    served by a replica.
+    '''
+    @jwt_required()
+    @admin_required
+    def get(self):
+
+        _format = request.args.get('format', 'jsonl')
+        _after_id = request.args.get('after_id', 0, type=int)
+        _limit = request.args.get('limit', None, type=int)
+
+        if _format not in SERIALIZERS:
+            return ({'success': False,
+                     'msg': f'Unsupported format, use one of: {", ".join(SERIALIZERS)}'
+                     }, 400)
+
+        serialize, mimetype = SERIALIZERS[_format]
+        users = iter_users(current_app.config['USER_EXPORT_BATCH_SIZE'], _after_id, _limit)
+
+        return Response(stream_with_context(serialize(users)), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename=users.{_format}'})
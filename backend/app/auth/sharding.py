@@ -0,0 +1,205 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from redis.exceptions import RedisError
+from ..metrics import REGISTRY
+
+'''
+Consistent-hash sharding of the JWT blocklist over several Redis servers
+'''
+
+logger = logging.getLogger(__name__)
+
+NODE_SECONDS = REGISTRY.histogram('blocklist_node_seconds', 'Blocklist command latency per Redis node', ['node'],
+                                  buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+NODE_ERRORS = REGISTRY.counter('blocklist_node_errors_total', 'Blocklist commands failed per Redis node', ['node'])
+
+
+class HashRing:
+    '''
+    Consistent hash ring placing each node at `vnodes` points, so keys spread
+    evenly and adding or removing a node only moves the keys it gains or loses
+    '''
+
+    def __init__(self, nodes, vnodes=160):
+        self.nodes = list(nodes)
+        points = sorted((self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def node_for(self, key):
+        return next(self.nodes_for(key))
+
+    def nodes_for(self, key):
+        '''
+        Yields each node once, clockwise from key's point: its owner first,
+        then the nodes its writes fall back to
+        '''
+        start = bisect.bisect(self._points, self._hash(key))
+        seen = set()
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class ShardedStore:
+    '''
+    Blocklist store routing each jti to one of several per-node stores
+    (KeyStore or BucketStore) by consistent hashing.
+
+    A node whose command fails is marked down and skipped for retry_interval
+    seconds: revocations it owns are written to the next node on the ring
+    instead, and for handoff_window seconds (the token TTL) lookups follow the
+    ring past recently failed nodes so those handed-off entries are found
+    after it recovers. Lookups owned by a node that is down see only those
+    entries, or count as revoked when fail_open is off.
+
+    Failure state is per process: a worker that never saw the node fail
+    only asks the owner. So the worker that handed a revocation off keeps it
+    as a hint and writes it to the owner on its first command there after the
+    retry interval. Until then, or for good if that worker exits first, other
+    workers can miss the revocation.
+    '''
+
+    def __init__(self, stores, vnodes=160, retry_interval=5.0, handoff_window=900.0, fail_open=True):
+        self.stores = dict(stores)
+        self.ring = HashRing(self.stores, vnodes)
+        self.retry_interval = retry_interval
+        self.handoff_window = handoff_window
+        self.fail_open = fail_open
+        self.name = f'{next(iter(self.stores.values())).name} over {len(self.stores)} nodes'
+        self._down_until = {}
+        self._failed_at = {}
+        self._hints = {node: {} for node in self.stores}
+        self._requests = dict.fromkeys(self.stores, 0)
+        self._errors = dict.fromkeys(self.stores, 0)
+        self._lock = threading.Lock()
+
+    def _is_down(self, node):
+        return time.monotonic() < self._down_until.get(node, 0)
+
+    def _recently_failed(self, node):
+        failed_at = self._failed_at.get(node)
+        return failed_at is not None and time.monotonic() - failed_at < self.handoff_window
+
+    def _call(self, node, method, *args):
+        started = time.perf_counter()
+        try:
+            return getattr(self.stores[node], method)(*args)
+        except RedisError:
+            with self._lock:
+                self._errors[node] += 1
+                self._failed_at[node] = time.monotonic()
+                self._down_until[node] = self._failed_at[node] + self.retry_interval
+            NODE_ERRORS.inc(node=node)
+            logger.warning('Blocklist node %s failed, skipping it for %.0fs', node, self.retry_interval)
+            raise
+        finally:
+            with self._lock:
+                self._requests[node] += 1
+            NODE_SECONDS.observe(time.perf_counter() - started, node=node)
+
+    def _replay_hints(self, node):
+        '''
+        Writes the revocations handed off while node was down back to it, so
+        workers that did not see it fail find them on their owner
+        '''
+        if not self._hints[node] or self._is_down(node):
+            return
+
+        with self._lock:
+            hints, self._hints[node] = self._hints[node], {}
+        now = time.monotonic()
+        for jti, (exp, expires_at) in hints.items():
+            if expires_at <= now:
+                continue
+            try:
+                self._call(node, 'add', jti, exp)
+            except RedisError:
+                with self._lock:
+                    for pending, hint in hints.items():
+                        self._hints[node].setdefault(pending, hint)
+                return
+
+    def add(self, jti, exp):
+        nodes = list(self.ring.nodes_for(jti))
+        owner = nodes[0]
+        self._replay_hints(owner)
+        # With every node marked down, try them all rather than dropping the revocation
+        candidates = [node for node in nodes if not self._is_down(node)] or nodes
+
+        error = None
+        for node in candidates:
+            try:
+                result = self._call(node, 'add', jti, exp)
+            except RedisError as e:
+                error = e
+                continue
+
+            if node != owner:
+                with self._lock:
+                    self._hints[owner][jti] = (exp, time.monotonic() + self.handoff_window)
+            return result
+        raise error
+
+    def contains(self, jti, exp):
+        error = None
+        self._replay_hints(self.ring.node_for(jti))
+        for position, node in enumerate(self.ring.nodes_for(jti)):
+            if self._is_down(node):
+                if position == 0 and not self.fail_open:
+                    return True
+                continue
+
+            try:
+                if self._call(node, 'contains', jti, exp):
+                    return True
+            except RedisError as e:
+                if position == 0 and not self.fail_open:
+                    return True
+                error = e
+                continue
+
+            # Writes skipped only nodes that failed, so a node that did not is the last place to look
+            if not self._recently_failed(node):
+                return False
+
+        if error is not None:
+            raise error
+        return False
+
+    def scan(self):
+        for store in self.stores.values():
+            yield from store.scan()
+
+    def memory_report(self):
+        reports = [store.memory_report() for store in self.stores.values()]
+        sizes = [report['bytes'] for report in reports]
+        return {'backend': self.name,
+                'keys': sum(report['keys'] for report in reports),
+                'entries': sum(report['entries'] for report in reports),
+                'bytes': None if None in sizes else sum(sizes)
+                }
+
+    def stats(self):
+        '''
+        {(node, stat): value} with each node's up state, command/error counts
+        and revocations waiting to be written back to it
+        '''
+        stats = {}
+        for node in self.stores:
+            stats[(node, 'up')] = 0 if self._is_down(node) else 1
+            stats[(node, 'requests')] = self._requests[node]
+            stats[(node, 'errors')] = self._errors[node]
+            stats[(node, 'hints')] = len(self._hints[node])
+        return stats
@@ -0,0 +1,168 @@
+import logging
+import math
+import time
+from redis.exceptions import RedisError, ResponseError, WatchError
+from ..metrics import REGISTRY, STAGE_SECONDS
+from ..models import normalize_email
+
+'''
+Redis token-bucket throttling of login attempts by email and client IP
+'''
+
+logger = logging.getLogger(__name__)
+
+THROTTLED = REGISTRY.counter('login_throttled_total', 'Login attempts rejected by the throttle', ['key'])
+BCRYPT_SECONDS_SAVED = REGISTRY.counter('login_throttle_bcrypt_seconds_saved_total',
+                                        'Estimated bcrypt CPU seconds not spent on throttled logins')
+
+# KEYS: one bucket per limited key. ARGV: now, then capacity and refill rate
+# (tokens/second) per key. Tokens are only taken when every bucket has one, so
+# a request rejected by the IP bucket does not also drain the email bucket.
+TOKEN_BUCKET_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local tokens = {}
+local retry_after = 0
+local limited = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - last) * rate)
+    tokens[i] = available
+    if available < 1 and (1 - available) / rate > retry_after then
+        retry_after = (1 - available) / rate
+        limited = i
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local available = tokens[i]
+    if retry_after == 0 then
+        available = available - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(available), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+
+return {tostring(retry_after), limited}
+'''
+
+
+def client_address(remote_addr, forwarded_for, trusted_proxies):
+    '''
+    Address the IP bucket keys on: the peer address when no proxy is trusted,
+    otherwise the one recorded by the outermost of trusted_proxies proxies,
+    i.e. the trusted_proxies-th X-Forwarded-For entry from the right, or None
+    when the header is shorter than that
+    '''
+    if not trusted_proxies:
+        return remote_addr or None
+    if not forwarded_for:
+        return None
+
+    addresses = [address.strip() for address in forwarded_for.split(',')]
+    if len(addresses) < trusted_proxies:
+        return None
+    return addresses[-trusted_proxies] or None
+
+
+class LoginThrottle:
+    '''
+    Token buckets per email and per client IP, updated atomically by a Lua
+    script. Redis servers without scripting (fakeredis without lupa, as used by
+    TestingConfig) get an equivalent WATCH/MULTI transaction. If Redis is
+    unreachable, logins are let through rather than locked out.
+    '''
+
+    KEY_PREFIX = 'login_throttle:'
+
+    def __init__(self, redis, email_burst, email_per_minute, ip_burst, ip_per_minute):
+        self.redis = redis
+        self.limits = {'email': (email_burst, email_per_minute / 60),
+                       'ip': (ip_burst, ip_per_minute / 60)}
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._scripting = True
+
+    @classmethod
+    def from_config(cls, redis, config):
+        return cls(redis,
+                   email_burst=config['LOGIN_THROTTLE_EMAIL_BURST'],
+                   email_per_minute=config['LOGIN_THROTTLE_EMAIL_PER_MINUTE'],
+                   ip_burst=config['LOGIN_THROTTLE_IP_BURST'],
+                   ip_per_minute=config['LOGIN_THROTTLE_IP_PER_MINUTE'])
+
+    def check(self, email, ip):
+        '''
+        Takes a token from the email bucket, and the IP bucket when ip is known,
+        returning 0 if the attempt may proceed or the seconds to wait before
+        retrying
+        '''
+        buckets = [(f'{self.KEY_PREFIX}email:{normalize_email(email)}', 'email')]
+        if ip:
+            buckets.append((f'{self.KEY_PREFIX}ip:{ip}', 'ip'))
+
+        keys = [key for key, _ in buckets]
+        args = [time.time()]
+        for _, kind in buckets:
+            args.extend(self.limits[kind])
+
+        try:
+            retry_after, limited = self._take(keys, args)
+        except RedisError:
+            logger.warning('Login throttle unavailable, allowing attempt', exc_info=True)
+            return 0
+
+        if retry_after:
+            THROTTLED.inc(key=buckets[limited - 1][1])
+            BCRYPT_SECONDS_SAVED.inc(STAGE_SECONDS.mean(stage='bcrypt_check'))
+        return retry_after
+
+    def _take(self, keys, args):
+        if self._scripting:
+            try:
+                retry_after, limited = self._script(keys=keys, args=args)
+                return float(retry_after), int(limited)
+            except (ImportError, ResponseError) as e:
+                if isinstance(e, ResponseError) and 'unknown command' not in str(e).lower():
+                    raise
+                self._scripting = False
+
+        return self._take_transaction(keys, args)
+
+    def _take_transaction(self, keys, args):
+        now = args[0]
+        limits = [(args[i * 2 + 1], args[i * 2 + 2]) for i in range(len(keys))]
+
+        while True:
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(*keys)
+                    tokens = []
+                    retry_after = 0.0
+                    limited = 0
+                    for i, (key, (capacity, rate)) in enumerate(zip(keys, limits), 1):
+                        stored, last = pipe.hmget(key, 'tokens', 'ts')
+                        available = float(stored) if stored is not None else capacity
+                        last = float(last) if last is not None else now
+                        available = min(capacity, available + max(0.0, now - last) * rate)
+                        tokens.append(available)
+                        if available < 1 and (1 - available) / rate > retry_after:
+                            retry_after = (1 - available) / rate
+                            limited = i
+
+                    pipe.multi()
+                    for key, (capacity, rate), available in zip(keys, limits, tokens):
+                        if not retry_after:
+                            available -= 1
+                        pipe.hset(key, mapping={'tokens': available, 'ts': now})
+                        pipe.expire(key, math.ceil(capacity / rate) + 1)
+                    pipe.execute()
+                    return retry_after, limited
+
+                except WatchError:
+                    continue
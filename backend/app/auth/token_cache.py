@@ -0,0 +1,79 @@
+import hashlib
+import time
+from hmac import compare_digest
+from flask import current_app
+from flask_jwt_extended import JWTManager
+from flask_jwt_extended.exceptions import CSRFError, JWTDecodeError
+from ..cache import TTLCache
+
+'''
+Per-worker cache of verified JWT claims, skipping signature verification and
+JSON decoding for tokens this worker has already seen
+'''
+
+
+class TokenCache:
+    '''
+    Bounded LRU from a token's digest to its verified claims, each entry kept
+    until the token's exp. Revoked tokens are evicted by jti.
+    '''
+
+    def __init__(self, maxsize):
+        self._claims = TTLCache(maxsize, ttl=0)
+        self._digests = TTLCache(maxsize, ttl=0)
+
+    @staticmethod
+    def digest(encoded_token):
+        return hashlib.blake2b(encoded_token.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, encoded_token):
+        return self._claims.get(self.digest(encoded_token))
+
+    def put(self, encoded_token, claims):
+        remaining = claims.get('exp', 0) - time.time()
+        if remaining <= 0:
+            return
+
+        digest = self.digest(encoded_token)
+        self._claims.set(digest, claims, ttl=remaining)
+        if claims.get('jti'):
+            self._digests.set(claims['jti'], digest, ttl=remaining)
+
+    def evict(self, jti):
+        digest = self._digests.pop(jti)
+        if digest is not None:
+            self._claims.pop(digest)
+
+    def clear(self):
+        self._claims.reset()
+        self._digests.reset()
+
+    def stats(self):
+        return self._claims.stats()
+
+
+class CachingJWTManager(JWTManager):
+    '''
+    JWTManager answering token decodes from app.token_cache when it is set.
+    A hit still enforces the CSRF double submit check; expired tokens have
+    already left the cache, so they go through full verification and fail it.
+    The blocklist check runs on every request as before.
+    '''
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        cache = getattr(current_app, 'token_cache', None)
+        if cache is None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        claims = cache.get(encoded_token)
+        if claims is None:
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+            cache.put(encoded_token, claims)
+        elif csrf_value:
+            if 'csrf' not in claims:
+                raise JWTDecodeError('Missing claim: csrf')
+            if not compare_digest(claims['csrf'], csrf_value):
+                raise CSRFError('CSRF double submit tokens do not match')
+
+        # Callers may add to the claims dict, so every request gets its own copy
+        return dict(claims)
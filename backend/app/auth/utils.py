@@ -1,5 +1,8 @@
+from functools import wraps
 from flask import current_app
+from flask_jwt_extended import get_jwt_identity
 from .. import jwt
+from ..metrics import STAGE_SECONDS
 
 '''
 Utility functions for setting up custom JWT callbacks
@@ -10,9 +13,65 @@ Utility functions for setting up custom JWT callbacks
 def is_token_in_blocklist(jwt_header: dict, jwt_payload: dict):
     '''
     Custom callback for checking a @jwt_required route to make sure the token
-    has not been revoked (added to redis blocklist)
+    has not been revoked (added to redis blocklist, or issued before the user's
+    current token epoch)
     '''
-    jti = jwt_payload['jti']
-    token_in_redis = current_app.redis_blocklist.get(jti)
+    with STAGE_SECONDS.time(stage='blocklist'):
+        if current_app.config['JWT_REVOCATION_MODE'] == 'epoch':
+            revoked = jwt_payload.get('epoch', 0) < current_app.token_epochs.current(jwt_payload['sub'])
+        else:
+            revoked = current_app.blocklist.is_revoked(jwt_payload['jti'], jwt_payload['exp'])
 
-    return token_in_redis is not None
\ No newline at end of file
+    if revoked:
+        _evict_decoded(jwt_payload['jti'])
+    return revoked
+
+
+def _evict_decoded(jti):
+    if current_app.token_cache is not None:
+        current_app.token_cache.evict(jti)
+
+
+@jwt.additional_claims_loader
+def add_token_claims(identity):
+    '''
+    Custom callback embedding the user's token epoch in every token created
+    with create_access_token, when running in epoch revocation mode. Read
+    past the worker's cache: a stale epoch would mint a token already revoked
+    by a logout on another worker.
+    '''
+    if current_app.config['JWT_REVOCATION_MODE'] == 'epoch':
+        return {'epoch': current_app.token_epochs.current(identity, fresh=True)}
+
+    return {}
+
+
+def admin_required(func):
+    '''
+    Decorator for @jwt_required routes limiting them to users whose public_id
+    is listed in ADMIN_PUBLIC_IDS
+    '''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if get_jwt_identity() not in current_app.config['ADMIN_PUBLIC_IDS']:
+            return ({'success': False,
+                     'msg': 'Admin access required'
+                     }, 403)
+
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def revoke_token(jwt_payload: dict):
+    '''
+    Adds the token's jti to the blocklist for the lifetime of an access token
+    '''
+    current_app.blocklist.revoke(jwt_payload['jti'], jwt_payload['exp'])
+    _evict_decoded(jwt_payload['jti'])
+
+
+def revoke_user_tokens(user):
+    '''
+    Revokes every token issued to the user so far by bumping their token epoch
+    '''
+    current_app.token_epochs.bump(user)
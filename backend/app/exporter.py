@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+from app import db
+from .models import User
+
+'''
+Helpers for streaming user listings/exports as JSON Lines or CSV
+'''
+
+
+def iter_users(batch_size, after_id=0, limit=None):
+    '''
+    Yields users ordered by id, limit at most, one keyset page (id > last seen
+    id, never OFFSET) per query. Pages are streamed through a server-side cursor
+    on Postgres, detached from the session once yielded and each read in its
+    own short transaction, so memory stays flat and no snapshot spans the export.
+    '''
+    last_id, remaining = after_id, limit
+
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        page = (User.query.filter(User.id > last_id).order_by(User.id).limit(size)
+                .execution_options(stream_results=True).yield_per(size))
+
+        count = 0
+        for user in page:
+            count += 1
+            last_id = user.id
+            yield user
+            db.session.expunge(user)
+
+        db.session.rollback()
+        if count < size:
+            return
+        if remaining is not None:
+            remaining -= count
+
+
+def to_jsonl(users):
+    for user in users:
+        yield json.dumps(user.to_dict(), default=str) + '\n'
+
+
+def to_csv(users):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(User().to_dict()))
+    writer.writeheader()
+
+    for user in users:
+        writer.writerow(user.to_dict())
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# format -> (serializer, mimetype)
+SERIALIZERS = {'jsonl': (to_jsonl, 'application/x-ndjson'),
+               'csv': (to_csv, 'text/csv')
+               }
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import bcrypt as _bcrypt
+from .metrics import STAGE_SECONDS
+
+'''
+Bounded worker pool for bcrypt hashing/checking, keeping CPU-heavy password
+work off the request threads
+'''
+
+
+_calibrations = {}
+
+
+def calibrate_rounds(bcrypt, target_seconds, min_rounds=4, max_rounds=16):
+    '''
+    Picks the highest bcrypt cost whose hash time on this machine stays within
+    target_seconds. Each extra round doubles the work, so a cheap measurement
+    is extrapolated and the chosen cost is then confirmed with one real hash.
+    The result is remembered for the life of the process.
+    '''
+    key = (target_seconds, min_rounds, max_rounds)
+    if key in _calibrations:
+        return _calibrations[key]
+
+    def measure(rounds):
+        started = time.perf_counter()
+        bcrypt.generate_password_hash('calibration-password', rounds)
+        return time.perf_counter() - started
+
+    base = min(measure(min_rounds) for _ in range(3))
+    rounds = min_rounds
+    while rounds < max_rounds and base * 2 ** (rounds + 1 - min_rounds) <= target_seconds:
+        rounds += 1
+
+    while rounds > min_rounds and measure(rounds) > target_seconds:
+        rounds -= 1
+
+    _calibrations[key] = rounds
+    return rounds
+
+
+def hash_rounds(pw_hash):
+    '''
+    Returns the cost factor encoded in a bcrypt hash, e.g. 12 for $2b$12$...
+    '''
+    return int(pw_hash.split('$')[2])
+
+
+class HasherBusy(Exception):
+    '''
+    Raised when the hashing queue is full or a hash did not finish within the
+    configured timeout
+    '''
+
+
+class PasswordHasher:
+    '''
+    Runs the bound Flask-Bcrypt methods in a per-process pool (by default the
+    host's cores split between the gunicorn workers), with a bounded number of
+    in-flight jobs and a per-call timeout. With PASSWORD_HASH_WORKERS set to 0,
+    the work runs inline in the calling thread.
+
+    The calling thread still waits for its result: what the pool isolates is
+    the worker's other threads, so it only helps threaded (gthread) workers.
+    There, in-flight jobs never exceed the thread count, so HasherBusy comes
+    from the timeout unless the queue is sized below the threads.
+    '''
+
+    def __init__(self, bcrypt, app=None):
+        self.bcrypt = bcrypt
+        self._workers = 0
+        self._queue_size = 0
+        self._timeout = None
+        self._slots = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        self._timeout = app.config.get('PASSWORD_HASH_TIMEOUT')
+        self._queue_size = app.config.get('PASSWORD_HASH_QUEUE_SIZE', 0)
+        self._slots = threading.BoundedSemaphore(self._workers + self._queue_size)
+
+    def generate_password_hash(self, password):
+        with STAGE_SECONDS.time(stage='bcrypt_hash'):
+            return self._run(self.bcrypt.generate_password_hash, password)
+
+    def check_password_hash(self, pw_hash, password):
+        with STAGE_SECONDS.time(stage='bcrypt_check'):
+            return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def after_fork(self):
+        '''
+        Forgets the pool and in-flight jobs inherited from the parent process,
+        whose worker processes belong to the parent
+        '''
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self._workers + self._queue_size)
+
+    def _get_pool(self):
+        # Created lazily so the pool is always forked from the serving process
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self._workers)
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self._workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Password hashing queue is full')
+
+        try:
+            future = self._get_pool().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy('Password hashing timed out')
+
+
+def _hash(password, rounds):
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return _bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash, e.g. the placeholder of a row still being registered
+        return False
+
+
+class AsyncPasswordHasher:
+    '''
+    PasswordHasher for the ASGI app: bcrypt runs in a process pool (or the
+    event loop's default thread pool with 0 workers) while the loop keeps
+    serving, with the same bounded queue and timeout raising HasherBusy
+    '''
+
+    def __init__(self, rounds, workers=0, queue_size=0, timeout=None):
+        self.rounds = rounds
+        self._workers = workers
+        self._timeout = timeout
+        self._capacity = workers + queue_size if workers else None
+        self._in_flight = 0
+        self._pool = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['BCRYPT_LOG_ROUNDS'],
+                   workers=config.get('PASSWORD_HASH_WORKERS', 0),
+                   queue_size=config.get('PASSWORD_HASH_QUEUE_SIZE', 0),
+                   timeout=config.get('PASSWORD_HASH_TIMEOUT'))
+
+    async def generate_password_hash(self, password):
+        with STAGE_SECONDS.time(stage='bcrypt_hash'):
+            return await self._run(_hash, password, self.rounds)
+
+    async def check_password_hash(self, pw_hash, password):
+        with STAGE_SECONDS.time(stage='bcrypt_check'):
+            return await self._run(_check, pw_hash, password)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _run(self, func, *args):
+        if self._capacity is not None and self._in_flight >= self._capacity:
+            raise HasherBusy('Password hashing queue is full')
+
+        if self._workers and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+
+        future = asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+        self._in_flight += 1
+        future.add_done_callback(self._release)
+
+        try:
+            # Shielded so a timed-out hash keeps its slot until it really finishes
+            return await asyncio.wait_for(asyncio.shield(future), self._timeout)
+        except asyncio.TimeoutError:
+            raise HasherBusy('Password hashing timed out')
+
+    def _release(self, _):
+        self._in_flight -= 1
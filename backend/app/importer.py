@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from app import db, bcrypt
+from .models import User, normalize_email
+
+'''
+Helpers for streaming bulk user imports from CSV/JSONL files
+'''
+
+BCRYPT_HASH = re.compile(r'^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$')
+IMPORT_COLUMNS = ('public_id', 'username', 'email', 'email_normalized', 'password', 'date_joined')
+
+
+def read_rows(path, file_format, start_offset=0):
+    '''
+    Yields user dicts from a CSV (with header) or JSON Lines file, skipping
+    the first start_offset records without holding the file in memory
+    '''
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        yield from islice(records, start_offset, None)
+
+
+def chunked(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _hash_password(password):
+    return bcrypt.generate_password_hash(password).decode('utf-8')
+
+
+def hash_passwords(passwords, pool=None):
+    '''
+    Hashes plaintext passwords, passing pre-hashed bcrypt strings through as is
+    '''
+    plaintext = [p for p in passwords if not BCRYPT_HASH.match(p)]
+    if pool is not None:
+        hashed = iter(pool.map(_hash_password, plaintext, chunksize=max(1, len(plaintext) // 64)))
+    else:
+        hashed = map(_hash_password, plaintext)
+
+    return [p if BCRYPT_HASH.match(p) else next(hashed) for p in passwords]
+
+
+def prepare_chunk(records, pool=None):
+    '''
+    Validates a chunk, drops emails already present (in any letter case) in the
+    chunk or the user table, and hashes the remaining passwords. Returns (rows, skipped).
+    '''
+    # normalized email -> record
+    unique = {}
+    for record in records:
+        email = (record.get('email') or '').strip()
+        if email and record.get('username') and record.get('password'):
+            unique.setdefault(normalize_email(email), record)
+
+    if unique:
+        existing = db.session.query(User.email_normalized).filter(User.email_normalized.in_(list(unique)))
+        for (email_normalized,) in existing:
+            del unique[email_normalized]
+
+    passwords = hash_passwords([r['password'] for r in unique.values()], pool)
+    now = datetime.now(timezone.utc)
+
+    rows = [{'public_id': str(uuid.uuid4()),
+             'username': record['username'],
+             'email': record['email'].strip(),
+             'email_normalized': email_normalized,
+             'password': password,
+             'date_joined': now
+             } for (email_normalized, record), password in zip(unique.items(), passwords)]
+
+    return rows, len(records) - len(rows)
+
+
+def _copy_rows(rows):
+    '''
+    Postgres path: COPY the chunk into a temporary table, then move it across
+    with ON CONFLICT DO NOTHING so concurrent signups cannot fail the batch
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in IMPORT_COLUMNS])
+    buffer.seek(0)
+
+    columns = ', '.join(IMPORT_COLUMNS)
+    with db.session.connection().connection.cursor() as cursor:
+        # Only the imported columns: copying the id default would draw a
+        # sequence value per staged row on top of the one the insert draws
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS user_import ON COMMIT DELETE ROWS '
+                       f'AS SELECT {columns} FROM "user" WITH NO DATA')
+        cursor.copy_expert(f'COPY user_import ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(f'INSERT INTO "user" ({columns}) SELECT {columns} FROM user_import '
+                       'ON CONFLICT DO NOTHING')
+        return cursor.rowcount
+
+
+def load_rows(rows):
+    '''
+    Inserts a prepared chunk in one batch and commits it, returning the number
+    of rows inserted
+    '''
+    if not rows:
+        return 0
+
+    if db.engine.dialect.name == 'postgresql':
+        inserted = _copy_rows(rows)
+    else:
+        db.session.execute(User.__table__.insert(), rows)
+        inserted = len(rows)
+
+    db.session.commit()
+    return inserted
+
+
+def make_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers) if workers else None
@@ -0,0 +1,347 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+
+'''
+Prometheus-style metrics: route latency histograms, hot-path stage timings
+and per-worker counters, aggregated across gunicorn workers on /metrics
+'''
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def mean(self, **labels):
+        '''
+        Mean observed value of one series in this worker, 0 if unobserved
+        '''
+        series = self._values.get(_label_key(self.labelnames, labels))
+        return series[1] / series[2] if series else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(counts), total, count]
+                    for key, (counts, total, count) in self._values.items()]
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    '''
+    A value read from a callback at collection time, e.g. cache sizes. Values
+    from different workers are summed.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def snapshot(self):
+        if self.collect is not None:
+            return [[list(key), value] for key, value in self.collect().items()]
+        return super().snapshot()
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        gauge = self._register(Gauge(name, documentation, labelnames))
+        if collect is not None:
+            gauge.collect = collect
+        return gauge
+
+    def snapshot(self):
+        return {name: {'kind': metric.kind,
+                       'documentation': metric.documentation,
+                       'labelnames': list(metric.labelnames),
+                       'buckets': list(getattr(metric, 'buckets', ())),
+                       'values': metric.snapshot()
+                       } for name, metric in self.metrics.items()}
+
+
+def merge_snapshots(snapshots):
+    '''
+    Sums the series of several worker snapshots into one
+    '''
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for value in metric['values']:
+                key = tuple(value[0])
+                if metric['kind'] == 'histogram':
+                    counts, total, count = target['values'].get(key, ([0] * len(metric['buckets']), 0.0, 0))
+                    target['values'][key] = ([a + b for a, b in zip(counts, value[1])],
+                                             total + value[2], count + value[3])
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value[1]
+    return merged
+
+
+def render(merged):
+    '''
+    Renders merged snapshots in the Prometheus text exposition format
+    '''
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric['labelnames']
+
+        for key, value in sorted(metric['values'].items()):
+            pairs = list(zip(labelnames, key))
+            if metric['kind'] == 'histogram':
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric['buckets'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+                lines.append(f'{name}_sum{_format_labels(pairs)} {total}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {count}')
+            else:
+                lines.append(f'{name}{_format_labels(pairs)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds',
+                                     'Request latency by route, including after-request hooks',
+                                     ['method', 'route', 'status'])
+STAGE_SECONDS = REGISTRY.histogram('auth_stage_duration_seconds',
+                                   'Time spent in hot-path stages (bcrypt, sql, blocklist, token_refresh)',
+                                   ['stage'])
+
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+
+def _unmerge(merged):
+    '''
+    Turns merge_snapshots output back into the snapshot format
+    '''
+    snapshot = {}
+    for name, metric in merged.items():
+        if metric['kind'] == 'histogram':
+            values = [[list(key), counts, total, count] for key, (counts, total, count) in metric['values'].items()]
+        else:
+            values = [[list(key), value] for key, value in metric['values'].items()]
+        snapshot[name] = dict(metric, values=values)
+    return snapshot
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def mark_process_dead(directory, pid):
+    '''
+    Folds an exited worker's counter and histogram totals into the retained
+    dead-workers snapshot and deletes its own, dropping its gauges. Summed
+    counters so never go down when a worker is recycled.
+    '''
+    if not directory:
+        return
+
+    path = snapshot_path(directory, pid)
+    snapshot = _read_snapshot(path)
+    if snapshot is not None:
+        totals = {name: metric for name, metric in snapshot.items() if metric['kind'] != 'gauge'}
+        dead_path = snapshot_path(directory, 'dead')
+        merged = _unmerge(merge_snapshots([_read_snapshot(dead_path) or {}, totals]))
+        with open(f'{dead_path}.tmp', 'w') as f:
+            json.dump(merged, f)
+        os.replace(f'{dead_path}.tmp', dead_path)
+
+    for stale in (path, f'{path}.tmp'):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+
+def clear_snapshots(directory):
+    '''
+    Deletes every worker snapshot, for when the server starts
+    '''
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Metrics:
+    '''
+    Flask extension timing every request and serving /metrics. With
+    METRICS_MULTIPROC_DIR set, each worker periodically writes its snapshot to
+    that directory and /metrics sums the snapshots of all workers. The server
+    must clear the directory when it starts and mark each worker dead when it
+    exits (the gunicorn.conf.py hooks), or dead workers' gauges are counted forever.
+    '''
+
+    def __init__(self, registry=REGISTRY, app=None):
+        self.registry = registry
+        self.directory = None
+        self._flush_interval = 5.0
+        self._flushed_at = 0.0
+        self._timed_sql = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_MULTIPROC_DIR')
+        self._flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._start_timer)
+        app.after_request(self._observe_request)
+        app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', self.serve)
+        self._time_sql()
+
+    def _time_sql(self):
+        if self._timed_sql:
+            return
+
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+        @event.listens_for(Engine, 'after_cursor_execute')
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info['query_started'].pop()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='sql')
+
+        self._timed_sql = True
+
+    def _start_timer(self):
+        g.request_started = time.perf_counter()
+
+    def _observe_request(self, response):
+        started = g.pop('request_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                    route=route, status=response.status_code)
+
+        if self.directory and time.monotonic() - self._flushed_at >= self._flush_interval:
+            self.flush()
+        return response
+
+    def flush(self):
+        '''
+        Writes this worker's snapshot where the other workers can read it
+        '''
+        path = snapshot_path(self.directory, os.getpid())
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+        self._flushed_at = time.monotonic()
+
+    def collect(self):
+        if not self.directory:
+            return merge_snapshots([self.registry.snapshot()])
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge_snapshots(snapshots)
+
+    def serve(self):
+        return Response(render(self.collect()), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from sqlalchemy import inspect, text
+from .models import User, normalize_email
+
+'''
+Online schema migrations run from the CLI against an existing database
+'''
+
+EMAIL_NORMALIZED_INDEX = 'ix_user_email_normalized'
+
+# Columns added to "user" since its first release, with their DDL. Each is
+# nullable or has a constant default, so adding it does not rewrite the table.
+USER_COLUMNS = {'token_epoch': 'INTEGER NOT NULL DEFAULT 0',
+                'last_login': 'TIMESTAMP WITH TIME ZONE',
+                'last_seen': 'TIMESTAMP WITH TIME ZONE'
+                }
+
+
+class DuplicateEmails(Exception):
+    '''
+    Raised when existing users differ only by email case, so the unique
+    normalized index cannot be built until they are merged or renamed
+    '''
+
+    def __init__(self, duplicates):
+        super().__init__(f'{len(duplicates)} normalized emails are shared by several users')
+        self.duplicates = duplicates
+
+
+def add_user_columns(engine):
+    '''
+    Adds the USER_COLUMNS missing from an existing user table, returning the
+    names of those added; safe to re-run
+    '''
+    columns = {column['name'] for column in inspect(engine).get_columns(User.__tablename__)}
+    missing = [name for name in USER_COLUMNS if name not in columns]
+    # IF NOT EXISTS keeps concurrent runs on Postgres from failing
+    if_not_exists = 'IF NOT EXISTS ' if engine.dialect.name == 'postgresql' else ''
+
+    with engine.begin() as conn:
+        for name in missing:
+            conn.execute(text(f'ALTER TABLE "user" ADD COLUMN {if_not_exists}{name} {USER_COLUMNS[name]}'))
+    return missing
+
+
+def add_email_normalized_column(engine):
+    '''
+    Adds user.email_normalized as a nullable column, returning whether it was
+    missing. Nullable so the ALTER does not rewrite or lock the table for long.
+    '''
+    columns = {column['name'] for column in inspect(engine).get_columns(User.__tablename__)}
+    if 'email_normalized' in columns:
+        return False
+
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE "user" ADD COLUMN email_normalized VARCHAR(75)'))
+    return True
+
+
+def backfill_email_normalized(engine, batch_size=1000):
+    '''
+    Fills email_normalized for rows still missing it, in id order one batch
+    per transaction, returning the number of rows updated. Rows signed up
+    while this runs are written by the application with the column set.
+    '''
+    select_batch = text('SELECT id, email FROM "user" WHERE email_normalized IS NULL AND id > :last_id '
+                        'ORDER BY id LIMIT :batch_size')
+    update_row = text('UPDATE "user" SET email_normalized = :email_normalized WHERE id = :row_id')
+
+    updated, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_batch, {'last_id': last_id, 'batch_size': batch_size}).fetchall()
+            if not rows:
+                return updated
+
+            conn.execute(update_row, [{'row_id': row_id, 'email_normalized': normalize_email(email)}
+                                      for row_id, email in rows])
+        updated, last_id = updated + len(rows), rows[-1][0]
+
+
+def find_duplicate_emails(engine):
+    '''
+    {normalized email: [emails]} for every normalized email held by more than one user
+    '''
+    with engine.connect() as conn:
+        rows = conn.execute(text('SELECT email, email_normalized FROM "user" WHERE email_normalized IN '
+                                 '(SELECT email_normalized FROM "user" GROUP BY email_normalized '
+                                 'HAVING COUNT(*) > 1) ORDER BY id'))
+        duplicates = defaultdict(list)
+        for email, email_normalized in rows:
+            duplicates[email_normalized].append(email)
+    return dict(duplicates)
+
+
+def index_is_valid(conn, name):
+    '''
+    Whether the Postgres index exists and is valid, None if it does not exist.
+    A CONCURRENTLY build that failed or was interrupted leaves it invalid.
+    '''
+    return conn.execute(text('SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                             'WHERE c.relname = :name AND pg_table_is_visible(c.oid)'),
+                        {'name': name}).scalar()
+
+
+def create_email_normalized_index(engine):
+    '''
+    Builds the unique index on email_normalized and makes the column NOT NULL.
+    On Postgres the index is built CONCURRENTLY, outside a transaction, so
+    signups and logins keep running while it builds; an invalid index left by
+    an interrupted earlier build is dropped and rebuilt.
+    '''
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if index_is_valid(conn, EMAIL_NORMALIZED_INDEX) is False:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_NORMALIZED_INDEX}'))
+            conn.execute(text(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {EMAIL_NORMALIZED_INDEX} '
+                              'ON "user" (email_normalized)'))
+            conn.execute(text('ALTER TABLE "user" ALTER COLUMN email_normalized SET NOT NULL'))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {EMAIL_NORMALIZED_INDEX} '
+                              'ON "user" (email_normalized)'))
+
+
+def normalize_emails(engine, batch_size=1000):
+    '''
+    Adds, backfills and indexes user.email_normalized; safe to re-run. Raises
+    DuplicateEmails, before building the index, if users collide once
+    normalized. Returns (column added, rows backfilled).
+    '''
+    added = add_email_normalized_column(engine)
+    updated = backfill_email_normalized(engine, batch_size)
+
+    duplicates = find_duplicate_emails(engine)
+    if duplicates:
+        raise DuplicateEmails(duplicates)
+
+    create_email_normalized_index(engine)
+    return added, updated
@@ -1,5 +1,27 @@
-from app import db, bcrypt
+from app import db, hasher
+from app.hashing import hash_rounds
 from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import inspect, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached, validates
+
+# Stored while a new row awaits its hash; never matches a bcrypt check
+UNUSABLE_PASSWORD = '!'
+
+
+def normalize_email(email):
+    '''
+    The key users are looked up and deduplicated by: Admin@X.com and
+    admin@x.com are the same account
+    '''
+    return email.strip().lower()
+
+
+def _email_normalized_default(context):
+    # Core inserts (register, importer, ASGI signup) that only pass email
+    return normalize_email(context.get_current_parameters()['email'])
 
 
 class User(db.Model):
@@ -7,22 +29,114 @@ class User(db.Model):
     public_id = db.Column(db.String(50), nullable=False, unique=True, index=True)
     username = db.Column(db.String(50), nullable=False)
     email = db.Column(db.String(75), nullable=False, unique=True, index=True)
+    # Maintained from email; every lookup by email goes through this index
+    email_normalized = db.Column(db.String(75), nullable=False, unique=True, index=True,
+                                 default=_email_normalized_default)
     password = db.Column(db.String(60), nullable=False)
     date_joined = db.Column(db.DateTime(), default=datetime.now(timezone.utc))
+    token_epoch = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Written behind by app.activity, so up to ACTIVITY_FLUSH_INTERVAL seconds old
+    last_login = db.Column(db.DateTime(timezone=True), nullable=True)
+    last_seen = db.Column(db.DateTime(timezone=True), nullable=True)
 
     def __repr__(self):
         return f'User {self.username}'
 
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.email_normalized = normalize_email(email)
+        return email
+
+    @classmethod
+    def by_email(cls, email):
+        return cls.query.filter_by(email_normalized=normalize_email(email))
+
     def set_password(self, _password):
-        self.password = bcrypt.generate_password_hash(_password).decode('utf-8')
+        self.password = hasher.generate_password_hash(_password).decode('utf-8')
 
     def check_password(self, _password):
-        return bcrypt.check_password_hash(self.password, _password)
+        return hasher.check_password_hash(self.password, _password)
+
+    def needs_rehash(self):
+        '''
+        Whether the stored hash uses a different cost than the configured one
+        '''
+        return hash_rounds(self.password) != current_app.config['BCRYPT_LOG_ROUNDS']
 
     def save(self):
+        # A rotated public_id must stop resolving on every worker; other workers'
+        # copies of the current one are dropped and it is re-cached fresh here
+        attrs = inspect(self).attrs
+        replaced_public_ids = attrs.public_id.history.deleted
+        replaced_emails = attrs.email_normalized.history.deleted
+
         db.session.add(self)
         db.session.commit()
 
+        current_app.replicas.stick(self.public_id, self.email_normalized, *replaced_public_ids, *replaced_emails)
+        current_app.identity_cache.invalidate(*replaced_public_ids, self.public_id)
+        current_app.identity_cache.put(self)
+
+    @classmethod
+    def register(cls, public_id, username, email, password):
+        '''
+        Creates the user unless the email is already taken in any letter case,
+        returning whether it was created. The insert doubles as the existence
+        check (ON CONFLICT DO NOTHING), so a duplicate costs one statement and
+        no bcrypt work; the row is only committed once its password hash has
+        been filled in.
+        '''
+        values = {'public_id': public_id,
+                  'username': username,
+                  'email': email,
+                  'password': UNUSABLE_PASSWORD
+                  }
+
+        try:
+            if not cls._insert_if_absent(values):
+                db.session.rollback()
+                return False
+
+            password_hash = hasher.generate_password_hash(password).decode('utf-8')
+            table = cls.__table__
+            db.session.execute(update(table)
+                               .where(table.c.email_normalized == normalize_email(email))
+                               .values(password=password_hash))
+            db.session.commit()
+            current_app.replicas.stick(public_id, normalize_email(email))
+            return True
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def _insert_if_absent(cls, values):
+        table = cls.__table__
+        dialect = db.engine.dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert_stmt = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            result = db.session.execute(insert_stmt(table).values(**values).on_conflict_do_nothing())
+            return result.rowcount == 1
+
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(table).values(**values))
+            return True
+        except IntegrityError:
+            return False
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        '''
+        Attaches a User built from a cached snapshot to the session as an already
+        persisted row, so it can be updated without first being selected
+        '''
+        user = cls(**snapshot._asdict())
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def to_dict(self):
         user_dict = {}
         user_dict['_id'] = self.id
@@ -0,0 +1,173 @@
+import time
+from urllib.parse import urlsplit
+from flask_sqlalchemy import get_state
+from redis import BlockingConnectionPool, Redis
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from .metrics import REGISTRY
+
+'''
+Per-worker sizing and instrumentation of the database and Redis connection pools
+'''
+
+POOL_WAIT = REGISTRY.histogram('pool_wait_seconds', 'Time spent obtaining a pooled connection', ['pool'],
+                               buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+POOL_TIMEOUTS = REGISTRY.counter('pool_timeouts_total',
+                                 'Connection requests that gave up waiting for a free connection', ['pool'])
+
+
+def pool_sizes(config):
+    '''
+    (pool_size, max_overflow) for one worker's engine: a connection per request
+    thread plus one for the activity flusher, with as many again as overflow,
+    capped so WEB_CONCURRENCY workers stay within DATABASE_MAX_CONNECTIONS
+    '''
+    threads = config['WORKER_THREADS']
+    size = config['DATABASE_POOL_SIZE'] or threads + 1
+    overflow = config['DATABASE_MAX_OVERFLOW']
+    if overflow is None:
+        overflow = threads
+
+    if config['DATABASE_MAX_CONNECTIONS']:
+        per_worker = max(1, config['DATABASE_MAX_CONNECTIONS'] // config['WEB_CONCURRENCY'])
+        size = min(size, per_worker)
+        overflow = max(0, min(overflow, per_worker - size))
+
+    return size, overflow
+
+
+def engine_options(config):
+    '''
+    SQLALCHEMY_ENGINE_OPTIONS for the primary and replica engines. SQLite keeps
+    SQLAlchemy's own single-connection pools.
+    '''
+    uri = config['SQLALCHEMY_DATABASE_URI'] or ''
+    if uri.startswith('sqlite'):
+        return {}
+
+    size, overflow = pool_sizes(config)
+    options = {'poolclass': InstrumentedQueuePool,
+               'pool_size': size,
+               'max_overflow': overflow,
+               'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+               'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+               'pool_pre_ping': config['DATABASE_POOL_PRE_PING']
+               }
+    if uri.startswith('postgres'):
+        options['connect_args'] = {'connect_timeout': config['DATABASE_CONNECT_TIMEOUT']}
+    return options
+
+
+class InstrumentedQueuePool(QueuePool):
+    '''
+    QueuePool recording how long checkouts wait (including opening a new
+    connection) and how often they time out
+    '''
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc(pool='database')
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started, pool='database')
+
+
+class InstrumentedBlockingConnectionPool(BlockingConnectionPool):
+    '''
+    Redis pool capped at max_connections, where callers wait up to timeout for
+    a free connection instead of opening more, recording waits and timeouts
+    '''
+
+    def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except RedisConnectionError as error:
+            if str(error) == 'No connection available.':
+                POOL_TIMEOUTS.inc(pool='redis')
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started, pool='redis')
+
+    def stats(self):
+        return {'in_use': self.max_connections - self.pool.qsize(),
+                'open': len(self._connections),
+                'capacity': self.max_connections
+                }
+
+
+def redis_max_connections(config, url=None):
+    '''
+    One connection per request thread and one spare, plus on the REDIS_URL
+    client one held permanently by each enabled pub/sub listener (revocation
+    cache, identity cache broadcast)
+    '''
+    if config['REDIS_MAX_CONNECTIONS']:
+        return config['REDIS_MAX_CONNECTIONS']
+
+    listeners = 0
+    if url is None:
+        listeners = sum(1 for setting in ('REVOCATION_CACHE_ENABLED', 'IDENTITY_CACHE_BROADCAST')
+                        if config.get(setting))
+    return config['WORKER_THREADS'] + 1 + listeners
+
+
+def redis_client(config, url=None):
+    '''
+    Blocklist Redis client (for REDIS_URL unless url is given), sized by
+    redis_max_connections. Commands fail fast on a dead server and retry with
+    jittered backoff, so a Redis restart does not turn into every worker
+    reconnecting in lockstep.
+    '''
+    max_connections = redis_max_connections(config, url)
+    pool = InstrumentedBlockingConnectionPool.from_url(
+        url or config['REDIS_URL'],
+        max_connections=max_connections,
+        timeout=config['REDIS_POOL_TIMEOUT'],
+        socket_timeout=config['REDIS_SOCKET_TIMEOUT'],
+        socket_connect_timeout=config['REDIS_SOCKET_TIMEOUT'],
+        health_check_interval=config['REDIS_HEALTH_CHECK_INTERVAL'],
+        retry=Retry(EqualJitterBackoff(cap=1.0, base=0.05), config['REDIS_RETRIES']),
+        retry_on_error=[RedisConnectionError, RedisTimeoutError])
+    return Redis(connection_pool=pool)
+
+
+def redis_node_name(url):
+    '''
+    host:port/db of a Redis URL, without its credentials, for metric labels
+    '''
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}/{parts.path.lstrip('/') or 0}"
+
+
+def pool_stats(app):
+    '''
+    {(pool, state): connections} for the app's database engines and Redis client
+    '''
+    stats = {}
+    for bind, connector in get_state(app).connectors.items():
+        engine = connector._engine
+        if engine is None or not isinstance(engine.pool, QueuePool):
+            continue
+
+        name = f'database:{bind}' if bind else 'database'
+        stats[(name, 'in_use')] = engine.pool.checkedout()
+        stats[(name, 'open')] = engine.pool.checkedout() + engine.pool.checkedin()
+        stats[(name, 'capacity')] = engine.pool.size() + engine.pool._max_overflow
+
+    redis_pool = getattr(app.redis_blocklist, 'connection_pool', None)
+    if isinstance(redis_pool, InstrumentedBlockingConnectionPool):
+        stats.update({('redis', state): value for state, value in redis_pool.stats().items()})
+
+    for node, client in app.blocklist_nodes.items():
+        if isinstance(client.connection_pool, InstrumentedBlockingConnectionPool):
+            stats.update({(f'redis:{node}', state): value
+                          for state, value in client.connection_pool.stats().items()})
+
+    return stats
@@ -0,0 +1,104 @@
+import logging
+import random
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from redis.exceptions import RedisError
+from sqlalchemy import orm
+from sqlalchemy.sql import Select
+
+'''
+Routing of read queries to read replicas, with read-your-writes stickiness
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    '''
+    Picks a replica bind for reads unless the current request is pinned to
+    the primary. A request pins itself once it writes, and User writes mark
+    the user (by public_id and email) sticky in Redis for sticky_seconds, so
+    later requests about them read the primary on every worker until the
+    replicas have caught up.
+    '''
+
+    KEY_PREFIX = 'replica_sticky:'
+
+    def __init__(self, binds, redis, sticky_seconds):
+        self.binds = list(binds)
+        self.redis = redis
+        self.sticky_ms = max(1, int(sticky_seconds * 1000))
+
+    def _key(self, key):
+        return f'{self.KEY_PREFIX}{key}'
+
+    def choose(self):
+        return random.choice(self.binds)
+
+    def pin_primary(self):
+        if has_app_context():
+            g._read_primary = True
+
+    def pinned(self):
+        return not self.binds or (has_app_context() and g.get('_read_primary', False))
+
+    def stick(self, *keys):
+        '''
+        Sends this request's and, for the window, later requests' reads about
+        keys to the primary
+        '''
+        if not self.binds:
+            return
+
+        self.pin_primary()
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(self._key(key), 1, px=self.sticky_ms)
+                pipe.execute()
+        except RedisError:
+            logger.warning('Could not record replica stickiness', exc_info=True)
+
+    def pin_if_recent(self, *keys):
+        '''
+        Pins the request to the primary if any of keys was written within the window
+        '''
+        if self.pinned():
+            return
+
+        try:
+            recent = any(self.redis.mget([self._key(key) for key in keys]))
+        except RedisError:
+            # Unknown: the primary is never stale
+            recent = True
+
+        if recent:
+            self.pin_primary()
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session sending plain SELECTs to a replica chosen by app.replicas. Anything
+    else (flushes, Core writes, SELECT ... FOR UPDATE, bare connections) uses
+    the primary and pins the rest of the request to it.
+    '''
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        router = getattr(self.app, 'replicas', None)
+        if router is None or router.pinned():
+            return super().get_bind(mapper, clause)
+
+        if isinstance(clause, Select) and clause._for_update_arg is None:
+            return get_state(self.app).db.get_engine(self.app, bind=router.choose())
+
+        router.pin_primary()
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_binds(uris):
+    return {f'replica_{i}': uri for i, uri in enumerate(uris)}
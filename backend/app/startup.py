@@ -0,0 +1,90 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
+from .metrics import REGISTRY
+
+'''
+Startup phase timings and what makes gunicorn --preload safe: the app is
+built once in the master, and forked workers open their own connections
+instead of using (or closing) the ones they inherited
+'''
+
+logger = logging.getLogger(__name__)
+
+# phase -> seconds spent in it by this process
+PHASES = {}
+
+REGISTRY.gauge('startup_phase_seconds', 'Seconds spent importing and building the app, per phase', ['phase'],
+               collect=lambda: {(phase,): seconds for phase, seconds in PHASES.items()})
+
+
+def record_phase(phase, seconds):
+    PHASES[phase] = PHASES.get(phase, 0.0) + seconds
+    logger.info('startup phase %s took %.1f ms', phase, seconds * 1000)
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def _detach(dbapi_connection):
+    '''
+    Points an inherited connection's socket at /dev/null in this process, so
+    closing it here (which sends the server a Terminate) cannot end the
+    session still used by the process it was inherited from
+    '''
+    fileno = getattr(dbapi_connection, 'fileno', None)
+    if fileno is None:
+        return
+
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(devnull, fileno())
+    finally:
+        os.close(devnull)
+
+
+def _record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    pid = connection_record.info.get('pid')
+    if pid is not None and pid != os.getpid():
+        _detach(dbapi_connection)
+        # The pool invalidates the record and retries with a connection of our own
+        raise exc.DisconnectionError(f'Connection opened by pid {pid}, not reusing it in {os.getpid()}')
+
+
+def install_fork_guard():
+    '''
+    Makes every pool refuse connections opened by another process: a checkout
+    in a forked child (gunicorn worker, bcrypt or importer pool process)
+    detaches the inherited connection and opens a fresh one, leaving the
+    parent's session intact
+    '''
+    if not event.contains(Pool, 'checkout', _check_pid):
+        event.listen(Pool, 'connect', _record_pid)
+        event.listen(Pool, 'checkout', _check_pid)
+
+
+def reset_after_fork():
+    '''
+    Run from gunicorn's post_fork hook in each worker: the bcrypt process pool
+    inherited from the master is forgotten and recreated on first use.
+    Database connections are handled on checkout by install_fork_guard,
+    redis-py pools reset themselves when they notice a new pid, and the
+    background threads (revocation and identity caches, activity flusher)
+    start lazily in the serving process.
+    '''
+    from . import hasher
+
+    hasher.after_fork()
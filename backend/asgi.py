@@ -0,0 +1,6 @@
+from app.asgi import create_asgi_app
+from config import configs
+
+
+# Async serving mode, e.g. `uvicorn asgi:app --workers 4`
+app = create_asgi_app(config_class=configs['DevelopmentConfig'])
@@ -0,0 +1,4 @@
+#For packaging
+'''
+Load/benchmark suite driving the auth API through realistic request mixes
+'''
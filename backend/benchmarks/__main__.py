@@ -0,0 +1,77 @@
+import json
+import sys
+import click
+from .auth import DEFAULT_MIX, compare, make_config, parse_mix, run_benchmark
+
+'''
+Command line entry point: python -m benchmarks --help
+'''
+
+
+def _format_mix(mix):
+    return ','.join(f'{route}={weight:g}' for route, weight in mix.items())
+
+
+@click.command()
+@click.option('--concurrency', '-c', default=8, show_default=True, help='Concurrent client sessions')
+@click.option('--duration', '-d', default=10.0, show_default=True, help='Seconds to run for')
+@click.option('--requests', '-n', 'requests_per_client', type=int,
+              help='Stop each client after this many operations instead of at the deadline')
+@click.option('--mix', default=_format_mix(DEFAULT_MIX), show_default=True,
+              help='Route weights, e.g. signup=1,login=4,update=10,logout=1')
+@click.option('--database-url', help='Benchmark against this database instead of a temporary sqlite file')
+@click.option('--redis-url', help='Use this Redis for the blocklist instead of fakeredis')
+@click.option('--bcrypt-rounds', type=int, help='Override BCRYPT_LOG_ROUNDS (default: the production cost)')
+@click.option('--hash-workers', type=int, help='Override PASSWORD_HASH_WORKERS')
+@click.option('--seed', default=0, show_default=True, help='Random seed for the request mix')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Write the JSON report here')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Diff against a previous JSON report')
+@click.option('--threshold', default=0.10, show_default=True, help='Relative change counted as a regression')
+@click.option('--max-error-rate', default=0.01, show_default=True,
+              help='Fail the run when more than this share of requests get a non-2xx response')
+def main(concurrency, duration, requests_per_client, mix, database_url, redis_url,
+         bcrypt_rounds, hash_workers, seed, output, baseline_path, threshold, max_error_rate):
+    '''Benchmark the auth API routes and report per-route throughput and latency'''
+
+    config_class = make_config(database_url, redis_url, bcrypt_rounds, hash_workers)
+    report = run_benchmark(config_class, concurrency, duration, requests_per_client, parse_mix(mix), seed)
+
+    click.echo(f"{'route':<8} {'reqs':>7} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in sorted(report['routes'].items()):
+        click.echo(f"{route:<8} {stats['requests']:>7} {stats['errors']:>6} {stats['throughput']:>9.1f} "
+                   f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    click.echo(f"total    {report['requests']:>7} {report['errors']:>6} {report['throughput']:>9.1f}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f'Report written to {output}')
+
+    failed = report['error_rate'] > max_error_rate
+    if failed:
+        click.echo(f"Error rate {report['error_rate']:.1%} exceeds {max_error_rate:.1%}", err=True)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, threshold)
+
+        baseline_rounds = baseline.get('meta', {}).get('bcrypt_rounds')
+        if baseline_rounds != report['meta']['bcrypt_rounds']:
+            click.echo(f"Warning: baseline hashed at bcrypt cost {baseline_rounds}, "
+                       f"this run at {report['meta']['bcrypt_rounds']}", err=True)
+
+        regressions = [row for row in rows if row['regression']]
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            click.echo(f"{row['route']:<8} {row['metric']:<10} {row['baseline']:>10.2f} -> "
+                       f"{row['current']:>10.2f} ({row['change']:+.1%}){flag}")
+        failed = failed or bool(regressions)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from app import create_app, db
+from config import Config, TestingConfig
+
+'''
+Drives create_app through a weighted mix of signup/login/update/logout calls
+from concurrent clients and reports per-route throughput and latency
+'''
+
+ROUTES = {'signup': ('POST', '/api/users/signup'),
+          'login': ('POST', '/api/users/login'),
+          'update': ('PUT', '/api/users/update'),
+          'logout': ('POST', '/api/users/logout')
+          }
+
+DEFAULT_MIX = {'signup': 1, 'login': 4, 'update': 10, 'logout': 1}
+PASSWORD = 'benchmarkpassword'
+
+
+def parse_mix(value):
+    '''
+    Parses "signup=1,login=4,update=10,logout=1" into route weights
+    '''
+    mix = {}
+    for part in value.split(','):
+        route, weight = part.split('=')
+        if route not in ROUTES:
+            raise ValueError(f'Unknown route {route!r}, expected one of {", ".join(ROUTES)}')
+        mix[route] = float(weight)
+    return mix
+
+
+def make_config(database_url=None, redis_url=None, bcrypt_rounds=None, hash_workers=None):
+    '''
+    Builds a config class on top of TestingConfig (sqlite + fakeredis), switching
+    to a real database and/or Redis when their URLs are given. The bcrypt cost
+    is pinned to the production default unless bcrypt_rounds is given, so
+    reports from different commits hash at the same cost.
+    '''
+    # Every simulated user logs in from one address, far past any login throttle
+    overrides = {'SECRET_KEY': TestingConfig.SECRET_KEY or 'benchmark',
+                 'JWT_SECRET_KEY': TestingConfig.JWT_SECRET_KEY or 'benchmark',
+                 'LOGIN_THROTTLE_ENABLED': False,
+                 'BCRYPT_LOG_ROUNDS': Config.BCRYPT_LOG_ROUNDS if bcrypt_rounds is None else bcrypt_rounds,
+                 'BCRYPT_TARGET_MS': None}
+
+    if database_url:
+        overrides['SQLALCHEMY_DATABASE_URI'] = database_url
+    else:
+        # In-memory sqlite is private to one connection, so threads need a file
+        path = os.path.join(tempfile.mkdtemp(prefix='auth-bench-'), 'bench.db')
+        overrides['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+
+    if redis_url:
+        overrides['TESTING'] = False
+        overrides['REDIS_URL'] = redis_url
+    if hash_workers is not None:
+        overrides['PASSWORD_HASH_WORKERS'] = hash_workers
+
+    return type('BenchmarkConfig', (TestingConfig,), overrides)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    '''
+    Thread-safe collection of per-route latencies and status codes; any
+    non-2xx response counts as an error
+    '''
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+            if not 200 <= status < 300:
+                self.errors[route] += 1
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, values in self.latencies.items():
+            values = sorted(values)
+            routes[route] = {'requests': len(values),
+                             'errors': self.errors[route],
+                             'error_rate': self.errors[route] / len(values),
+                             'throughput': len(values) / elapsed,
+                             'mean_ms': sum(values) / len(values) * 1000,
+                             'p50_ms': percentile(values, 50) * 1000,
+                             'p95_ms': percentile(values, 95) * 1000,
+                             'p99_ms': percentile(values, 99) * 1000,
+                             'statuses': dict(self.statuses[route])
+                             }
+
+        total = sum(r['requests'] for r in routes.values())
+        errors = sum(r['errors'] for r in routes.values())
+        return {'elapsed_s': elapsed,
+                'requests': total,
+                'errors': errors,
+                'error_rate': errors / total if total else 0.0,
+                'throughput': total / elapsed,
+                'routes': routes
+                }
+
+
+class VirtualUser:
+    '''
+    One client session: signs up once, then performs weighted operations,
+    logging in first whenever an operation needs a valid token
+    '''
+
+    def __init__(self, app, recorder, name, rng):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.rng = rng
+        self.name = name
+        self.email = f'{name}@bench.local'
+        self.signups = 0
+        self.logged_in = False
+
+    def _call(self, route, payload=None):
+        method, path = ROUTES[route]
+        headers = {'Content-Type': 'application/json'}
+        csrf = self._cookie('csrf_access_token')
+        if csrf:
+            headers['X-CSRF-TOKEN'] = csrf
+
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, headers=headers,
+                                    data=json.dumps(payload or {}))
+        self.recorder.record(route, time.perf_counter() - started, response.status_code)
+        return response
+
+    def _cookie(self, name):
+        for cookie in self.client.cookie_jar:
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def signup(self, email=None):
+        self.signups += 1
+        return self._call('signup', {'username': self.name[:50],
+                                     'email': email or f'{self.name}-{self.signups}@bench.local',
+                                     'password': PASSWORD})
+
+    def login(self):
+        response = self._call('login', {'email': self.email, 'password': PASSWORD})
+        self.logged_in = response.status_code == 200
+
+    def update(self):
+        if not self.logged_in:
+            self.login()
+        self._call('update', {'username': f'{self.name}-{self.rng.randrange(10 ** 6)}'[:50]})
+
+    def logout(self):
+        if not self.logged_in:
+            self.login()
+        self._call('logout')
+        self.logged_in = False
+
+    def run(self, mix, deadline, max_ops):
+        self.signup(self.email)
+        routes, weights = zip(*mix.items())
+        ops = 0
+
+        while time.monotonic() < deadline and (max_ops is None or ops < max_ops):
+            getattr(self, self.rng.choices(routes, weights)[0])()
+            ops += 1
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(config_class, concurrency=8, duration=10.0, requests_per_client=None,
+                  mix=None, seed=0):
+    '''
+    Runs the workload and returns a JSON-serialisable report
+    '''
+    mix = mix or DEFAULT_MIX
+    app = create_app(config_class)
+    recorder = Recorder()
+
+    with app.app_context():
+        db.create_all()
+
+    clients = [VirtualUser(app, recorder, f'bench-{seed}-{i}', random.Random(seed + i))
+               for i in range(concurrency)]
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=c.run, args=(mix, deadline, requests_per_client))
+               for c in clients]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = recorder.summary(elapsed)
+    report['meta'] = {'revision': git_revision(),
+                      'timestamp': datetime.now(timezone.utc).isoformat(),
+                      'database': config_class.SQLALCHEMY_DATABASE_URI.split(':', 1)[0],
+                      'redis': 'fakeredis' if config_class.TESTING else 'redis',
+                      'bcrypt_rounds': config_class.BCRYPT_LOG_ROUNDS,
+                      'concurrency': concurrency,
+                      'duration_s': duration,
+                      'requests_per_client': requests_per_client,
+                      'mix': mix
+                      }
+    return report
+
+
+def compare(baseline, current, threshold=0.10):
+    '''
+    Lists per-route changes of throughput and p50/p95/p99 latency between two
+    reports, flagging changes worse than threshold as regressions
+    '''
+    rows = []
+    for route, now in current['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+
+        for metric, higher_is_better in (('throughput', True), ('p50_ms', False),
+                                         ('p95_ms', False), ('p99_ms', False)):
+            change = (now[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            worse = -change if higher_is_better else change
+            rows.append({'route': route,
+                         'metric': metric,
+                         'baseline': before[metric],
+                         'current': now[metric],
+                         'change': change,
+                         'regression': worse > threshold
+                         })
+    return rows
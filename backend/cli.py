@@ -1,19 +1,150 @@
 import os
 import sys
+import time
 import click
 from flask.cli import with_appcontext
 
 
 @click.command('test')
 @click.argument('directory', nargs=1)
+@click.option('--workers', '-n', default='auto', show_default=True,
+              help="Parallel test processes, 'auto' for one per core or 0 to run serially")
 @with_appcontext
-def test(directory):
+def test(directory, workers):
     '''Run tests with coverage for specified directory'''
 
     if sys.prefix == sys.base_prefix:
         print('You must first activate the virtual environment')
 
     else:
-        os.system(f'pytest --cov={directory} -v')
+        # Each xdist process gets its own in-memory database and fakeredis servers
+        if workers == 'auto' and (os.cpu_count() or 1) == 1:
+            workers = '0'
+        parallel = f' -n {workers}' if workers != '0' else ''
+        os.system(f'pytest --cov={directory}{parallel} -v')
         os.system('rm .coverage')
 
+
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format, inferred from the file extension by default')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows hashed and inserted per batch')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+              help='Processes used for bcrypt hashing, 0 to hash inline')
+@click.option('--start-offset', default=0, help='Input records to skip before importing')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='File recording the next offset after each committed chunk, resumed from if present')
+@with_appcontext
+def import_users(path, file_format, chunk_size, workers, start_offset, checkpoint):
+    '''Stream users from a CSV/JSONL file into the user table in batches'''
+    from app.importer import read_rows, chunked, prepare_chunk, load_rows, make_pool
+
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            start_offset = int(f.read().strip() or 0)
+        click.echo(f'Resuming from offset {start_offset}')
+
+    offset, inserted, skipped = start_offset, 0, 0
+    started = time.perf_counter()
+    pool = make_pool(workers)
+
+    try:
+        for chunk in chunked(read_rows(path, file_format, start_offset), chunk_size):
+            rows, chunk_skipped = prepare_chunk(chunk, pool)
+            loaded = load_rows(rows)
+            inserted += loaded
+            skipped += chunk_skipped + len(rows) - loaded
+            offset += len(chunk)
+
+            if checkpoint:
+                with open(checkpoint, 'w') as f:
+                    f.write(str(offset))
+
+            rate = (offset - start_offset) / (time.perf_counter() - started)
+            click.echo(f'offset {offset}: {inserted} inserted, {skipped} skipped, {rate:.0f} rows/s')
+
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'Imported {inserted} users ({skipped} skipped) from {offset - start_offset} records '
+               f'in {elapsed:.1f}s, {(offset - start_offset) / max(elapsed, 1e-9):.0f} rows/s')
+
+
+@click.command('export-users')
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', 'file_format', type=click.Choice(['jsonl', 'csv']), default='jsonl', show_default=True)
+@click.option('--batch-size', default=1000, show_default=True, help='Users fetched per keyset page')
+@click.option('--after-id', default=0, help='Only export users with a greater id')
+@click.option('--limit', type=int, help='Maximum number of users to export')
+@with_appcontext
+def export_users(output, file_format, batch_size, after_id, limit):
+    '''Stream users ordered by id to a JSONL/CSV file (stdout by default)'''
+    from app.exporter import SERIALIZERS, iter_users
+
+    serialize, _ = SERIALIZERS[file_format]
+    exported, last_id = 0, after_id
+
+    def counted(users):
+        nonlocal exported, last_id
+        for user in users:
+            exported, last_id = exported + 1, user.id
+            yield user
+
+    started = time.perf_counter()
+    for chunk in serialize(counted(iter_users(batch_size, after_id, limit))):
+        output.write(chunk)
+
+    # Progress goes to stderr so stdout stays a clean export
+    click.echo(f'Exported {exported} users in {time.perf_counter() - started:.1f}s, '
+               f'resume with --after-id {last_id}', err=True)
+
+
+@click.command('blocklist-memory')
+@with_appcontext
+def blocklist_memory():
+    '''Report the Redis keys, revoked jtis and memory held by the JWT blocklist'''
+    from flask import current_app
+
+    report = current_app.blocklist.store.memory_report()
+    click.echo(f"backend: {report['backend']}")
+    click.echo(f"keys: {report['keys']}")
+    click.echo(f"revoked tokens: {report['entries']}")
+
+    if report['bytes'] is None:
+        click.echo('memory: unavailable (server does not support MEMORY USAGE)')
+    else:
+        per_token = report['bytes'] / report['entries'] if report['entries'] else 0
+        click.echo(f"memory: {report['bytes']} bytes, {per_token:.1f} bytes per revoked token")
+
+
+@click.command('add-user-columns')
+@with_appcontext
+def add_user_columns():
+    '''Add the user columns newer releases need to an existing database; safe to re-run'''
+    from app import db
+    from app.migrations import add_user_columns as migrate
+
+    added = migrate(db.engine)
+    click.echo(f"Added {', '.join(added)}" if added else 'All user columns in place')
+
+
+@click.command('normalize-emails')
+@click.option('--batch-size', default=1000, show_default=True, help='Users backfilled per transaction')
+@with_appcontext
+def normalize_emails(batch_size):
+    '''Add, backfill and uniquely index user.email_normalized; safe to re-run'''
+    from app import db
+    from app.migrations import DuplicateEmails, normalize_emails as migrate
+
+    try:
+        added, updated = migrate(db.engine, batch_size)
+    except DuplicateEmails as error:
+        for email_normalized, emails in error.duplicates.items():
+            click.echo(f"{email_normalized}: {', '.join(emails)}", err=True)
+        raise click.ClickException(f'{error}; resolve them and re-run')
+
+    click.echo(f"{'Added' if added else 'Found'} email_normalized, backfilled {updated} users, index in place")
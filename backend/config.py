@@ -11,6 +11,11 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Comma-separated read replicas for User lookups; a user reads the primary
+    # for REPLICA_STICKY_SECONDS after their own writes
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('SQLALCHEMY_REPLICA_URIS', '').split(',') if uri]
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
     JWT_TOKEN_LOCATION = ['cookies']
     JWT_ACCESS_COOKIE_PATH = '/api/'
@@ -18,15 +23,135 @@ class Config:
     JWT_SESSION_COOKIE = False
     JWT_COOKIE_SECURE = False
     JWT_COOKIE_CSRF_PROTECT = True
+    # Verified claims cached per worker until each token's exp; 0 disables
+    JWT_DECODE_CACHE_SIZE = int(os.environ.get('JWT_DECODE_CACHE_SIZE', 10000))
+
+    # 'implicit' re-issues access cookies past half their TTL after requests;
+    # 'explicit' issues a refresh cookie at login for POST /api/users/refresh
+    JWT_REFRESH_MODE = os.environ.get('JWT_REFRESH_MODE', 'implicit')
+    JWT_REFRESH_COALESCE_SIZE = 10000
+    JWT_REFRESH_COOKIE_PATH = '/api/users/refresh'
 
     REDIS_URL = os.environ.get('REDIS_URL')
 
+    # Per-worker connection pools are sized from the gunicorn worker/thread
+    # counts (see gunicorn.conf.py) unless set explicitly
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+    DATABASE_POOL_SIZE = int(os.environ['DATABASE_POOL_SIZE']) if os.environ.get('DATABASE_POOL_SIZE') else None
+    DATABASE_MAX_OVERFLOW = (int(os.environ['DATABASE_MAX_OVERFLOW'])
+                             if os.environ.get('DATABASE_MAX_OVERFLOW') else None)
+    DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', 5))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'
+    DATABASE_CONNECT_TIMEOUT = int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5))
+    # Server-wide connection budget shared by all workers, e.g. Postgres max_connections minus headroom
+    DATABASE_MAX_CONNECTIONS = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 0))
+    REDIS_MAX_CONNECTIONS = int(os.environ['REDIS_MAX_CONNECTIONS']) if os.environ.get('REDIS_MAX_CONNECTIONS') else None
+    REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 1))
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 1))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    REDIS_RETRIES = int(os.environ.get('REDIS_RETRIES', 3))
+
+    # 'blocklist' stores one entry per revoked jti; 'epoch' revokes all of a user's
+    # tokens by bumping a per-user counter embedded in each token
+    JWT_REVOCATION_MODE = os.environ.get('JWT_REVOCATION_MODE', 'blocklist')
+    TOKEN_EPOCH_CACHE_SECONDS = float(os.environ.get('TOKEN_EPOCH_CACHE_SECONDS', 5))
+    TOKEN_EPOCH_CACHE_SIZE = 10000
+    TOKEN_EPOCH_REDIS_TTL = timedelta(days=1)
+
+    # 'keys' stores one Redis key per revoked jti; 'buckets' packs them into small
+    # per-expiry-minute hashes, far less memory and RDB snapshot work per logout
+    JWT_BLOCKLIST_BACKEND = os.environ.get('JWT_BLOCKLIST_BACKEND', 'keys')
+    JWT_BLOCKLIST_BUCKET_SHARDS = int(os.environ.get('JWT_BLOCKLIST_BUCKET_SHARDS', 16))
+    # 'keys' also writes and reads the bare jti keys used before they were
+    # prefixed; set false once every worker has run a prefixed release for one
+    # access token TTL
+    JWT_BLOCKLIST_LEGACY_KEYS = os.environ.get('JWT_BLOCKLIST_LEGACY_KEYS', 'true').lower() == 'true'
+    # Spread revoked jtis over several Redis servers by consistent hashing; empty
+    # keeps them on REDIS_URL. An unreachable node is skipped for
+    # REDIS_BLOCKLIST_RETRY_SECONDS, its writes handed to the next node on the ring
+    # and written back to it once it recovers (app/auth/sharding.py). WSGI only.
+    REDIS_BLOCKLIST_URLS = [url for url in os.environ.get('REDIS_BLOCKLIST_URLS', '').split(',') if url]
+    REDIS_BLOCKLIST_VNODES = int(os.environ.get('REDIS_BLOCKLIST_VNODES', 160))
+    REDIS_BLOCKLIST_RETRY_SECONDS = float(os.environ.get('REDIS_BLOCKLIST_RETRY_SECONDS', 5))
+    # While a node is down its lookups see only the revocations handed off during
+    # the outage; false treats its tokens as revoked instead
+    REDIS_BLOCKLIST_FAIL_OPEN = os.environ.get('REDIS_BLOCKLIST_FAIL_OPEN', 'true').lower() == 'true'
+
+    # public_id -> user snapshots for authenticated routes, optionally shared via Redis
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+    IDENTITY_CACHE_REDIS = os.environ.get('IDENTITY_CACHE_REDIS', 'false').lower() == 'true'
+    # Invalidations (e.g. a logout rotating public_id) reach every worker over
+    # pub/sub within IDENTITY_CACHE_MAX_STALENESS seconds instead of the TTL
+    IDENTITY_CACHE_BROADCAST = os.environ.get('IDENTITY_CACHE_BROADCAST', 'true').lower() == 'true'
+    IDENTITY_CACHE_CHANNEL = 'identity-invalidations'
+    IDENTITY_CACHE_MAX_STALENESS = float(os.environ.get('IDENTITY_CACHE_MAX_STALENESS', 5))
+
+    # Per-worker Bloom filter/LRU in front of the Redis blocklist, synced over pub/sub.
+    # Revocations reach every worker within REVOCATION_CACHE_MAX_STALENESS seconds.
+    REVOCATION_CACHE_ENABLED = os.environ.get('REVOCATION_CACHE_ENABLED', 'true').lower() == 'true'
+    REVOCATION_CACHE_CHANNEL = 'jwt-revocations'
+    REVOCATION_CACHE_MAX_STALENESS = float(os.environ.get('REVOCATION_CACHE_MAX_STALENESS', 5))
+    REVOCATION_CACHE_CAPACITY = int(os.environ.get('REVOCATION_CACHE_CAPACITY', 100000))
+    REVOCATION_CACHE_ERROR_RATE = 0.001
+    REVOCATION_CACHE_LRU_SIZE = 10000
+
+    # last_login/last_seen are buffered per worker and written in batches every
+    # ACTIVITY_FLUSH_INTERVAL seconds; 0 leaves flushing to explicit flush() calls
+    ACTIVITY_TRACKING_ENABLED = os.environ.get('ACTIVITY_TRACKING_ENABLED', 'true').lower() == 'true'
+    ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 5))
+    ACTIVITY_BUFFER_SIZE = int(os.environ.get('ACTIVITY_BUFFER_SIZE', 100000))
+
+    # Comma-separated user public_ids allowed to list/export users via
+    # /api/admin/users. Not emails, which users can change to any unclaimed address.
+    ADMIN_PUBLIC_IDS = [public_id.strip() for public_id in os.environ.get('ADMIN_PUBLIC_IDS', '').split(',')
+                        if public_id.strip()]
+    # Users per keyset page (and server-side cursor fetch) when exporting
+    USER_EXPORT_BATCH_SIZE = int(os.environ.get('USER_EXPORT_BATCH_SIZE', 1000))
+
+    # Swagger UI at / and /swagger.json; off in production to skip registering them
+    API_DOCS_ENABLED = os.environ.get('API_DOCS_ENABLED', 'true').lower() == 'true'
+
+    # Shared directory where gunicorn workers publish metrics for /metrics to aggregate
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+    # Token buckets shedding credential-stuffing before the User query and bcrypt
+    LOGIN_THROTTLE_ENABLED = os.environ.get('LOGIN_THROTTLE_ENABLED', 'true').lower() == 'true'
+    LOGIN_THROTTLE_EMAIL_BURST = int(os.environ.get('LOGIN_THROTTLE_EMAIL_BURST', 5))
+    LOGIN_THROTTLE_EMAIL_PER_MINUTE = float(os.environ.get('LOGIN_THROTTLE_EMAIL_PER_MINUTE', 5))
+    LOGIN_THROTTLE_IP_BURST = int(os.environ.get('LOGIN_THROTTLE_IP_BURST', 30))
+    LOGIN_THROTTLE_IP_PER_MINUTE = float(os.environ.get('LOGIN_THROTTLE_IP_PER_MINUTE', 30))
+    # Reverse proxies in front of the app that append to X-Forwarded-For (1 for
+    # the nginx frontend). The IP bucket keys on the address they report, or on
+    # the peer address when none are trusted; the header is then ignored.
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+    # bcrypt cost: calibrated at startup to BCRYPT_TARGET_MS per hash when set,
+    # otherwise BCRYPT_LOG_ROUNDS. Logins rehash passwords stored at another cost.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_TARGET_MS = float(os.environ['BCRYPT_TARGET_MS']) if os.environ.get('BCRYPT_TARGET_MS') else None
+    BCRYPT_MIN_ROUNDS = int(os.environ.get('BCRYPT_MIN_ROUNDS', 10))
+    BCRYPT_MAX_ROUNDS = int(os.environ.get('BCRYPT_MAX_ROUNDS', 16))
+
+    # bcrypt runs in a per-worker process pool, by default splitting the host's
+    # cores between the WEB_CONCURRENCY workers; 0 hashes inline in the request thread
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS',
+                                               max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         'DATABASE_URL').replace('postgres://', 'postgresql://')
+    SQLALCHEMY_REPLICA_URIS = [uri.replace('postgres://', 'postgresql://')
+                               for uri in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if uri]
     FLASK_ENV = 'production'
     JWT_COOKIE_SECURE = True
+    API_DOCS_ENABLED = os.environ.get('API_DOCS_ENABLED', 'false').lower() == 'true'
     DEBUG = False
 
 
@@ -38,6 +163,12 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     TESTING = True
+    # bcrypt's minimum cost; tests check behaviour, not hash strength
+    BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASH_WORKERS = 0
+    REVOCATION_CACHE_ENABLED = False
+    IDENTITY_CACHE_BROADCAST = False
+    ACTIVITY_FLUSH_INTERVAL = 0
 
 
 configs = {
@@ -0,0 +1,32 @@
+import os
+
+'''
+gunicorn settings; config.py reads the same WEB_CONCURRENCY and
+GUNICORN_THREADS to size each worker's database and Redis pools
+'''
+
+bind = ':5000'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Threaded workers, so a request waiting on bcrypt in the hashing pool only
+# holds one of its worker's threads; with threads = 1 gunicorn falls back to
+# sync workers and each login blocks the whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Build the app once in the master; workers reset what they inherit (app/startup.py)
+preload_app = True
+
+
+def on_starting(server):
+    from app.metrics import clear_snapshots
+    clear_snapshots(os.environ.get('METRICS_MULTIPROC_DIR'))
+
+
+def post_fork(server, worker):
+    from app.startup import reset_after_fork
+    reset_after_fork()
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+    mark_process_dead(os.environ.get('METRICS_MULTIPROC_DIR'), worker.pid)
@@ -0,0 +1,107 @@
+import unittest
+import fakeredis
+from sqlalchemy import event
+from app import bcrypt, create_app, db, hasher, metrics
+from config import TestingConfig
+
+'''
+Shared app/schema test case: one app and schema per config class and test
+process, with every test run inside a transaction that is rolled back
+'''
+
+# config class -> app built for it in this process
+_apps = {}
+
+
+def shared_app(config_class):
+    '''
+    Builds the app for config_class once per process and creates its schema.
+    pysqlite does not emit BEGIN itself, which SAVEPOINTs need, so the engine
+    takes over transaction control.
+    '''
+    app = _apps.get(config_class)
+    if app is None:
+        app = _apps[config_class] = create_app(config_class)
+
+        with app.app_context():
+            engine = db.get_engine(app)
+            if engine.dialect.name == 'sqlite':
+                @event.listens_for(engine, 'connect')
+                def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+                    dbapi_connection.isolation_level = None
+
+                @event.listens_for(engine, 'begin')
+                def _begin(conn):
+                    conn.exec_driver_sql('BEGIN')
+
+            db.create_all()
+
+    return app
+
+
+def reset_app_state(app):
+    '''
+    Gives the app a fresh fakeredis server, re-binds the shared extensions to it
+    and empties its in-process caches and their counters, so nothing a
+    previous test stored or configured leaks into the next
+    '''
+    app.redis_blocklist.connection_pool = fakeredis.FakeStrictRedis().connection_pool
+    for client in app.blocklist_nodes.values():
+        client.connection_pool = fakeredis.FakeStrictRedis().connection_pool
+
+    # Tests building their own apps leave these process-wide extensions configured for them
+    bcrypt.init_app(app)
+    hasher.init_app(app)
+    metrics.directory = app.config.get('METRICS_MULTIPROC_DIR')
+
+    app.identity_cache.clear()
+    app.token_epochs.clear()
+    if app.token_cache is not None:
+        app.token_cache.clear()
+    if getattr(app, 'refresh_coalescer', None) is not None:
+        app.refresh_coalescer.clear()
+    if app.activity is not None:
+        app.activity.clear()
+
+
+class AppTestCase(unittest.TestCase):
+    '''
+    Runs each test against the shared app for config_class inside an outer
+    transaction, with the session working in a SAVEPOINT restarted after every
+    commit or rollback, and rolls everything back afterwards
+    '''
+    config_class = TestingConfig
+
+    def setUp(self):
+        '''
+        Sets up the shared app and context, and binds the session to a
+        connection whose transaction is rolled back in tearDown.
+        '''
+        self.app = shared_app(self.config_class)
+        reset_app_state(self.app)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self._session = db.session
+        db.session = db.create_scoped_session(options={'bind': self.connection, 'binds': {}})
+
+        self.nested = self.connection.begin_nested()
+
+        @event.listens_for(db.session, 'after_transaction_end')
+        def _restart_savepoint(session, transaction):
+            if not self.nested.is_active:
+                self.nested = self.connection.begin_nested()
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        '''
+        Rolls back everything the test wrote and restores the default session.
+        '''
+        db.session.remove()
+        db.session = self._session
+        self.transaction.rollback()
+        self.connection.close()
+        self.appctx.pop()
@@ -0,0 +1,123 @@
+import unittest
+import uuid
+import json
+from unittest import mock
+from datetime import datetime, timezone
+from app import create_app, db
+from app.activity import ActivityBuffer, DROPPED, FLUSH_LAG
+from app.models import User
+from config import TestingConfig
+
+
+class TestActivityBuffer(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up the app, db and a user to record activity for.
+        '''
+        self.app = create_app(TestingConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        self.user.set_password('adminisabadpassword')
+        self.user.save()
+
+    def tearDown(self):
+        '''
+        Tears down the db and app context.
+        '''
+        db.session.remove()
+        db.drop_all()
+        self.appctx.pop()
+
+    def _stored(self):
+        return db.engine.execute(User.__table__.select()
+                                 .where(User.__table__.c.public_id == self.user.public_id)).first()
+
+    def test_requests_are_buffered_not_written(self):
+        '''
+        Logging in and authenticated requests only touch the buffer.
+        '''
+        login = self.client.post('/api/users/login',
+                                 headers={'Content-Type': 'application/json'},
+                                 data=json.dumps({'email': 'admin@gmail.com', 'password': 'adminisabadpassword'}))
+        csrf = next(cookie.value for cookie in self.client.cookie_jar if cookie.name == 'csrf_access_token')
+        update = self.client.put('/api/users/update',
+                                 headers={'Content-Type': 'application/json', 'X-CSRF-TOKEN': csrf},
+                                 data=json.dumps({'username': 'Changed'}))
+
+        assert login.status_code == 200
+        assert update.status_code == 200
+        assert self.app.activity.pending() == 1
+        assert self._stored().last_login is None
+        assert self._stored().last_seen is None
+
+    def test_flush_writes_latest_timestamps(self):
+        '''
+        flush() writes the newest timestamps per user in one batch and keeps
+        columns that were not updated.
+        '''
+        earlier = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        later = datetime(2022, 1, 2, tzinfo=timezone.utc)
+        lag_count = sum(count for _, _, _, count in FLUSH_LAG.snapshot())
+        self.app.activity.record(self.user.public_id, last_login=earlier, last_seen=earlier)
+        self.app.activity.record(self.user.public_id, last_seen=later)
+        self.app.activity.record(self.user.public_id, last_seen=earlier)
+
+        updated = self.app.activity.flush()
+        stored = self._stored()
+
+        assert updated == 1
+        assert self.app.activity.pending() == 0
+        assert stored.last_login.replace(tzinfo=timezone.utc) == earlier
+        assert stored.last_seen.replace(tzinfo=timezone.utc) == later
+        assert sum(count for _, _, _, count in FLUSH_LAG.snapshot()) == lag_count + 1
+
+    def test_buffer_is_bounded(self):
+        '''
+        Once maxsize users are buffered, updates for new users are dropped
+        while buffered users keep updating.
+        '''
+        buffer = ActivityBuffer(lambda: db.engine, maxsize=2, flush_interval=0)
+        dropped = sum(value for _, value in DROPPED.snapshot())
+        now = datetime.now(timezone.utc)
+
+        for public_id in ('a', 'b', 'c'):
+            buffer.record(public_id, last_seen=now)
+        buffer.record('a', last_login=now)
+
+        assert buffer.pending() == 2
+        assert sum(value for _, value in DROPPED.snapshot()) == dropped + 1
+
+    def test_flush_writes_in_public_id_order(self):
+        '''
+        Rows are written sorted by public_id whatever order they were
+        recorded in, so concurrent flushes lock shared rows in the same order.
+        '''
+        buffer = ActivityBuffer(lambda: db.engine, maxsize=10, flush_interval=0)
+        written = []
+        buffer._write = lambda rows: written.extend(row['b_public_id'] for row in rows) or len(rows)
+        now = datetime.now(timezone.utc)
+
+        for public_id in ('c', 'a', 'b'):
+            buffer.record(public_id, last_seen=now)
+        buffer.flush()
+
+        assert written == ['a', 'b', 'c']
+
+    def test_exit_flush_registered_once(self):
+        '''
+        Restarting the flusher thread does not register another exit flush.
+        '''
+        buffer = ActivityBuffer(lambda: db.engine, maxsize=10, flush_interval=60)
+        registered = []
+
+        with mock.patch('app.activity.atexit.register', registered.append):
+            buffer.start()
+            buffer._thread = None
+            buffer.start()
+
+        assert registered == [buffer.flush]
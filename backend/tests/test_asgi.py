@@ -0,0 +1,273 @@
+import unittest
+import json
+from datetime import timedelta
+from starlette.testclient import TestClient
+from sqlalchemy import select
+from app import db
+from app.asgi import create_asgi_app, async_database_uri
+from app.auth.blocklist import KeyStore
+from app.models import User
+from config import TestingConfig
+
+
+class EpochTestingConfig(TestingConfig):
+    JWT_REVOCATION_MODE = 'epoch'
+
+
+class EpochRefreshTestingConfig(EpochTestingConfig):
+    JWT_REFRESH_MODE = 'explicit'
+
+
+class ReplicaTestingConfig(TestingConfig):
+    SQLALCHEMY_REPLICA_URIS = ['sqlite://']
+
+
+class TestAsgiApp(unittest.TestCase):
+    config_class = TestingConfig
+
+    def setUp(self):
+        '''
+        Starts the ASGI app on a test event loop, creates the schema and signs up
+        a user through the API.
+        '''
+        self.app = create_asgi_app(self.config_class)
+        self.state = self.app.state
+        self.client = TestClient(self.app)
+        self.client.__enter__()
+        self._run(self._create_schema)
+
+        self._post('/api/users/signup', {'username': 'Admin',
+                                         'email': 'admin@gmail.com',
+                                         'password': 'adminisabadpassword'})
+
+    def tearDown(self):
+        '''
+        Shuts the app down, disposing of its engine and Redis client.
+        '''
+        self.client.__exit__(None, None, None)
+
+    def _run(self, func, *args):
+        return self.client.portal.call(func, *args)
+
+    async def _create_schema(self):
+        async with self.state.engine.begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+
+    async def _user(self, email):
+        async with self.state.engine.connect() as conn:
+            table = User.__table__
+            return (await conn.execute(select(table).where(table.c.email == email))).first()
+
+    def _post(self, path, data=None, **kwargs):
+        return self.client.post(path, data=json.dumps(data) if data is not None else None,
+                                headers={'Content-Type': 'application/json', **kwargs.pop('headers', {})},
+                                **kwargs)
+
+    def _login(self, password='adminisabadpassword'):
+        return self._post('/api/users/login', {'email': 'admin@gmail.com', 'password': password})
+
+    def _token_headers(self, claims=None, **encode_kwargs):
+        user = self._run(self._user, 'admin@gmail.com')
+        token = self.state.tokens.encode(user.public_id, claims=claims, **encode_kwargs)
+        self.client.cookies.set('access_token_cookie', token)
+        return token, {'X-CSRF-TOKEN': self.state.tokens.decode_unverified(token)['csrf']}
+
+
+class TestAsgiRoutes(TestAsgiApp):
+
+    def test_async_database_uri(self):
+        '''
+        Sync database URIs are mapped onto their async drivers.
+        '''
+        assert str(async_database_uri('postgres://u:p@db/app')) == 'postgresql+asyncpg://u:p@db/app'
+        assert str(async_database_uri('sqlite://')) == 'sqlite+aiosqlite://'
+        with self.assertRaises(ValueError):
+            async_database_uri('mysql://u:p@db/app')
+
+    def test_sharded_blocklist_rejected(self):
+        '''
+        The ASGI app refuses to start with REDIS_BLOCKLIST_URLS set rather than
+        revoking tokens where the sharded blocklist never looks.
+        '''
+        config_class = type('ShardedConfig', (TestingConfig,), {'REDIS_BLOCKLIST_URLS': ['redis://blocklist-a:6379/0']})
+
+        with self.assertRaises(ValueError):
+            create_asgi_app(config_class)
+
+    def test_user_signup(self):
+        '''
+        Signup answers 201, then 202 for the same email; the stored password verifies.
+        '''
+        data = {'username': 'Testing', 'email': 'testing@gmail.com', 'password': 'badpassword'}
+
+        response_201 = self._post('/api/users/signup', data)
+        response_202 = self._post('/api/users/signup', data)
+        response_400 = self._post('/api/users/signup', {'username': 'Te', 'email': 'testing@gmail.com'})
+        user = self._run(self._user, 'testing@gmail.com')
+
+        assert response_201.status_code == 201
+        assert response_202.status_code == 202
+        assert response_400.status_code == 400
+        assert set(response_400.json()['errors']) == {'username', 'password'}
+        assert user.username == 'Testing'
+        assert self._run(self.state.hasher.check_password_hash, user.password, 'badpassword')
+
+    def test_user_login(self):
+        '''
+        Login answers 200 with access cookies, 401 for an unknown email and 403
+        for a wrong password.
+        '''
+        response_200 = self._login()
+        response_401 = self._post('/api/users/login', {'email': 'testing@gmail.com', 'password': 'badpassword'})
+        response_403 = self._login('WRONGPASSWORD')
+        user = self._run(self._user, 'admin@gmail.com')
+
+        assert response_200.status_code == 200
+        assert response_200.json()['user'] == {'_id': user.id, 'username': 'Admin', 'email': 'admin@gmail.com'}
+        assert response_200.cookies.get('access_token_cookie')
+        assert response_200.cookies.get('csrf_access_token')
+        assert response_401.status_code == 401
+        assert response_403.status_code == 403
+
+    def test_user_update(self):
+        '''
+        A valid token and CSRF header update the user; an unknown identity is
+        401, as is a missing CSRF header.
+        '''
+        _, headers = self._token_headers()
+        response_200 = self.client.put('/api/users/update', data=json.dumps({'username': 'Changed'}),
+                                       headers=headers)
+        response_csrf = self.client.put('/api/users/update', data=json.dumps({'username': 'Nope'}))
+
+        self.client.cookies.set('access_token_cookie', self.state.tokens.encode('1234567890'))
+        token_401 = self.client.cookies.get('access_token_cookie')
+        response_401 = self.client.put('/api/users/update', data=json.dumps({'username': 'Notgonnawork'}),
+                                       headers={'X-CSRF-TOKEN': self.state.tokens.decode_unverified(token_401)['csrf']})
+
+        assert response_200.status_code == 200
+        assert response_200.json()['user']['username'] == 'Changed'
+        assert self._run(self._user, 'admin@gmail.com').username == 'Changed'
+        assert response_csrf.status_code == 401
+        assert response_csrf.json() == {'msg': 'Missing CSRF token'}
+        assert response_401.status_code == 401
+
+    def test_user_logout(self):
+        '''
+        Logout blocklists the token in Redis, rotates the public_id and unsets
+        the cookies; the revoked token is then rejected.
+        '''
+        token, headers = self._token_headers()
+        public_id = self._run(self._user, 'admin@gmail.com').public_id
+
+        response_200 = self._post('/api/users/logout', headers=headers)
+        self.client.cookies.set('access_token_cookie', token)
+        response_revoked = self._post('/api/users/logout', headers=headers)
+
+        claims = self.state.tokens.decode_unverified(token)
+        assert response_200.status_code == 200
+        assert response_200.json()['user'] == 'Admin'
+        assert self._run(self.state.redis.get, KeyStore.key(claims['jti'])) is not None
+        assert self._run(self.state.redis.get, claims['jti']) is not None
+        assert self._run(self._user, 'admin@gmail.com').public_id != public_id
+        assert response_revoked.status_code == 401
+        assert response_revoked.json() == {'msg': 'Token has been revoked'}
+
+    def test_expiring_token_reissued_once(self):
+        '''
+        In implicit refresh mode a token past half its TTL is re-issued once.
+        '''
+        _, headers = self._token_headers(expires_delta=timedelta(minutes=5))
+
+        first = self.client.put('/api/users/update', data=json.dumps({'username': 'Changed'}), headers=headers)
+        second = self.client.put('/api/users/update', data=json.dumps({'username': 'Again'}), headers=headers)
+
+        assert first.status_code == 200
+        assert 'access_token_cookie' in first.cookies
+        assert second.status_code == 200
+        assert 'access_token_cookie' not in second.cookies
+
+
+class TestAsgiEpochRevocation(TestAsgiApp):
+    config_class = EpochTestingConfig
+
+    def test_logout_revokes_every_token(self):
+        '''
+        In epoch mode logging out with one token revokes the user's other tokens.
+        '''
+        login = self._login()
+        other_token = login.cookies.get('access_token_cookie')
+        _, headers = self._token_headers(claims={'epoch': 0})
+
+        response_200 = self._post('/api/users/logout', headers=headers)
+        self.client.cookies.set('access_token_cookie', other_token)
+        response_revoked = self.client.put('/api/users/update', data=json.dumps({'username': 'Nope'}),
+                                           headers={'X-CSRF-TOKEN':
+                                                    self.state.tokens.decode_unverified(other_token)['csrf']})
+
+        assert response_200.status_code == 200
+        assert self._run(self._user, 'admin@gmail.com').token_epoch == 1
+        assert response_revoked.status_code == 401
+
+
+class TestAsgiEpochRefresh(TestAsgiApp):
+    config_class = EpochRefreshTestingConfig
+
+    def test_refresh_token_carries_epoch(self):
+        '''
+        A refresh token issued after a logout carries the new epoch, so it can
+        be exchanged for an access token.
+        '''
+        _, headers = self._token_headers(claims={'epoch': 0})
+        self._post('/api/users/logout', headers=headers)
+
+        login = self._login()
+        refresh_token = login.cookies.get('refresh_token_cookie')
+        response_200 = self._post('/api/users/refresh',
+                                  headers={'X-CSRF-TOKEN': self.state.tokens.decode_unverified(refresh_token)['csrf']})
+
+        assert self.state.tokens.decode_unverified(refresh_token)['epoch'] == 1
+        assert response_200.status_code == 200
+
+
+class TestAsgiActivity(TestAsgiApp):
+
+    def test_login_and_requests_recorded(self):
+        '''
+        Logins set last_login and authenticated requests last_seen, buffered
+        until a flush writes them.
+        '''
+        self._login()
+        _, headers = self._token_headers()
+        self.client.put('/api/users/update', data=json.dumps({'username': 'Changed'}), headers=headers)
+
+        buffered = self._run(self._user, 'admin@gmail.com')
+        pending = self.state.activity.pending()
+        updated = self._run(self.state.activity.flush)
+        stored = self._run(self._user, 'admin@gmail.com')
+
+        assert buffered.last_login is None
+        assert pending == 1
+        assert updated == 1
+        assert stored.last_login is not None
+        assert stored.last_seen >= stored.last_login
+
+
+class TestAsgiReplicaStickiness(TestAsgiApp):
+    config_class = ReplicaTestingConfig
+
+    def test_writes_mark_user_sticky(self):
+        '''
+        Signups, updates and logouts mark the user sticky so WSGI workers read
+        them from the primary.
+        '''
+        before = self._run(self._user, 'admin@gmail.com').public_id
+        signup_sticky = self._run(self.state.redis.get, 'replica_sticky:admin@gmail.com')
+        _, headers = self._token_headers()
+        self.client.put('/api/users/update', data=json.dumps({'email': 'new@gmail.com'}), headers=headers)
+        self._post('/api/users/logout', headers=headers)
+        after = self._run(self._user, 'new@gmail.com').public_id
+
+        sticky = [self._run(self.state.redis.get, f'replica_sticky:{key}') for key in ('new@gmail.com', before, after)]
+
+        assert signup_sticky is not None
+        assert all(value is not None for value in sticky)
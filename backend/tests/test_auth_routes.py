@@ -1,32 +1,26 @@
-import unittest
 import uuid
 import json
 from flask import current_app
 from flask_jwt_extended import create_access_token, get_jti, get_csrf_token
-from app import create_app, db
+from app.auth.blocklist import KeyStore
 from app.models import User
-from config import TestingConfig
+from tests.base import AppTestCase
 
 
-class TestFlaskApp(unittest.TestCase):
+class TestFlaskApp(AppTestCase):
 
     def setUp(self):
         '''
-        Sets up the app environment for testing: creates db, test_client, and app context.
+        Sets up the shared app, a rolled back transaction, test_client and app context.
         '''
-        self.app = create_app(TestingConfig)
-        self.appctx = self.app.app_context()
-        self.appctx.push()
-        db.create_all()
+        super().setUp()
         self._populate_db()
-        self.client = self.app.test_client()
 
     def tearDown(self):
         '''
-        Tears down the set up test_client, db, and app context.
+        Rolls back the test's transaction and tears down the app context.
         '''
-        db.drop_all()
-        self.appctx.pop()
+        super().tearDown()
         self.app = None
         self.appctx = None
         self.client = None
@@ -206,7 +200,7 @@ class TestFlaskApp(unittest.TestCase):
                                         follow_redirects=True
                                         )
 
-        blocked_token = current_app.redis_blocklist.get(get_jti(token_200))
+        blocked_token = current_app.redis_blocklist.get(KeyStore.key(get_jti(token_200)))
 
         assert response_200.status_code == 200
         assert response_200.request.path == '/api/users/logout'
@@ -0,0 +1,69 @@
+import unittest
+import json
+from benchmarks.auth import ROUTES, Recorder, compare, make_config, parse_mix, run_benchmark
+from config import Config
+from benchmarks.tokens import run_token_benchmark
+
+
+class TestAuthBenchmark(unittest.TestCase):
+
+    def test_short_run_reports_every_route(self):
+        '''
+        A short concurrent run covers all routes without server errors and
+        produces a JSON-serialisable report.
+        '''
+        config_class = make_config(bcrypt_rounds=4)
+        report = run_benchmark(config_class, concurrency=2, duration=30,
+                               requests_per_client=20, mix=parse_mix('signup=1,login=1,update=2,logout=1'))
+
+        assert set(report['routes']) == set(ROUTES)
+        assert all(stats['errors'] == 0 for stats in report['routes'].values())
+        assert all(stats['p50_ms'] <= stats['p99_ms'] for stats in report['routes'].values())
+        assert json.loads(json.dumps(report))['meta']['concurrency'] == 2
+        assert report['meta']['bcrypt_rounds'] == 4
+
+    def test_client_errors_are_not_successes(self):
+        '''
+        Any non-2xx response counts as an error, not only server errors.
+        '''
+        recorder = Recorder()
+        for status in (200, 201, 401, 429, 500):
+            recorder.record('login', 0.001, status)
+
+        report = recorder.summary(1.0)
+
+        assert report['routes']['login']['errors'] == 3
+        assert report['error_rate'] == 0.6
+
+    def test_bcrypt_cost_pinned_to_production(self):
+        '''
+        Without an override benchmarks hash at the production cost, not the
+        cheap cost the test config uses.
+        '''
+        assert make_config().BCRYPT_LOG_ROUNDS == Config.BCRYPT_LOG_ROUNDS
+        assert make_config(bcrypt_rounds=6).BCRYPT_LOG_ROUNDS == 6
+        assert make_config().BCRYPT_TARGET_MS is None
+
+    def test_compare_flags_regressions(self):
+        '''
+        Slower percentiles and lower throughput beyond the threshold are flagged.
+        '''
+        baseline = {'routes': {'login': {'throughput': 100.0, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0}}}
+        current = {'routes': {'login': {'throughput': 80.0, 'p50_ms': 10.5, 'p95_ms': 30.0, 'p99_ms': 30.0}}}
+
+        flagged = {row['metric'] for row in compare(baseline, current, threshold=0.1) if row['regression']}
+
+        assert flagged == {'throughput', 'p95_ms'}
+
+
+class TestTokenBenchmark(unittest.TestCase):
+
+    def test_reports_both_modes(self):
+        '''
+        The verification benchmark times the uncached and cached paths.
+        '''
+        report = run_token_benchmark(iterations=20)
+
+        assert report['uncached_us'] > 0
+        assert report['cached_us'] > 0
+        assert report['speedup'] is not None
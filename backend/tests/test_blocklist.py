@@ -0,0 +1,232 @@
+import unittest
+import time
+import uuid
+import json
+import fakeredis
+from flask import Config
+from flask_jwt_extended import create_access_token, get_csrf_token, get_jti
+from app import create_app, db
+from app.auth.blocklist import BloomFilter, Blocklist, KeyStore
+from app.models import User
+from cli import blocklist_memory
+from config import TestingConfig
+
+
+class CountingRedis(fakeredis.FakeStrictRedis):
+    '''
+    fakeredis client that counts blocklist GET round trips
+    '''
+    gets = 0
+
+    def get(self, name):
+        self.gets += 1
+        return super().get(name)
+
+    def mget(self, keys, *args):
+        self.gets += 1
+        return super().mget(keys, *args)
+
+
+class TestRevocationCache(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up two "workers" sharing one fake Redis server, each with its own cache.
+        '''
+        self.server = fakeredis.FakeServer()
+        self.config = Config('.')
+        self.config.from_object(TestingConfig)
+        self.config['REVOCATION_CACHE_ENABLED'] = True
+        self.redis_a = CountingRedis(server=self.server)
+        self.worker_a = Blocklist.from_config(self.redis_a, self.config)
+        self.worker_b = Blocklist.from_config(fakeredis.FakeStrictRedis(server=self.server), self.config)
+
+    def tearDown(self):
+        '''
+        Stops the pub/sub listener threads.
+        '''
+        self.worker_a.cache.stop()
+        self.worker_b.cache.stop()
+
+    def _wait_for(self, predicate, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        '''
+        Every added key is reported present.
+        '''
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [str(uuid.uuid4()) for _ in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        assert all(key in bloom for key in keys)
+
+    def test_unrevoked_tokens_skip_redis_once_synced(self):
+        '''
+        Once the listener is synced, "not revoked" answers come from the local filter.
+        '''
+        self.worker_a.is_revoked(str(uuid.uuid4()))
+        assert self._wait_for(lambda: self.worker_a.cache.synced)
+
+        gets_before = self.redis_a.gets
+        for _ in range(100):
+            assert not self.worker_a.is_revoked(str(uuid.uuid4()))
+
+        assert self.redis_a.gets - gets_before < 5
+
+    def test_revocation_reaches_other_workers(self):
+        '''
+        A logout on one worker is seen by another worker's cache through pub/sub.
+        '''
+        self.worker_a.is_revoked(str(uuid.uuid4()))
+        assert self._wait_for(lambda: self.worker_a.cache.synced)
+
+        jti = str(uuid.uuid4())
+        self.worker_b.revoke(jti)
+
+        assert self._wait_for(lambda: self.worker_a.cache.known_revoked(jti))
+        assert self.worker_a.is_revoked(jti)
+        assert self.worker_b.is_revoked(jti)
+        assert self.redis_a.get(KeyStore.key(jti)) is not None
+
+    def test_existing_revocations_loaded_on_sync(self):
+        '''
+        jtis revoked before the worker started are loaded when the listener syncs.
+        '''
+        jti = str(uuid.uuid4())
+        self.worker_b.revoke(jti)
+
+        self.worker_a.is_revoked(str(uuid.uuid4()))
+        assert self._wait_for(lambda: self.worker_a.cache.synced)
+
+        assert self.worker_a.cache.might_be_revoked(jti)
+        assert self.worker_a.is_revoked(jti)
+
+    def test_unsynced_cache_falls_back_to_redis(self):
+        '''
+        Without a live subscription, lookups are answered by Redis.
+        '''
+        jti = str(uuid.uuid4())
+        self.redis_a.setex(KeyStore.key(jti), 900, '')
+        gets_before = self.redis_a.gets
+
+        assert not self.worker_a.cache.synced
+        assert not self.worker_a.cache.might_be_revoked(jti)
+        assert self.worker_a.is_revoked(jti)
+        assert self.redis_a.gets == gets_before + 1
+
+    def test_legacy_keys_read_and_written(self):
+        '''
+        With legacy keys on, jtis revoked under the bare keys earlier releases
+        used are still found, and new revocations are visible under both.
+        '''
+        store = KeyStore(self.redis_a, 900, legacy_keys=True)
+        old_jti, new_jti = str(uuid.uuid4()), str(uuid.uuid4())
+        self.redis_a.setex(old_jti, 900, '')
+
+        store.add(new_jti)
+
+        assert store.contains(old_jti)
+        assert self.redis_a.get(new_jti) is not None
+        assert self.redis_a.get(KeyStore.key(new_jti)) is not None
+        assert not KeyStore(self.redis_a, 900).contains(old_jti)
+
+    def test_scan_skips_other_keys(self):
+        '''
+        Scans and memory reports only see blocklist keys, not the throttle,
+        epoch or cache keys sharing the Redis database.
+        '''
+        jti = str(uuid.uuid4())
+        self.worker_a.revoke(jti)
+        self.redis_a.hset('login_throttle:email:admin@gmail.com', 'tokens', 4)
+        self.redis_a.set('token_epoch:someone', 1)
+
+        assert list(self.worker_a.store.scan()) == [jti]
+        assert self.worker_a.store.memory_report()['entries'] == 1
+
+
+class BucketConfig(TestingConfig):
+    JWT_BLOCKLIST_BACKEND = 'buckets'
+    JWT_BLOCKLIST_BUCKET_SHARDS = 4
+
+
+class TestBucketStore(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up an app using the bucketed blocklist and one user.
+        '''
+        self.app = create_app(BucketConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.redis = self.app.redis_blocklist
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        self.user.set_password('adminisabadpassword')
+        self.user.save()
+
+    def tearDown(self):
+        '''
+        Tears down the db and app context.
+        '''
+        db.drop_all()
+        self.appctx.pop()
+
+    def test_revocations_share_expiry_buckets(self):
+        '''
+        Many revocations expiring in the same minute land in at most one hash per
+        shard, each expiring after its minute; lookups only match their own bucket.
+        '''
+        exp = (int(time.time()) // 60 + 15) * 60 + 10
+        jtis = [str(uuid.uuid4()) for _ in range(500)]
+        for jti in jtis:
+            self.app.blocklist.revoke(jti, exp)
+
+        keys = self.redis.keys('blocklist:*')
+
+        assert len(keys) <= 4
+        assert all(0 < self.redis.ttl(key) <= 16 * 60 + 60 for key in keys)
+        assert all(self.app.blocklist.is_revoked(jti, exp) for jti in jtis)
+        assert not self.app.blocklist.is_revoked(jtis[0], exp + 60)
+        assert not self.app.blocklist.is_revoked(str(uuid.uuid4()), exp)
+        assert set(self.app.blocklist.store.scan()) == set(jtis)
+
+    def test_logout_revokes_through_buckets(self):
+        '''
+        Logging out records the token in its bucket and the token is then rejected.
+        '''
+        token = create_access_token(identity=self.user.public_id)
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        headers = {'Content-Type': 'application/json', 'X-CSRF-TOKEN': get_csrf_token(token)}
+
+        response_200 = self.client.post('/api/users/logout', headers=headers)
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        response_401 = self.client.put('/api/users/update', headers=headers,
+                                       data=json.dumps({'username': 'Revoked'}))
+
+        assert response_200.status_code == 200
+        assert response_401.status_code == 401
+        assert self.redis.get(KeyStore.key(get_jti(token))) is None
+        assert self.app.blocklist.store.memory_report()['entries'] == 1
+
+    def test_memory_report_command(self):
+        '''
+        blocklist-memory reports the backend, key and token counts.
+        '''
+        exp = time.time() + 900
+        for _ in range(3):
+            self.app.blocklist.revoke(str(uuid.uuid4()), exp)
+
+        result = self.app.test_cli_runner().invoke(blocklist_memory)
+
+        assert result.exit_code == 0
+        assert 'backend: buckets' in result.output
+        assert 'revoked tokens: 3' in result.output
@@ -0,0 +1,108 @@
+import uuid
+import os
+from unittest import mock
+import json
+import tempfile
+from app.models import User
+from app.importer import IMPORT_COLUMNS, _copy_rows
+from cli import import_users
+from tests.base import AppTestCase
+
+
+PREHASHED = '$2b$12$k.HNKyENLhodcyqUBu5XteuKOlNmQLrcsWoy45prpC/kb8zSFOwJS'
+
+
+class TestImportUsers(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app, db with one existing user, and a scratch directory.
+        '''
+        super().setUp()
+        self.runner = self.app.test_cli_runner()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        user.set_password('adminisabadpassword')
+        user.save()
+
+    def tearDown(self):
+        '''
+        Tears down the scratch directory, rolls back the test's writes and pops the app context.
+        '''
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_csv_dedupes_and_keeps_prehashed(self):
+        '''
+        Existing and repeated emails are skipped, bcrypt strings are stored as given
+        and plaintext passwords are hashed.
+        '''
+        path = self._write('users.csv', 'username,email,password\n'
+                                        'One,one@gmail.com,onepassword\n'
+                                        'Admin,admin@gmail.com,adminpassword\n'
+                                        'Again,one@gmail.com,againpassword\n'
+                                        f'Two,two@gmail.com,{PREHASHED}\n')
+
+        result = self.runner.invoke(import_users, [path, '--workers', '0', '--chunk-size', '2'])
+
+        one = User.query.filter_by(email='one@gmail.com').first()
+        two = User.query.filter_by(email='two@gmail.com').first()
+
+        assert result.exit_code == 0, result.output
+        assert 'Imported 2 users (2 skipped) from 4 records' in result.output
+        assert User.query.count() == 3
+        assert one.username == 'One'
+        assert one.check_password('onepassword')
+        assert two.password == PREHASHED
+
+    def test_import_jsonl_resumes_from_checkpoint(self):
+        '''
+        A checkpoint written by a previous run makes the import resume after it.
+        '''
+        lines = [json.dumps({'username': f'User{i}', 'email': f'user{i}@gmail.com', 'password': PREHASHED})
+                 for i in range(5)]
+        path = self._write('users.jsonl', '\n'.join(lines) + '\n')
+        checkpoint = self._write('users.offset', '3')
+
+        result = self.runner.invoke(import_users, [path, '--workers', '0', '--checkpoint', checkpoint])
+
+        assert result.exit_code == 0, result.output
+        assert 'Resuming from offset 3' in result.output
+        assert User.query.filter(User.email.like('user%')).count() == 2
+        assert User.query.filter_by(email='user0@gmail.com').first() is None
+        with open(checkpoint) as f:
+            assert f.read() == '5'
+
+    def test_import_hashes_in_process_pool(self):
+        '''
+        Plaintext passwords hashed across worker processes verify afterwards.
+        '''
+        path = self._write('users.csv', 'username,email,password\n'
+                                        'Pool,pool@gmail.com,poolpassword\n')
+
+        result = self.runner.invoke(import_users, [path, '--workers', '2'])
+
+        assert result.exit_code == 0, result.output
+        assert User.query.filter_by(email='pool@gmail.com').first().check_password('poolpassword')
+
+    def test_postgres_staging_table_has_import_columns_only(self):
+        '''
+        The COPY staging table is built from the imported columns alone, so it
+        draws no id sequence values, and its cursor is closed.
+        '''
+        with mock.patch('app.importer.db') as db:
+            cursor = db.session.connection.return_value.connection.cursor.return_value.__enter__.return_value
+            _copy_rows([dict.fromkeys(IMPORT_COLUMNS, 'x')])
+
+        create = cursor.execute.call_args_list[0].args[0]
+        assert create.endswith(f'AS SELECT {", ".join(IMPORT_COLUMNS)} FROM "user" WITH NO DATA')
+        assert 'LIKE' not in create
+        assert db.session.connection.return_value.connection.cursor.return_value.__exit__.called
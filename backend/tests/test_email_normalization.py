@@ -0,0 +1,167 @@
+import unittest
+import uuid
+from unittest import mock
+from sqlalchemy import create_engine, inspect, text
+from app.importer import prepare_chunk
+from app.migrations import (DuplicateEmails, EMAIL_NORMALIZED_INDEX, USER_COLUMNS, add_user_columns,
+                            create_email_normalized_index, normalize_emails)
+from app.models import User
+from tests.base import AppTestCase
+
+
+class TestEmailNormalization(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app and db with one existing user.
+        '''
+        super().setUp()
+
+        User.register(public_id=str(uuid.uuid4()), username='Admin',
+                      email='Admin@Gmail.com', password='adminisabadpassword')
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def test_signup_rejects_case_variant(self):
+        '''
+        An email differing only by case or surrounding spaces is already taken.
+        '''
+        response_202 = self.client.post('/api/users/signup',
+                                        json={'username': 'Again',
+                                              'email': ' admin@gmail.COM',
+                                              'password': 'anotherpassword'})
+
+        assert response_202.status_code == 202
+        assert User.query.count() == 1
+
+    def test_login_ignores_case(self):
+        '''
+        Logging in finds the user whatever case the email is typed in.
+        '''
+        response_200 = self.client.post('/api/users/login',
+                                        json={'email': 'ADMIN@gmail.com',
+                                              'password': 'adminisabadpassword'})
+
+        assert response_200.status_code == 200
+        assert User.by_email('admin@GMAIL.com').first().email == 'Admin@Gmail.com'
+
+    def test_import_skips_case_variants(self):
+        '''
+        Imported emails are deduplicated by their normalized form, against the
+        table and within the chunk.
+        '''
+        records = [{'username': 'One', 'email': 'ADMIN@gmail.com', 'password': 'x' * 8},
+                   {'username': 'Two', 'email': 'New@gmail.com', 'password': 'x' * 8},
+                   {'username': 'Three', 'email': 'new@GMAIL.com', 'password': 'x' * 8}]
+
+        rows, skipped = prepare_chunk(records)
+
+        assert skipped == 2
+        assert [(row['email'], row['email_normalized']) for row in rows] == [('New@gmail.com', 'new@gmail.com')]
+
+
+class TestNormalizeEmailsMigration(unittest.TestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up a database with the user table as it was before email_normalized.
+        '''
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE "user" (id INTEGER PRIMARY KEY, email VARCHAR(75) NOT NULL UNIQUE)'))
+            conn.execute(text('INSERT INTO "user" (email) VALUES (:email)'),
+                         [{'email': email} for email in ('One@Gmail.com', ' two@gmail.com', 'three@gmail.com')])
+
+    def tearDown(self):
+        '''
+        Disposes of the database.
+        '''
+        self.engine.dispose()
+
+    def _normalized(self):
+        with self.engine.connect() as conn:
+            return [row[0] for row in conn.execute(text('SELECT email_normalized FROM "user" ORDER BY id'))]
+
+    def test_backfills_and_indexes_idempotently(self):
+        '''
+        The column is added, backfilled in batches and uniquely indexed; a
+        second run finds nothing left to do.
+        '''
+        first = normalize_emails(self.engine, batch_size=2)
+        second = normalize_emails(self.engine, batch_size=2)
+        indexes = {index['name']: index for index in inspect(self.engine).get_indexes('user')}
+
+        assert first == (True, 3)
+        assert second == (False, 0)
+        assert self._normalized() == ['one@gmail.com', 'two@gmail.com', 'three@gmail.com']
+        assert indexes[EMAIL_NORMALIZED_INDEX]['unique']
+
+    def test_duplicates_abort_before_index(self):
+        '''
+        Users colliding once normalized are reported and no index is built.
+        '''
+        with self.engine.begin() as conn:
+            conn.execute(text('INSERT INTO "user" (email) VALUES (\'ONE@gmail.com\')'))
+
+        with self.assertRaises(DuplicateEmails) as raised:
+            normalize_emails(self.engine)
+
+        assert raised.exception.duplicates == {'one@gmail.com': ['One@Gmail.com', 'ONE@gmail.com']}
+        assert EMAIL_NORMALIZED_INDEX not in {index['name'] for index in inspect(self.engine).get_indexes('user')}
+
+    def test_invalid_postgres_index_rebuilt(self):
+        '''
+        On Postgres an invalid index left by an interrupted concurrent build is
+        dropped before the index is built again; a valid one is kept.
+        '''
+        def statements(valid):
+            engine = mock.MagicMock()
+            engine.dialect.name = 'postgresql'
+            conn = engine.connect.return_value.execution_options.return_value.__enter__.return_value
+            conn.execute.return_value.scalar.return_value = valid
+            create_email_normalized_index(engine)
+            return [str(call.args[0]).split(' ON ')[0] for call in conn.execute.call_args_list[1:]]
+
+        assert statements(False) == [f'DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_NORMALIZED_INDEX}',
+                                     f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {EMAIL_NORMALIZED_INDEX}',
+                                     'ALTER TABLE "user" ALTER COLUMN email_normalized SET NOT NULL']
+        assert statements(True)[0].startswith('CREATE UNIQUE INDEX CONCURRENTLY')
+
+
+class TestAddUserColumnsMigration(unittest.TestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up a database with a user row from before the newer user columns.
+        '''
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE "user" (id INTEGER PRIMARY KEY, email VARCHAR(75) NOT NULL UNIQUE)'))
+            conn.execute(text('INSERT INTO "user" (email) VALUES (\'one@gmail.com\')'))
+
+    def tearDown(self):
+        '''
+        Disposes of the database.
+        '''
+        self.engine.dispose()
+
+    def test_adds_missing_columns_idempotently(self):
+        '''
+        Missing columns are added with their defaults filled in for existing
+        rows; a second run adds nothing.
+        '''
+        first = add_user_columns(self.engine)
+        second = add_user_columns(self.engine)
+        with self.engine.connect() as conn:
+            row = conn.execute(text('SELECT token_epoch, last_login, last_seen FROM "user"')).first()
+
+        assert first == list(USER_COLUMNS)
+        assert second == []
+        assert tuple(row) == (0, None, None)
@@ -0,0 +1,140 @@
+import unittest
+import uuid
+import json
+import time
+from app import create_app, db, bcrypt, hasher
+from app.hashing import calibrate_rounds, hash_rounds
+from app.models import User
+from config import TestingConfig
+
+
+class PooledHashingConfig(TestingConfig):
+    PASSWORD_HASH_WORKERS = 1
+    PASSWORD_HASH_QUEUE_SIZE = 0
+    PASSWORD_HASH_TIMEOUT = 30
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up an app whose bcrypt work runs in a single-process hashing pool.
+        '''
+        self.app = create_app(PooledHashingConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        '''
+        Shuts the hashing pool down and tears down the db and app context.
+        '''
+        hasher.shutdown()
+        db.drop_all()
+        self.appctx.pop()
+
+    def _signup(self, email):
+        return self.client.post('/api/users/signup',
+                                headers={'Content-Type': 'application/json'},
+                                data=json.dumps({'username': 'Pooled',
+                                                 'email': email,
+                                                 'password': 'pooledpassword'
+                                                 }))
+
+    def test_pooled_hash_and_check(self):
+        '''
+        Hashes produced in the pool verify in the pool, and wrong passwords do not.
+        '''
+        user = User(public_id=str(uuid.uuid4()), username='Pooled', email='pool@gmail.com')
+        user.set_password('pooledpassword')
+        user.save()
+
+        assert user.password.startswith('$2b$')
+        assert user.check_password('pooledpassword')
+        assert not user.check_password('wrongpassword')
+
+    def test_signup_busy_when_queue_full(self):
+        '''
+        With every slot taken, signup answers 503 with Retry-After instead of queueing.
+        '''
+        hasher._slots.acquire()
+        try:
+            response_503 = self._signup('busy@gmail.com')
+        finally:
+            hasher._slots.release()
+
+        response_201 = self._signup('notbusy@gmail.com')
+
+        assert response_503.status_code == 503
+        assert response_503.headers.get('Retry-After') == '1'
+        assert response_503.get_json()['success'] is False
+        assert User.query.filter_by(email='busy@gmail.com').first() is None
+        assert response_201.status_code == 201
+
+    def test_signup_busy_on_timeout(self):
+        '''
+        A hash that does not finish within PASSWORD_HASH_TIMEOUT is reported as busy.
+        '''
+        self.app.config['PASSWORD_HASH_TIMEOUT'] = 1e-6
+        hasher.init_app(self.app)
+
+        response_503 = self._signup('slow@gmail.com')
+
+        assert response_503.status_code == 503
+
+
+class CheapRoundsConfig(TestingConfig):
+    BCRYPT_LOG_ROUNDS = 5
+
+
+class TestBcryptCost(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up an app configured for a cheap bcrypt cost.
+        '''
+        self.app = create_app(CheapRoundsConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        '''
+        Tears down the db and app context.
+        '''
+        db.drop_all()
+        self.appctx.pop()
+
+    def test_calibration_respects_target_and_bounds(self):
+        '''
+        The calibrated cost stays within bounds and hashes within the target.
+        '''
+        generous = calibrate_rounds(bcrypt, target_seconds=0.05, min_rounds=4, max_rounds=8)
+        tiny = calibrate_rounds(bcrypt, target_seconds=1e-9, min_rounds=4, max_rounds=8)
+
+        started = time.perf_counter()
+        bcrypt.generate_password_hash('calibration-password', generous)
+
+        assert 4 <= generous <= 8
+        assert tiny == 4
+        assert time.perf_counter() - started < 0.05 * 4
+
+    def test_login_rehashes_other_cost(self):
+        '''
+        Logging in with a hash stored at another cost rewrites it at the configured cost.
+        '''
+        user = User(public_id=str(uuid.uuid4()), username='Old', email='old@gmail.com',
+                    password=bcrypt.generate_password_hash('oldpassword', 4).decode('utf-8'))
+        user.save()
+
+        response_200 = self.client.post('/api/users/login',
+                                        headers={'Content-Type': 'application/json'},
+                                        data=json.dumps({'email': 'old@gmail.com', 'password': 'oldpassword'}))
+        user = User.query.filter_by(email='old@gmail.com').first()
+
+        assert response_200.status_code == 200
+        assert hash_rounds(user.password) == 5
+        assert not user.needs_rehash()
+        assert user.check_password('oldpassword')
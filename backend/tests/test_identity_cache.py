@@ -0,0 +1,124 @@
+import uuid
+import json
+import time
+import fakeredis
+from flask import current_app
+from flask_jwt_extended import create_access_token, get_csrf_token
+from sqlalchemy import event
+from app import db
+from app.auth.identity import IdentityCache
+from app.models import User
+from tests.base import AppTestCase
+
+
+class TestIdentityCache(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app, db and a logged in user for the authenticated routes.
+        '''
+        super().setUp()
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Cached', email='cached@gmail.com')
+        self.user.set_password('cachedpassword')
+        self.user.save()
+        self.public_id = self.user.public_id
+        current_app.identity_cache.invalidate(self.public_id)
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+        super().tearDown()
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _request(self, method, path, data=None):
+        token = create_access_token(identity=self.public_id)
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.open(path, method=method,
+                                headers={'Content-Type': 'application/json',
+                                         'X-CSRF-TOKEN': get_csrf_token(token)
+                                         },
+                                data=json.dumps(data or {}))
+
+    def test_repeat_lookups_skip_database(self):
+        '''
+        Only the first authenticated request selects the user by public_id.
+        '''
+        self._request('PUT', '/api/users/update', {'username': 'First'})
+        self._request('PUT', '/api/users/update', {'username': 'Second'})
+        response_200 = self._request('PUT', '/api/users/update', {'username': 'Third'})
+
+        lookups = [s for s in self.statements if s.startswith('SELECT') and 'public_id = ?' in s]
+        stats = current_app.identity_cache.stats()
+
+        assert response_200.status_code == 200
+        assert response_200.get_json()['user']['username'] == 'Third'
+        assert len(lookups) == 1
+        assert stats['hits'] == 2
+        assert stats['db_loads'] == 1
+        assert User.query.filter_by(public_id=self.public_id).first().username == 'Third'
+
+    def test_logout_invalidates_rotated_identity(self):
+        '''
+        Rotating public_id on logout drops the cached snapshot of the old identity.
+        '''
+        current_app.identity_cache.get(self.public_id)
+
+        response_200 = self._request('POST', '/api/users/logout')
+        user = User.query.filter_by(email='cached@gmail.com').first()
+
+        assert response_200.status_code == 200
+        assert current_app.identity_cache.get(self.public_id) is None
+        assert current_app.identity_cache.get(user.public_id).email == 'cached@gmail.com'
+
+    def test_redis_layer_shared_between_workers(self):
+        '''
+        A snapshot loaded by one worker is served to another from Redis.
+        '''
+        worker_a = IdentityCache(maxsize=10, ttl=60, redis=current_app.redis_blocklist)
+        worker_b = IdentityCache(maxsize=10, ttl=60, redis=current_app.redis_blocklist)
+
+        worker_a.get(self.public_id)
+        snapshot = worker_b.get(self.public_id)
+
+        assert snapshot.username == 'Cached'
+        assert worker_b.stats()['redis_hits'] == 1
+        assert worker_b.stats()['db_loads'] == 0
+
+        worker_a.invalidate(self.public_id)
+        assert current_app.redis_blocklist.get(f'identity:{self.public_id}') is None
+
+    def test_invalidation_broadcast_to_other_workers(self):
+        '''
+        A public_id invalidated by one worker stops resolving from another
+        worker's local cache as soon as the message arrives.
+        '''
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = (IdentityCache(maxsize=10, ttl=60, broadcast=fakeredis.FakeStrictRedis(server=server),
+                                            channel='identity-invalidations') for _ in range(2))
+        try:
+            assert self._wait_for(lambda: worker_b.get(self.public_id) is not None and worker_b.synced)
+            db.session.query(User).filter_by(public_id=self.public_id).update({'public_id': 'rotated'})
+
+            worker_a.invalidate(self.public_id)
+
+            assert self._wait_for(lambda: worker_b.get(self.public_id) is None)
+        finally:
+            worker_a.stop()
+            worker_b.stop()
+
+    def _wait_for(self, predicate, timeout=3.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.01)
+        return False
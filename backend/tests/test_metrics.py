@@ -0,0 +1,125 @@
+import unittest
+import uuid
+import os
+import json
+import tempfile
+from app import create_app, db
+from app.metrics import Registry, clear_snapshots, mark_process_dead, merge_snapshots, render
+from app.models import User
+from config import TestingConfig
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up an app whose workers publish metrics to a scratch directory.
+        '''
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config_class = type('MetricsConfig', (TestingConfig,), {'METRICS_MULTIPROC_DIR': self.tmpdir.name})
+        self.app = create_app(config_class)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        user.set_password('adminisabadpassword')
+        user.save()
+
+    def tearDown(self):
+        '''
+        Tears down the scratch directory, db and app context.
+        '''
+        db.drop_all()
+        self.appctx.pop()
+        self.tmpdir.cleanup()
+
+    def _count(self, body, prefix):
+        for line in body.splitlines():
+            if line.startswith(prefix):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_routes_and_stages_exposed(self):
+        '''
+        /metrics exposes route latency histograms and bcrypt/sql stage timings.
+        '''
+        self.client.post('/api/users/login',
+                         headers={'Content-Type': 'application/json'},
+                         data=json.dumps({'email': 'admin@gmail.com', 'password': 'adminisabadpassword'}))
+
+        response = self.client.get('/metrics')
+        body = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert self._count(body, 'http_request_duration_seconds_count{method="POST",'
+                                 'route="/api/users/login",status="200"}') >= 1
+        assert self._count(body, 'auth_stage_duration_seconds_count{stage="bcrypt_check"}') >= 1
+        assert self._count(body, 'auth_stage_duration_seconds_count{stage="sql"}') >= 1
+        assert 'identity_cache{stat="hits"}' in body
+
+    def test_snapshots_of_all_workers_are_summed(self):
+        '''
+        A snapshot written by another worker is added to this worker's series.
+        '''
+        other = Registry()
+        other.histogram('http_request_duration_seconds', 'latency', ['method', 'route', 'status']).observe(
+            0.2, method='GET', route='/other', status=200)
+        other.counter('auth_other_total', 'other worker counter').inc(3)
+        with open(os.path.join(self.tmpdir.name, 'metrics_999999.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+
+        body = self.client.get('/metrics').get_data(as_text=True)
+
+        assert self._count(body, 'http_request_duration_seconds_count{method="GET",'
+                                 'route="/other",status="200"}') == 1
+        assert self._count(body, 'http_request_duration_seconds_bucket{method="GET",'
+                                 'route="/other",status="200",le="0.25"}') == 1
+        assert self._count(body, 'auth_other_total') == 3
+
+    def _write_worker(self, pid, count):
+        other = Registry()
+        other.counter('auth_other_total', 'other worker counter').inc(count)
+        other.histogram('latency', 'latency', buckets=(1.0,)).observe(0.5)
+        other.gauge('other_cache', 'other worker gauge', ['stat']).inc(7, stat='size')
+        with open(os.path.join(self.tmpdir.name, f'metrics_{pid}.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+
+    def test_exited_worker_totals_retained(self):
+        '''
+        An exited worker's counters and histograms keep being summed while its
+        gauges are dropped, and a server start clears every snapshot.
+        '''
+        self._write_worker(999998, 3)
+        self._write_worker(999999, 2)
+
+        mark_process_dead(self.tmpdir.name, 999998)
+        mark_process_dead(self.tmpdir.name, 999999)
+        mark_process_dead(self.tmpdir.name, 999999)
+        body = self.client.get('/metrics').get_data(as_text=True)
+        files = sorted(name for name in os.listdir(self.tmpdir.name) if not name.startswith(f'metrics_{os.getpid()}'))
+        clear_snapshots(self.tmpdir.name)
+
+        assert self._count(body, 'auth_other_total') == 5
+        assert self._count(body, 'latency_count') == 2
+        assert 'other_cache' not in body
+        assert files == ['metrics_dead.json']
+        assert os.listdir(self.tmpdir.name) == []
+
+    def test_merge_sums_histograms(self):
+        '''
+        Bucket counts, sums and counts add up across snapshots.
+        '''
+        registry = Registry()
+        histogram = registry.histogram('latency', 'latency', ['route'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, route='/a')
+        histogram.observe(5.0, route='/a')
+
+        body = render(merge_snapshots([registry.snapshot(), registry.snapshot()]))
+
+        assert 'latency_bucket{route="/a",le="0.1"} 2' in body
+        assert 'latency_bucket{route="/a",le="1"} 2' in body
+        assert 'latency_bucket{route="/a",le="+Inf"} 4' in body
+        assert 'latency_count{route="/a"} 4' in body
@@ -0,0 +1,108 @@
+import unittest
+import threading
+import fakeredis
+from redis import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app import create_app
+from app.pools import (InstrumentedBlockingConnectionPool, InstrumentedQueuePool, POOL_TIMEOUTS, engine_options,
+                       pool_sizes, pool_stats, redis_max_connections)
+from config import TestingConfig
+
+
+def _timeouts(pool):
+    return sum(value for key, value in POOL_TIMEOUTS.snapshot() if key == [pool])
+
+
+class TestPoolSizing(unittest.TestCase):
+
+    def _config(self, **overrides):
+        config = {key: getattr(TestingConfig, key) for key in dir(TestingConfig) if key.isupper()}
+        config.update(overrides)
+        return config
+
+    def test_sized_from_threads_within_budget(self):
+        '''
+        Each worker gets a connection per thread plus one, and overflow, unless
+        WEB_CONCURRENCY workers would exceed DATABASE_MAX_CONNECTIONS.
+        '''
+        unbounded = pool_sizes(self._config(WORKER_THREADS=4))
+        budgeted = pool_sizes(self._config(WORKER_THREADS=4, WEB_CONCURRENCY=8, DATABASE_MAX_CONNECTIONS=40))
+
+        assert unbounded == (5, 4)
+        assert budgeted == (5, 0)
+
+    def test_redis_pool_adds_listener_connections(self):
+        '''
+        The REDIS_URL pool reserves a connection per enabled pub/sub listener on
+        top of one per thread and a spare; shard node pools and explicit
+        REDIS_MAX_CONNECTIONS do not.
+        '''
+        both = self._config(WORKER_THREADS=4, REVOCATION_CACHE_ENABLED=True, IDENTITY_CACHE_BROADCAST=True)
+        neither = self._config(WORKER_THREADS=4, REVOCATION_CACHE_ENABLED=False, IDENTITY_CACHE_BROADCAST=False)
+
+        assert redis_max_connections(both) == 7
+        assert redis_max_connections(neither) == 5
+        assert redis_max_connections(both, 'redis://blocklist-a:6379/0') == 5
+        assert redis_max_connections(dict(both, REDIS_MAX_CONNECTIONS=3)) == 3
+
+    def test_engine_options_skip_sqlite(self):
+        '''
+        SQLite keeps its own pools; server databases get the sized, pre-pinging pool.
+        '''
+        sqlite = engine_options(self._config())
+        postgres = engine_options(self._config(SQLALCHEMY_DATABASE_URI='postgresql://localhost/auth'))
+
+        assert sqlite == {}
+        assert postgres['poolclass'] is InstrumentedQueuePool
+        assert postgres['pool_pre_ping'] is True
+        assert postgres['connect_args'] == {'connect_timeout': TestingConfig.DATABASE_CONNECT_TIMEOUT}
+
+
+class TestInstrumentedPools(unittest.TestCase):
+
+    def test_database_checkout_timeout_counted(self):
+        '''
+        A checkout waiting past pool_timeout on a saturated pool is counted.
+        '''
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0,
+                               pool_timeout=0.05)
+        before = _timeouts('database')
+
+        held = engine.connect()
+        try:
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+        finally:
+            held.close()
+
+        assert _timeouts('database') == before + 1
+
+    def test_redis_pool_blocks_and_reports(self):
+        '''
+        The Redis pool never exceeds max_connections: callers wait for a free
+        connection, time out when none frees up, and the state is reported.
+        '''
+        pool = InstrumentedBlockingConnectionPool(max_connections=1, timeout=0.05,
+                                                  connection_class=fakeredis.FakeConnection,
+                                                  server=fakeredis.FakeServer())
+        client = Redis(connection_pool=pool)
+        app = create_app(TestingConfig)
+        app.redis_blocklist = client
+        before = _timeouts('redis')
+
+        client.set('key', 1)
+        held = pool.get_connection('get')
+        with self.assertRaises(RedisConnectionError):
+            client.get('key')
+        saturated = pool_stats(app)
+
+        threading.Timer(0.01, pool.release, [held]).start()
+        pool.timeout = 1
+        value = client.get('key')
+
+        assert _timeouts('redis') == before + 1
+        assert saturated[('redis', 'in_use')] == 1
+        assert saturated[('redis', 'capacity')] == 1
+        assert value == b'1'
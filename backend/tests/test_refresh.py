@@ -0,0 +1,108 @@
+import uuid
+import json
+from datetime import timedelta
+from flask_jwt_extended import create_access_token, get_csrf_token
+from app.models import User
+from config import TestingConfig
+from tests.base import AppTestCase
+
+
+class ExplicitRefreshConfig(TestingConfig):
+    JWT_REFRESH_MODE = 'explicit'
+
+
+class RefreshTestCase(AppTestCase):
+
+    def setUp(self):
+        '''
+        Sets up the app, db and a user to authenticate as.
+        '''
+        super().setUp()
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        self.user.set_password('adminisabadpassword')
+        self.user.save()
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _access_cookies_set(self, response):
+        return [c for c in response.headers.getlist('Set-Cookie') if c.startswith('access_token_cookie=')]
+
+
+class TestImplicitRefresh(RefreshTestCase):
+
+    def _update(self, token):
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.put('/api/users/update',
+                               headers={'Content-Type': 'application/json',
+                                        'X-CSRF-TOKEN': get_csrf_token(token)
+                                        },
+                               data=json.dumps({'username': 'Changed'}))
+
+    def test_expiring_token_reissued_once(self):
+        '''
+        A token past half its TTL is re-issued on the first request only.
+        '''
+        token = create_access_token(identity=self.user.public_id, expires_delta=timedelta(minutes=5))
+
+        first = self._update(token)
+        second = self._update(token)
+
+        assert first.status_code == 200
+        assert len(self._access_cookies_set(first)) == 1
+        assert second.status_code == 200
+        assert not self._access_cookies_set(second)
+
+    def test_fresh_token_not_reissued(self):
+        '''
+        A token within the first half of its TTL is left alone.
+        '''
+        response = self._update(create_access_token(identity=self.user.public_id))
+
+        assert response.status_code == 200
+        assert not self._access_cookies_set(response)
+
+    def test_unprotected_route_not_refreshed(self):
+        '''
+        An access cookie sent to a route that never verified it is not re-issued.
+        '''
+        token = create_access_token(identity=self.user.public_id, expires_delta=timedelta(minutes=5))
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+
+        response = self.client.post('/api/users/signup',
+                                    headers={'Content-Type': 'application/json'},
+                                    data=json.dumps({'username': 'Testing',
+                                                     'email': 'testing@gmail.com',
+                                                     'password': 'badpassword'}))
+
+        assert response.status_code == 201
+        assert not self._access_cookies_set(response)
+
+
+class TestExplicitRefresh(RefreshTestCase):
+    config_class = ExplicitRefreshConfig
+
+    def test_login_issues_refresh_cookie_for_refresh_endpoint(self):
+        '''
+        Login sets a refresh cookie that /api/users/refresh exchanges for a new
+        access cookie; no implicit re-issue happens.
+        '''
+        login = self.client.post('/api/users/login',
+                                 headers={'Content-Type': 'application/json'},
+                                 data=json.dumps({'email': 'admin@gmail.com',
+                                                  'password': 'adminisabadpassword'}))
+        csrf = next(c.value for c in self.client.cookie_jar if c.name == 'csrf_refresh_token')
+
+        response_200 = self.client.post('/api/users/refresh', headers={'X-CSRF-TOKEN': csrf})
+        response_401 = self.app.test_client().post('/api/users/refresh')
+
+        assert login.status_code == 200
+        assert any(c.startswith('refresh_token_cookie=') for c in login.headers.getlist('Set-Cookie'))
+        assert response_200.status_code == 200
+        assert len(self._access_cookies_set(response_200)) == 1
+        assert response_401.status_code == 401
+        assert not hasattr(self.app, 'refresh_coalescer')
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+import json
+from app import create_app, db, bcrypt
+from app.models import User
+from config import TestingConfig
+
+
+class ReplicaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up an app on a primary and one replica sqlite file, each with the
+        schema. Rows are copied by hand to stand in for replication.
+        '''
+        self.tmp = tempfile.mkdtemp(prefix='auth-replicas-')
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(self.tmp, "primary.db")}'
+            SQLALCHEMY_REPLICA_URIS = [f'sqlite:///{os.path.join(self.tmp, "replica.db")}']
+            REPLICA_STICKY_SECONDS = 0.5
+
+        self.app = create_app(ReplicaConfig)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            self.replica = db.get_engine(self.app, bind='replica_0')
+            db.metadata.create_all(bind=self.replica)
+
+    def tearDown(self):
+        '''
+        Drops the databases and their directory.
+        '''
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.metadata.drop_all(bind=self.replica)
+        shutil.rmtree(self.tmp)
+
+    def _replicate(self, email):
+        with self.app.app_context():
+            row = db.engine.execute(User.__table__.select().where(User.__table__.c.email == email)).first()
+            self.replica.execute(User.__table__.insert().values(**row._mapping))
+
+    def _login(self, email, password):
+        return self.client.post('/api/users/login',
+                                headers={'Content-Type': 'application/json'},
+                                data=json.dumps({'email': email, 'password': password}))
+
+
+class TestReplicaRouting(ReplicaTestCase):
+
+    def test_reads_use_replica(self):
+        '''
+        Logins read from the replica: a user only the replica has can log in.
+        '''
+        with self.app.app_context():
+            self.replica.execute(User.__table__.insert().values(
+                public_id=str(uuid.uuid4()), username='Replica', email='replica@gmail.com',
+                password=bcrypt.generate_password_hash('replicapassword').decode('utf-8')))
+
+        response_200 = self._login('replica@gmail.com', 'replicapassword')
+
+        assert response_200.status_code == 200
+
+    def test_read_your_writes_within_window(self):
+        '''
+        A user who just signed up reads the primary until the window closes,
+        then the (lagging) replica again.
+        '''
+        signup = self.client.post('/api/users/signup',
+                                  headers={'Content-Type': 'application/json'},
+                                  data=json.dumps({'username': 'Fresh',
+                                                   'email': 'fresh@gmail.com',
+                                                   'password': 'freshpassword'}))
+        response_200 = self._login('fresh@gmail.com', 'freshpassword')
+
+        time.sleep(0.6)
+        response_401 = self._login('fresh@gmail.com', 'freshpassword')
+        self._replicate('fresh@gmail.com')
+        response_replicated = self._login('fresh@gmail.com', 'freshpassword')
+
+        assert signup.status_code == 201
+        assert response_200.status_code == 200
+        assert response_401.status_code == 401
+        assert response_replicated.status_code == 200
+
+    def test_writes_go_to_primary(self):
+        '''
+        User.save() writes the primary, and re-reads in the same request do not
+        go back to the replica.
+        '''
+        with self.app.app_context():
+            user = User(public_id=str(uuid.uuid4()), username='Primary', email='primary@gmail.com')
+            user.set_password('primarypassword')
+            user.save()
+
+            assert user.username == 'Primary'
+            assert db.engine.execute(User.__table__.select()).first() is not None
+            assert self.replica.execute(User.__table__.select()).first() is None
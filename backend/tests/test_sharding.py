@@ -0,0 +1,170 @@
+import unittest
+import time
+import uuid
+import fakeredis
+from flask import current_app
+from flask_jwt_extended import create_access_token, get_csrf_token, get_jti
+from app.auth.blocklist import KeyStore
+from app.auth.sharding import HashRing, ShardedStore
+from app.models import User
+from config import TestingConfig
+from tests.base import AppTestCase
+
+
+class ShardedConfig(TestingConfig):
+    REDIS_BLOCKLIST_URLS = ['redis://blocklist-a:6379/0', 'redis://blocklist-b:6379/0', 'redis://blocklist-c:6379/0']
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        '''
+        Keys spread evenly, and a fourth node takes about a quarter of them
+        without moving any between the original three.
+        '''
+        keys = [str(uuid.uuid4()) for _ in range(10000)]
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+
+        owners = [before.node_for(key) for key in keys]
+        moved = [(old, after.node_for(key)) for key, old in zip(keys, owners) if after.node_for(key) != old]
+
+        assert all(2500 < owners.count(node) < 4200 for node in 'abc')
+        assert all(new == 'd' for _, new in moved)
+        assert 1500 < len(moved) < 3500
+
+    def test_nodes_for_yields_each_node_once(self):
+        '''
+        The fallback order visits every node exactly once, owner first.
+        '''
+        ring = HashRing(['a', 'b', 'c'])
+        nodes = list(ring.nodes_for('some-jti'))
+
+        assert sorted(nodes) == ['a', 'b', 'c']
+        assert nodes[0] == ring.node_for('some-jti')
+
+
+class TestShardedStore(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up a store over three fake Redis servers.
+        '''
+        self.servers = {name: fakeredis.FakeServer() for name in 'abc'}
+        self.store = ShardedStore({name: KeyStore(fakeredis.FakeStrictRedis(server=server), 900)
+                                   for name, server in self.servers.items()}, retry_interval=60)
+        self.jti = str(uuid.uuid4())
+        self.owner, self.fallback, _ = self.store.ring.nodes_for(self.jti)
+
+    def _recover(self, node):
+        self.servers[node].connected = True
+        self.store._down_until[node] = 0
+
+    def test_jtis_stored_on_their_owner_only(self):
+        '''
+        A revocation lands on the node the ring assigns and is found there.
+        '''
+        self.store.add(self.jti, time.time() + 900)
+
+        holders = [name for name, store in self.store.stores.items() if store.contains(self.jti)]
+
+        assert holders == [self.owner]
+        assert self.store.contains(self.jti, None)
+        assert not self.store.contains(str(uuid.uuid4()), None)
+
+    def test_down_node_hands_off_to_next_node(self):
+        '''
+        With its owner unreachable a revocation goes to the next node, stays
+        visible after the owner recovers, and the failure shows in stats.
+        '''
+        self.servers[self.owner].connected = False
+
+        self.store.add(self.jti, time.time() + 900)
+        revoked_while_down = self.store.contains(self.jti, None)
+        stats = self.store.stats()
+        self._recover(self.owner)
+
+        assert self.store.stores[self.fallback].contains(self.jti)
+        assert revoked_while_down
+        assert self.store.contains(self.jti, None)
+        assert stats[(self.owner, 'up')] == 0
+        assert stats[(self.owner, 'errors')] == 1
+        assert stats[(self.fallback, 'up')] == 1
+
+    def test_handoff_written_back_for_other_workers(self):
+        '''
+        A worker that never saw the owner fail finds a handed-off revocation
+        once the worker that handed it off has written it back to the owner.
+        '''
+        other = ShardedStore({name: KeyStore(fakeredis.FakeStrictRedis(server=server), 900)
+                              for name, server in self.servers.items()}, retry_interval=60)
+        self.servers[self.owner].connected = False
+        self.store.add(self.jti, time.time() + 900)
+        self._recover(self.owner)
+
+        missed_before_replay = other.contains(self.jti, None)
+        hints = self.store.stats()[(self.owner, 'hints')]
+        self.store.contains(self.jti, None)
+
+        assert not missed_before_replay
+        assert hints == 1
+        assert self.store.stores[self.owner].contains(self.jti)
+        assert other.contains(self.jti, None)
+        assert self.store.stats()[(self.owner, 'hints')] == 0
+
+    def test_fail_closed_while_owner_down(self):
+        '''
+        With fail_open off, tokens owned by an unreachable node count as revoked.
+        '''
+        self.store.fail_open = False
+        self.servers[self.owner].connected = False
+
+        assert self.store.contains(self.jti, None)
+
+
+class TestShardedBlocklist(AppTestCase):
+    config_class = ShardedConfig
+
+
+    def setUp(self):
+        '''
+        Sets up the app with the blocklist sharded over three nodes, and a user.
+        '''
+        super().setUp()
+
+        User.register(public_id=str(uuid.uuid4()), username='Admin',
+                      email='admin@gmail.com', password='adminisabadpassword')
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _post_logout(self, token):
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.post('/api/users/logout', headers={'X-CSRF-TOKEN': get_csrf_token(token)})
+
+    def test_logout_revokes_on_owning_node(self):
+        '''
+        Logout writes the jti to its node only, and the token is then refused.
+        '''
+        user = User.query.filter_by(email='admin@gmail.com').first()
+        token = create_access_token(identity=user.public_id)
+        jti = get_jti(token)
+
+        response_200 = self._post_logout(token)
+        response_401 = self._post_logout(token)
+
+        owner = current_app.blocklist.store.ring.node_for(jti)
+        holders = [node for node, client in current_app.blocklist_nodes.items() if client.get(KeyStore.key(jti)) is not None]
+        body = self.client.get('/metrics').get_data(as_text=True)
+
+        assert response_200.status_code == 200
+        assert response_401.status_code == 401
+        assert sorted(current_app.blocklist_nodes) == ['blocklist-a:6379/0', 'blocklist-b:6379/0',
+                                                       'blocklist-c:6379/0']
+        assert holders == [owner]
+        assert current_app.blocklist.is_revoked(jti)
+        assert current_app.redis_blocklist.get(KeyStore.key(jti)) is None
+        assert f'blocklist_nodes{{node="{owner}",stat="up"}} 1' in body
@@ -0,0 +1,60 @@
+import uuid
+from unittest import mock
+from sqlalchemy import event
+from app import db, hasher
+from app.models import User
+from tests.base import AppTestCase
+
+
+class TestRegister(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app and db with one existing user.
+        '''
+        super().setUp()
+
+        User.register(public_id=str(uuid.uuid4()), username='Admin',
+                      email='admin@gmail.com', password='adminisabadpassword')
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+        super().tearDown()
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        # Savepoints belong to the test's rolled back transaction, not the code under test
+        if 'SAVEPOINT' not in statement:
+            self.statements.append(statement)
+
+    def test_duplicate_email_costs_one_statement_and_no_hash(self):
+        '''
+        A taken email is detected by the insert itself, before any bcrypt work.
+        '''
+        with mock.patch.object(hasher, 'generate_password_hash') as generate:
+            created = User.register(public_id=str(uuid.uuid4()), username='Again',
+                                    email='admin@gmail.com', password='anotherpassword')
+
+        assert created is False
+        assert not generate.called
+        assert len(self.statements) == 1
+        assert 'ON CONFLICT DO NOTHING' in self.statements[0]
+        assert User.query.filter_by(email='admin@gmail.com').first().username == 'Admin'
+
+    def test_new_user_stored_with_hash(self):
+        '''
+        A new email is inserted and committed with its bcrypt hash filled in.
+        '''
+        created = User.register(public_id=str(uuid.uuid4()), username='Testing',
+                                email='testing@gmail.com', password='badpassword')
+        user = User.query.filter_by(email='testing@gmail.com').first()
+
+        assert created is True
+        assert user.password.startswith('$2b$')
+        assert user.check_password('badpassword')
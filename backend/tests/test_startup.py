@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import unittest
+from app import create_app, db, hasher
+from app.startup import PHASES, reset_after_fork
+from config import TestingConfig
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Sets up the app and app context.
+        '''
+        self.app = create_app(TestingConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+
+    def tearDown(self):
+        '''
+        Tears down the app context.
+        '''
+        self.appctx.pop()
+
+    def test_forked_child_gets_fresh_connections(self):
+        '''
+        A child forked after the app was built (gunicorn --preload) opens its
+        own database connection instead of the inherited one, and the post_fork
+        reset drops the bcrypt executor; the parent keeps both.
+        '''
+        db.session.execute('SELECT 1')
+        db.session.remove()
+        parent_connection = db.engine.raw_connection()
+        parent_dbapi = parent_connection.connection
+        parent_connection.close()
+        hasher._pool = parent_executor = object()
+
+        read_fd, write_fd = os.pipe()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                child_connection = db.engine.raw_connection()
+                reset_after_fork()
+                fresh = child_connection.connection is not parent_dbapi and hasher._pool is None
+                os.write(write_fd, b'1' if fresh else b'0')
+                os._exit(0)
+
+            os.waitpid(pid, 0)
+            child_fresh = os.read(read_fd, 1)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+        parent_connection = db.engine.raw_connection()
+        try:
+            assert child_fresh == b'1'
+            assert hasher._pool is parent_executor
+            assert parent_connection.connection is parent_dbapi
+        finally:
+            parent_connection.close()
+            hasher._pool = None
+
+    def test_phases_reported(self):
+        '''
+        Import and create_app times are recorded and exported on /metrics.
+        '''
+        body = self.app.test_client().get('/metrics').get_data(as_text=True)
+
+        assert PHASES['import'] > 0
+        assert PHASES['create_app'] > 0
+        assert 'startup_phase_seconds{phase="create_app"}' in body
+
+    def test_docs_can_be_disabled(self):
+        '''
+        With API_DOCS_ENABLED off neither Swagger UI nor swagger.json is served.
+        '''
+        class NoDocsConfig(TestingConfig):
+            API_DOCS_ENABLED = False
+
+        response_200 = self.app.test_client().get('/swagger.json')
+        response_404 = create_app(NoDocsConfig).test_client().get('/swagger.json')
+
+        assert response_200.status_code == 200
+        assert response_404.status_code == 404
+
+    def test_fakeredis_only_imported_for_testing(self):
+        '''
+        A non-testing app is built without importing fakeredis.
+        '''
+        script = ('import sys\n'
+                  'from app import create_app\n'
+                  'from config import DevelopmentConfig\n'
+                  'create_app(DevelopmentConfig)\n'
+                  'sys.exit("fakeredis" in sys.modules)\n')
+        env = {**os.environ, 'REDIS_URL': 'redis://localhost:6379/0', 'SQLALCHEMY_DATABASE_URI': 'sqlite://'}
+
+        result = subprocess.run([sys.executable, '-c', script], env=env,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        assert result.returncode == 0
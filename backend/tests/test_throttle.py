@@ -0,0 +1,120 @@
+import unittest
+import uuid
+import json
+import importlib.util
+from unittest import mock
+import fakeredis
+from app import hasher
+from app.auth.throttle import LoginThrottle, THROTTLED, client_address
+from app.models import User
+from config import TestingConfig
+from tests.base import AppTestCase
+
+
+class ThrottleConfig(TestingConfig):
+    LOGIN_THROTTLE_EMAIL_BURST = 3
+    LOGIN_THROTTLE_EMAIL_PER_MINUTE = 1
+    LOGIN_THROTTLE_IP_BURST = 5
+    LOGIN_THROTTLE_IP_PER_MINUTE = 1
+    TRUSTED_PROXIES = 1
+
+
+class TestLoginThrottle(AppTestCase):
+    config_class = ThrottleConfig
+
+
+    def setUp(self):
+        '''
+        Sets up an app with small login buckets and one user.
+        '''
+        super().setUp()
+
+        user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        user.set_password('adminisabadpassword')
+        user.save()
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _login(self, email, password='WRONGPASSWORD', ip='10.0.0.1'):
+        return self.client.post('/api/users/login',
+                                data=json.dumps({'email': email, 'password': password}),
+                                headers={'Content-Type': 'application/json', 'X-Forwarded-For': ip})
+
+    def test_email_bucket_rejects_before_bcrypt(self):
+        '''
+        Attempts beyond the email burst get a 429 without a bcrypt check, and
+        other IPs are limited on the same email too.
+        '''
+        allowed = [self._login('admin@gmail.com', ip=f'10.0.0.{i}').status_code for i in range(3)]
+
+        with mock.patch.object(hasher, 'check_password_hash') as check:
+            response_429 = self._login('Admin@gmail.com', 'adminisabadpassword', ip='10.0.0.99')
+
+        assert allowed == [403, 403, 403]
+        assert response_429.status_code == 429
+        assert int(response_429.headers['Retry-After']) >= 1
+        assert not check.called
+
+    def test_ip_bucket_rejects_many_emails(self):
+        '''
+        One IP cycling through emails is limited by the IP bucket.
+        '''
+        before = THROTTLED.snapshot()
+        statuses = [self._login(f'user{i}@gmail.com').status_code for i in range(6)]
+
+        assert statuses == [401] * 5 + [429]
+        assert dict((tuple(k), v) for k, v in THROTTLED.snapshot())[('ip',)] == \
+            dict((tuple(k), v) for k, v in before).get(('ip',), 0) + 1
+
+    def test_ip_bucket_uses_peer_without_trusted_proxies(self):
+        '''
+        Without a trusted proxy the IP bucket keys on the peer address, so a
+        spoofed X-Forwarded-For does not escape it.
+        '''
+        self.app.config['TRUSTED_PROXIES'] = 0
+        try:
+            statuses = [self._login(f'user{i}@gmail.com', ip=f'10.0.0.{i}').status_code for i in range(6)]
+        finally:
+            self.app.config['TRUSTED_PROXIES'] = 1
+
+        assert statuses == [401] * 5 + [429]
+
+    def test_client_address(self):
+        '''
+        The client is read as many hops from the right as there are trusted
+        proxies, or is the peer when none are.
+        '''
+        assert client_address('10.9.9.9', '6.6.6.6, 10.0.0.1', 1) == '10.0.0.1'
+        assert client_address('10.9.9.9', '6.6.6.6, 10.0.0.1', 2) == '6.6.6.6'
+        assert client_address('10.9.9.9', '10.0.0.1', 2) is None
+        assert client_address('10.9.9.9', '10.0.0.1', 0) == '10.9.9.9'
+        assert client_address('10.9.9.9', None, 1) is None
+
+    def _assert_bucket(self, throttle):
+        decisions = [throttle.check('same@gmail.com', '10.1.1.1') for _ in range(3)]
+
+        assert decisions[:2] == [0, 0]
+        assert 0 < decisions[2] <= 60
+
+    def test_transaction_path(self):
+        '''
+        The WATCH/MULTI fallback used without Lua support enforces the bucket.
+        '''
+        throttle = LoginThrottle(fakeredis.FakeStrictRedis(), 2, 1, 10, 1)
+        throttle._scripting = False
+
+        self._assert_bucket(throttle)
+
+    @unittest.skipIf(importlib.util.find_spec('lupa') is None, 'fakeredis needs lupa for Lua scripting')
+    def test_script_path(self):
+        '''
+        The Lua script enforces the bucket atomically.
+        '''
+        throttle = LoginThrottle(fakeredis.FakeStrictRedis(), 2, 1, 10, 1)
+
+        self._assert_bucket(throttle)
+        assert throttle._scripting
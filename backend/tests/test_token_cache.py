@@ -0,0 +1,99 @@
+import uuid
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+import jwt
+from flask_jwt_extended import JWTManager, create_access_token, get_csrf_token
+from app.models import User
+from tests.base import AppTestCase
+
+
+class TestTokenCache(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app, db and a user to authenticate as.
+        '''
+        super().setUp()
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        self.user.set_password('adminisabadpassword')
+        self.user.save()
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _update(self, token, csrf=None):
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.put('/api/users/update',
+                               headers={'Content-Type': 'application/json',
+                                        'X-CSRF-TOKEN': csrf or get_csrf_token(token)
+                                        },
+                               data=json.dumps({'username': 'Changed'}))
+
+    def test_repeat_requests_verify_once(self):
+        '''
+        A token is fully verified on first use and served from the cache after.
+        '''
+        token = create_access_token(identity=self.user.public_id)
+        csrf = jwt.decode(token, options={'verify_signature': False})['csrf']
+
+        with mock.patch.object(JWTManager, '_decode_jwt_from_config', autospec=True,
+                               side_effect=JWTManager._decode_jwt_from_config) as decode:
+            statuses = [self._update(token, csrf).status_code for _ in range(3)]
+
+        assert statuses == [200, 200, 200]
+        assert decode.call_count == 1
+        assert self.app.token_cache.stats()['hits'] == 2
+
+    def test_cached_token_still_checks_csrf(self):
+        '''
+        A cached token with the wrong CSRF header is rejected.
+        '''
+        token = create_access_token(identity=self.user.public_id)
+
+        response_200 = self._update(token)
+        response_401 = self._update(token, csrf='not-the-csrf-token')
+
+        assert response_200.status_code == 200
+        assert response_401.status_code == 401
+
+    def test_logout_evicts_token(self):
+        '''
+        Logging out drops the token from the cache and later uses are rejected.
+        '''
+        token = create_access_token(identity=self.user.public_id)
+        self._update(token)
+        assert self.app.token_cache.get(token) is not None
+
+        response_200 = self.client.post('/api/users/logout',
+                                        headers={'Content-Type': 'application/json',
+                                                 'X-CSRF-TOKEN': get_csrf_token(token)})
+        response_401 = self._update(token)
+
+        assert response_200.status_code == 200
+        assert self.app.token_cache.get(token) is None
+        assert response_401.status_code == 401
+
+    def test_expired_token_not_served_from_cache(self):
+        '''
+        Entries only live until the token's exp, so an expired token is rejected.
+        '''
+        token = create_access_token(identity=self.user.public_id, expires_delta=timedelta(seconds=1))
+        csrf = get_csrf_token(token)
+
+        response_200 = self._update(token, csrf)
+        # PyJWT compares exp against whole seconds
+        time.sleep(2.1)
+        # Drop the sliding-session cookie re-issued with the first response
+        self.client = self.app.test_client()
+        response_401 = self._update(token, csrf)
+
+        assert response_200.status_code == 200
+        assert response_401.status_code == 401
+        assert response_401.get_json()['msg'] == 'Token has expired'
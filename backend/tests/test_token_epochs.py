@@ -0,0 +1,97 @@
+import uuid
+import json
+from flask import current_app
+from flask_jwt_extended import create_access_token, decode_token, get_csrf_token
+from app.models import User
+from config import TestingConfig
+from tests.base import AppTestCase
+
+
+class EpochConfig(TestingConfig):
+    JWT_REVOCATION_MODE = 'epoch'
+
+
+class TestTokenEpochs(AppTestCase):
+    config_class = EpochConfig
+
+
+    def setUp(self):
+        '''
+        Sets up an app running in epoch revocation mode with one user.
+        '''
+        super().setUp()
+
+        self.user = User(public_id=str(uuid.uuid4()), username='Epoch', email='epoch@gmail.com')
+        self.user.set_password('epochpassword')
+        self.user.save()
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _put_update(self, token):
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.put('/api/users/update',
+                               headers={'Content-Type': 'application/json',
+                                        'X-CSRF-TOKEN': get_csrf_token(token)
+                                        },
+                               data=json.dumps({'username': 'Changed'}))
+
+    def _post_logout(self, token):
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        return self.client.post('/api/users/logout',
+                                headers={'X-CSRF-TOKEN': get_csrf_token(token)})
+
+    def test_tokens_carry_epoch_claim(self):
+        '''
+        Tokens minted by create_access_token embed the user's current epoch.
+        '''
+        token = create_access_token(identity=self.user.public_id)
+
+        assert decode_token(token)['epoch'] == 0
+
+    def test_logout_revokes_every_token_of_user(self):
+        '''
+        Logging out bumps the epoch, rejecting all older tokens without blocklist
+        entries or a public_id rotation.
+        '''
+        public_id = self.user.public_id
+        token_a = create_access_token(identity=public_id)
+        token_b = create_access_token(identity=public_id)
+
+        response_logout = self._post_logout(token_a)
+        response_revoked = self._put_update(token_b)
+        response_200 = self._put_update(create_access_token(identity=public_id))
+
+        assert response_logout.status_code == 200
+        assert response_revoked.status_code == 401
+        assert response_200.status_code == 200
+        assert User.query.filter_by(email='epoch@gmail.com').first().public_id == public_id
+        assert current_app.redis_blocklist.dbsize() == 1
+
+    def test_new_tokens_ignore_stale_cached_epoch(self):
+        '''
+        A logout on another worker is not yet in this worker's cache, yet a
+        token minted here afterwards carries the new epoch and is accepted.
+        '''
+        current_app.token_epochs.current(self.user.public_id)
+        current_app.redis_blocklist.set(f'token_epoch:{self.user.public_id}', 1)
+
+        token = create_access_token(identity=self.user.public_id)
+        response_200 = self._put_update(token)
+
+        assert decode_token(token)['epoch'] == 1
+        assert response_200.status_code == 200
+
+    def test_epoch_falls_back_to_database(self):
+        '''
+        If Redis loses the epoch, the value persisted on the User row is used.
+        '''
+        current_app.token_epochs.bump(self.user)
+        current_app.redis_blocklist.flushall()
+        current_app.token_epochs.clear()
+
+        assert current_app.token_epochs.current(self.user.public_id) == 1
+        assert int(current_app.redis_blocklist.get(f'token_epoch:{self.user.public_id}')) == 1
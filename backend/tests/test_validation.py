@@ -0,0 +1,76 @@
+import uuid
+import json
+from flask_jwt_extended import create_access_token, get_csrf_token
+from werkzeug.exceptions import BadRequest
+from app import create_app
+from app.auth import validation
+from app.auth.routes import signup_user_model
+from app.models import User
+from config import TestingConfig
+from tests.base import AppTestCase
+
+
+class TestPayloadValidation(AppTestCase):
+
+
+    def setUp(self):
+        '''
+        Sets up the app, db and test client.
+        '''
+        super().setUp()
+
+    def tearDown(self):
+        '''
+        Rolls back the test's writes and tears down the app context.
+        '''
+        super().tearDown()
+
+    def _post(self, path, data):
+        return self.client.post(path, headers={'Content-Type': 'application/json'}, data=json.dumps(data))
+
+    def test_errors_match_flask_restx(self):
+        '''
+        Invalid signups get the same 400 body flask-restx validation produces.
+        '''
+        data = {'username': 'ab', 'password': 'short'}
+
+        response_400 = self._post('/api/users/signup', data)
+        try:
+            signup_user_model.validate(data)
+        except BadRequest as e:
+            expected = e.data
+
+        assert response_400.status_code == 400
+        assert response_400.get_json()['message'] == 'Input payload validation failed'
+        assert response_400.get_json()['errors'] == expected['errors']
+        assert set(expected['errors']) == {'username', 'email', 'password'}
+
+    def test_validators_compiled_once(self):
+        '''
+        Validators are compiled at app creation and reused by later apps.
+        '''
+        compiled = dict(validation._validators)
+        create_app(TestingConfig)
+
+        assert len(compiled) == 3
+        assert all(validation._validators[key] is validator for key, validator in compiled.items())
+
+    def test_update_is_validated_but_partial(self):
+        '''
+        UpdateUser rejects invalid fields but accepts a subset of them.
+        '''
+        user = User(public_id=str(uuid.uuid4()), username='Admin', email='admin@gmail.com')
+        user.set_password('adminisabadpassword')
+        user.save()
+
+        token = create_access_token(identity=user.public_id)
+        self.client.set_cookie('localhost', 'access_token_cookie', token, httponly=True)
+        headers = {'Content-Type': 'application/json', 'X-CSRF-TOKEN': get_csrf_token(token)}
+
+        response_400 = self.client.put('/api/users/update', headers=headers, data=json.dumps({'username': 'ab'}))
+        response_200 = self.client.put('/api/users/update', headers=headers, data=json.dumps({'email': 'new@gmail.com'}))
+
+        assert response_400.status_code == 400
+        assert 'username' in response_400.get_json()['errors']
+        assert response_200.status_code == 200
+        assert response_200.get_json()['user']['email'] == 'new@gmail.com'
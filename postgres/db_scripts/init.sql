@@ -7,16 +7,21 @@ CREATE TABLE "user" (
 	email VARCHAR(75) NOT NULL, 
 	password VARCHAR(60) NOT NULL, 
 	date_joined TIMESTAMP, 
+	token_epoch INTEGER DEFAULT 0 NOT NULL, 
+	last_login TIMESTAMP WITH TIME ZONE, 
+	last_seen TIMESTAMP WITH TIME ZONE, 
+	email_normalized VARCHAR(75) NOT NULL, 
 	UNIQUE (username), 
 	UNIQUE (email)
 );
 
 CREATE UNIQUE INDEX ix_user_public_id ON "user" (public_id);
 CREATE UNIQUE INDEX ix_user_email ON "user" (email);
+CREATE UNIQUE INDEX ix_user_email_normalized ON "user" (email_normalized);
 
 
 /*Insert row, sync the primary key*/
-INSERT INTO "user" VALUES(1,'9edcf16e-9391-4096-ab3f-a8b2017e64f8','testing','testing@gmail.com','$2b$12$k.HNKyENLhodcyqUBu5XteuKOlNmQLrcsWoy45prpC/kb8zSFOwJS','2022-01-21 03:29:10.899459');
+INSERT INTO "user" VALUES(1,'9edcf16e-9391-4096-ab3f-a8b2017e64f8','testing','testing@gmail.com','$2b$12$k.HNKyENLhodcyqUBu5XteuKOlNmQLrcsWoy45prpC/kb8zSFOwJS','2022-01-21 03:29:10.899459',0,NULL,NULL,'testing@gmail.com');
 SELECT setval('user_id_seq', (SELECT MAX(id) FROM "user"));
 
 COMMIT;